@@ -1,6 +1,7 @@
 __version__ = "0.3.1"
 from apx.base import *
 from apx.vm_base import *
+from apx.codec import *
 from apx.node import *
 from apx.file import *
 from apx.file_map import *
@@ -10,7 +11,10 @@ from apx.parser import Parser
 from apx.context import *
 from apx.client import *
 from apx.compiler import *
+from apx.vm_profiler import *
 from apx.vm import *
+import apx.numpy_dtype
+import apx.node_cache
 from apx.generator import NodeGenerator, ComGenerator
 from apx.tester import *
 
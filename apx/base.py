@@ -121,8 +121,11 @@ class Port:
    def __init__(self, portType, name, dataSignature, attributes=None):
       self.portType = portType    #string containing 'P' for provide port or 'R' for require port
       self.name = name            #name of the port
-      self.dsg = DataSignature(dataSignature)
-      self.attr = PortAttribute(attributes) if attributes is not None else None
+      self.dsg = dataSignature if isinstance(dataSignature, DataSignature) else DataSignature(dataSignature)
+      if attributes is None or isinstance(attributes, PortAttribute):
+         self.attr = attributes
+      else:
+         self.attr = PortAttribute(attributes)
       self.id = None
 
    def __str__(self):
@@ -236,26 +239,7 @@ class DataSignature:
       return self.dataElement.to_string(normalized)
 
    def packLen(self):
-      result=0
-      stack = []
-      i = iter([self.dataElement])
-
-      while True:
-         try:
-            dataElement = next(i)
-         except StopIteration:
-            try:
-               i = stack.pop()
-               continue
-            except IndexError:
-               break
-         if dataElement.typeCode == RECORD_TYPE_CODE:
-            stack.append(i)
-            i=iter(dataElement.elements)
-         else:
-            elemSize=self._calcElemSize(dataElement)
-            result+=elemSize
-      return result
+      return self._calcElemSize(self.dataElement)
 
    def _calcElemSize(self, dataElement):
       typeCodes = [UINT8_TYPE_CODE, UINT16_TYPE_CODE, UINT32_TYPE_CODE, UINT64_TYPE_CODE,
@@ -316,7 +300,13 @@ class DataSignature:
             (childElement,remain)=DataSignature.parseDataSignature(remain, typeList)
             if childElement is None:
                if remain[0] == '}':
-                  return (recordElement,remain[1:])
+                  remain = remain[1:]
+                  if (len(remain)>0) and (remain[0]=='['): #array of records
+                     (value,remain)=match_pair(remain,'[',']')
+                     if value is None:
+                        raise ParseError("Expecting ']' near: "+remain)
+                     recordElement.arrayLen=int(value)
+                  return (recordElement,remain)
                else:
                   raise ParseError('syntax error while parsing record')
             else:
@@ -419,10 +409,10 @@ class DataElement:
                      SINT8_TYPE_CODE, SINT16_TYPE_CODE, SINT32_TYPE_CODE, SINT64_TYPE_CODE,
                      STRING_TYPE_CODE]
       typeMinVal = [0, 0, 0, 0,
-                     -128, -32768, -2147483648, None, #python has issues with 64-bit integer literals, ignore for now
+                     -128, -32768, -2147483648, -9223372036854775808,
                      0]
-      typeMaxVal = [255, 65535, 0xFFFFFFFF, None, #python has issues with 64-bit integer literals, ignore for now
-                     127, 32767, 2147483647, None,
+      typeMaxVal = [255, 65535, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF,
+                     127, 32767, 2147483647, 9223372036854775807,
                      255]
       if reference is not None:
          self.typeCode = REFERENCE_TYPE_CODE
@@ -527,6 +517,10 @@ class DataElement:
    def UInt32(cls, name=None, minVal = None, maxVal = None, arrayLen = None):
       return cls(name, UINT32_TYPE_CODE, minVal, maxVal, arrayLen)
 
+   @classmethod
+   def UInt64(cls, name=None, minVal = None, maxVal = None, arrayLen = None):
+      return cls(name, UINT64_TYPE_CODE, minVal, maxVal, arrayLen)
+
    @classmethod
    def String(cls, name=None, arrayLen = None):
       return cls(name, STRING_TYPE_CODE, None, None, arrayLen)
@@ -543,6 +537,10 @@ class DataElement:
    def SInt32(cls, name=None, minVal = None, maxVal = None, arrayLen = None):
       return cls(name, SINT32_TYPE_CODE, minVal, maxVal, arrayLen)
 
+   @classmethod
+   def SInt64(cls, name=None, minVal = None, maxVal = None, arrayLen = None):
+      return cls(name, SINT64_TYPE_CODE, minVal, maxVal, arrayLen)
+
    @classmethod
    def Record(cls, name=None, elements = None):
       self = cls(name, RECORD_TYPE_CODE)
@@ -612,7 +610,7 @@ class DataElement:
 
    def createInitData(self, initValue):
       data = bytearray()
-      if (self.typeCode == RECORD_TYPE_CODE):
+      if (self.typeCode == RECORD_TYPE_CODE) and not self.isArray():
          if (initValue.valueType != VTYPE_LIST):
             raise ValueError('invalid init value type: list expected')
          if len(initValue.elements) != len(self.elements):
@@ -626,7 +624,14 @@ class DataElement:
    @staticmethod
    def _createInitDataInner(dataElement, initValue, is_array_elem=False):
       data = bytearray()
-      if (dataElement.typeCode == RECORD_TYPE_CODE):
+      if (dataElement.typeCode == RECORD_TYPE_CODE) and dataElement.isArray() and (not is_array_elem):
+         if (initValue.valueType != VTYPE_LIST):
+            raise ValueError('invalid init value type: expected list')
+         if len(initValue.elements) != dataElement.arrayLen:
+            raise ValueError('Incorrect number of array elements in init_value: got %d, expected %d'%(len(initValue.elements), dataElement.arrayLen))
+         for initElem in initValue.elements:
+            data.extend(DataElement._createInitDataInner(dataElement, initElem, True))
+      elif (dataElement.typeCode == RECORD_TYPE_CODE):
          if (initValue.valueType != VTYPE_LIST):
             raise ValueError('invalid init value type: list expected')
          if len(initValue.elements) != len(dataElement.elements):
@@ -643,7 +648,8 @@ class DataElement:
                   data.append(ord(initValue.value[i]))
                else:
                   data.append(0)
-      elif (dataElement.typeCode in [UINT8_TYPE_CODE, UINT16_TYPE_CODE, UINT32_TYPE_CODE, SINT8_TYPE_CODE, SINT16_TYPE_CODE, SINT32_TYPE_CODE]):
+      elif (dataElement.typeCode in [UINT8_TYPE_CODE, UINT16_TYPE_CODE, UINT32_TYPE_CODE, UINT64_TYPE_CODE,
+                                     SINT8_TYPE_CODE, SINT16_TYPE_CODE, SINT32_TYPE_CODE, SINT64_TYPE_CODE]):
          if (dataElement.isArray()) and (not is_array_elem):
             if (initValue.valueType != VTYPE_LIST):
                raise ValueError('invalid init value type: expected list')
@@ -664,6 +670,9 @@ class DataElement:
                data.append(int(initValue.value)>>8 & 0xFF)
                data.append(int(initValue.value)>>16 & 0xFF)
                data.append(int(initValue.value)>>24 & 0xFF)
+            elif dataElement.typeCode==UINT64_TYPE_CODE or dataElement.typeCode==SINT64_TYPE_CODE:
+               #TODO: implement big endian support
+               data.extend((int(initValue.value) & 0xFFFFFFFFFFFFFFFF).to_bytes(8, 'little'))
             else:
                raise NotImplementedError(dataElement.typeCode)
       elif dataElement.typeCode == REFERENCE_TYPE_CODE:
@@ -1,6 +1,7 @@
 import apx
 import remotefile
 import abc
+import contextlib
 
 class DataListener(metaclass=abc.ABCMeta):
     @abc.abstractmethod
@@ -114,23 +115,50 @@ class Client:
     
     def write(self, identifier, value):
         if self.node is not None and self.nodeData is not None:
-            if isinstance(identifier, apx.Port):
-                port = identifier
-                test_port = self.node.providePorts[port.id]
-                if test_port is not port:
-                    if isinstance(port, apx.RequirePort):
-                        raise ValueError('Cannot write to require port {0.name}.{1.name}'.format(self.node, port))
-                    else:
-                        raise ValueError('Port {0.name} is not a provide port of node {1.name}'.format(self.port, self.node))
-            if isinstance(identifier, str):
-                port = self.node.find(identifier)
-                if not isinstance(port, apx.ProvidePort):
-                    raise ValueError('Port {0.name} is not a provide port of node {1.name}'.format(self.port, self.node))
-            elif isinstance(identifier, int):
-                port = self.node.providePorts[identifier]
-                if port is None:
-                    raise ValueError('Port {0.name} is not a provide port of node {1.name}'.format(self.port, self.node))
+            port = self._find_provide_port(identifier)
             self.nodeData.write_provide_port(port.id, value)
+
+    def write_many(self, values):
+        """
+        Writes several provide ports at once. values is a dict of identifier (port, port name or port id) and value.
+        Ports located next to each other in the output file are transmitted as a single message.
+        """
+        if self.node is not None and self.nodeData is not None:
+            if isinstance(values, dict):
+                values = values.items()
+            self.nodeData.write_many([(self._find_provide_port(identifier).id, value) for (identifier, value) in values])
+
+    def transaction(self):
+        """
+        Returns a context manager which buffers all port writes made inside the with-block (by the calling thread).
+        The writes are transmitted together when the block ends, the receiver sees them as one update:
+
+        with client.transaction():
+            client.write('VehicleSpeed', speed)
+            client.write('EngineSpeed', rpm)
+        """
+        if self.node is not None and self.nodeData is not None:
+            return self.nodeData.transaction()
+        return contextlib.nullcontext() #nothing to buffer, write is a no-op without a node
+
+    def _find_provide_port(self, identifier):
+        if isinstance(identifier, apx.Port):
+            port = identifier
+            test_port = self.node.providePorts[port.id]
+            if test_port is not port:
+                if isinstance(port, apx.RequirePort):
+                    raise ValueError('Cannot write to require port {0.name}.{1.name}'.format(self.node, port))
+                else:
+                    raise ValueError('Port {0.name} is not a provide port of node {1.name}'.format(self.port, self.node))
+        if isinstance(identifier, str):
+            port = self.node.find(identifier)
+            if not isinstance(port, apx.ProvidePort):
+                raise ValueError('Port {0.name} is not a provide port of node {1.name}'.format(self.port, self.node))
+        elif isinstance(identifier, int):
+            port = self.node.providePorts[identifier]
+            if port is None:
+                raise ValueError('Port {0.name} is not a provide port of node {1.name}'.format(self.port, self.node))
+        return port
     
     def write_port(self, identifier, value):
         """
@@ -0,0 +1,238 @@
+import struct
+import operator
+import array
+from apx.base import *
+from apx.vm_base import *
+
+FIELD_SCALAR = 0
+FIELD_ARRAY  = 1
+FIELD_STR    = 2
+FIELD_BYTES  = 3 #string unpacked as bytes (see rawStrings option of the compiler)
+
+CHECK_SCALAR       = 0
+CHECK_ARRAY        = 1
+CHECK_STR          = 2
+CHECK_RECORD       = 3
+CHECK_RECORD_ARRAY = 4
+
+#codec backends that can be selected by NodeData
+BACKEND_VM     = 'vm'     #byte code programs executed by apx.VM
+BACKEND_STRUCT = 'struct' #StructCodec for flat signatures, VM for everything else
+BACKEND_PYTHON = 'python' #PyCodec (generated python code), VM for unsupported types
+
+def encode_str(value):
+   """
+   Returns string port value as bytes: str is UTF-8 encoded, bytes and bytearray are returned as is
+   """
+   return value.encode('utf-8') if isinstance(value, str) else value
+
+class StructField:
+   """
+   Describes one field (or the whole value) of a StructCodec
+   """
+   def __init__(self, name, kind, count, index, typecode=None):
+      self.name = name   #record key or None when the codec is not a record
+      self.kind = kind   #FIELD_SCALAR, FIELD_ARRAY, FIELD_STR or FIELD_BYTES
+      self.count = count #number of struct items used by this field (FIELD_STR and FIELD_BYTES always use one)
+      self.index = index #index of first item in the tuple returned by struct.unpack_from
+      self.typecode = typecode #FIELD_ARRAY only: array.array type code, None when the array is unpacked as list
+
+class StructCodec:
+   """
+   Packs and unpacks a flat data element (scalar, array, string or a record containing only those)
+   using a single precompiled struct.Struct covering the entire port.
+
+   Values are identical to the ones produced/consumed by the APX VM.
+   """
+   def __init__(self, fmt, fields, is_record):
+      self.struct = struct.Struct(fmt)
+      self.size = self.struct.size
+      self.fields = fields
+      self.is_record = is_record
+      self.keys = tuple(field.name for field in fields) if is_record else None
+      self.is_scalar_only = all(field.kind == FIELD_SCALAR for field in fields)
+      if is_record and self.is_scalar_only:
+         self._getter = operator.itemgetter(*self.keys)
+      else:
+         self._getter = None
+
+   def unpack(self, data, offset=0):
+      """
+      Unpacks value from data at offset, returns python value (int, str, list or dict)
+      """
+      items = self.struct.unpack_from(data, offset)
+      if self.is_record:
+         if self.is_scalar_only:
+            return dict(zip(self.keys, items))
+         return {field.name: self._unpack_field(field, items) for field in self.fields}
+      return self._unpack_field(self.fields[0], items)
+
+   def unpack_into(self, target, data, offset=0):
+      """
+      Same as unpack but updates target in-place instead of allocating a new value.
+      target must be a dict for record codecs; lists of the correct length found in target (or target itself) are refilled.
+      Returns the unpacked value (target when it could be reused)
+      """
+      items = self.struct.unpack_from(data, offset)
+      if self.is_record:
+         if not isinstance(target, dict):
+            raise ValueError('target must be of type dict')
+         for field in self.fields:
+            if field.kind == FIELD_ARRAY and field.typecode is None:
+               container = target.get(field.name)
+               if type(container) is list and len(container) == field.count:
+                  container[:] = items[field.index:field.index+field.count]
+                  continue
+            target[field.name] = self._unpack_field(field, items)
+         return target
+      field = self.fields[0]
+      if field.kind == FIELD_ARRAY and field.typecode is None and type(target) is list and len(target) == field.count:
+         target[:] = items[field.index:field.index+field.count]
+         return target
+      return self._unpack_field(field, items)
+
+   def pack(self, value, data, offset=0):
+      """
+      Packs python value into data at offset, returns the offset following the packed data
+      """
+      if self._getter is not None:
+         items = self._getter(value)
+         if len(self.keys) == 1:
+            self.struct.pack_into(data, offset, items)
+         else:
+            self.struct.pack_into(data, offset, *items)
+      else:
+         items = []
+         if self.is_record:
+            if not isinstance(value, dict):
+               raise ValueError('value must be of type dict')
+            for field in self.fields:
+               self._pack_field(field, value[field.name], items)
+         else:
+            self._pack_field(self.fields[0], value, items)
+         self.struct.pack_into(data, offset, *items)
+      return offset+self.size
+
+   @staticmethod
+   def _unpack_field(field, items):
+      if field.kind == FIELD_SCALAR:
+         return items[field.index]
+      elif field.kind == FIELD_ARRAY:
+         if field.typecode is not None:
+            return array.array(field.typecode, items[field.index:field.index+field.count])
+         return list(items[field.index:field.index+field.count])
+      elif field.kind == FIELD_STR:
+         return items[field.index].partition(b'\0')[0].decode('utf-8')
+      else:
+         return items[field.index].partition(b'\0')[0]
+
+   @staticmethod
+   def _pack_field(field, value, items):
+      if field.kind == FIELD_SCALAR:
+         items.append(value)
+      elif field.kind == FIELD_ARRAY:
+         if not isinstance(value, (list, array.array)):
+            raise ValueError('value must be a list, got {}'.format(str(value)))
+         if len(value) < field.count:
+            raise ValueError('Not enough elements in list value list {0}. Expected {1} items'.format(repr(value), field.count))
+         items.extend(value[:field.count])
+      elif field.kind == FIELD_STR:
+         items.append(encode_str(value))
+      else:
+         items.append(value)
+
+class PyCodec:
+   """
+   Packs and unpacks a data element using python functions generated specifically for its data signature
+   (see Compiler.compilePyCodec). The generated functions contain no instruction dispatch, record keys are
+   compiled into the functions as constants.
+   """
+   def __init__(self, signature, size, source, namespace, compact_arrays=False, raw_strings=False):
+      self.signature = signature #normalized signature string of the data element
+      self.compact_arrays = compact_arrays
+      self.raw_strings = raw_strings
+      self.size = size
+      self.source = source #generated python source code
+      self.struct = namespace['_struct'] #struct.Struct used by the generated functions
+      self.pack = namespace['pack']
+      self.unpack = namespace['unpack']
+      self.unpack_into = namespace['unpack_into']
+
+class SpanCodec:
+   """
+   Unpacks a sequence of consecutive data elements (e.g. a span of require ports) using a single python function
+   generated by Compiler.compileSpanCodec. unpack returns a list with one value per data element.
+   """
+   def __init__(self, size, source, namespace):
+      self.size = size
+      self.source = source #generated python source code
+      self.struct = namespace['_struct']
+      self.unpack = namespace['unpack']
+
+class BoundsCheck:
+   """
+   Precompiled range check of a data element (see Compiler.compileBoundsCheck), used by the checked pack mode of NodeData.
+
+   Integers must be within the limits of the data signature (or the limits of the type when the signature has none),
+   integer arrays are checked in bulk using min/max, strings must fit into the string length and arrays must have exactly
+   the number of items of the data signature.
+   """
+   def __init__(self, kind, lower=None, upper=None, count=None, fields=None, element=None):
+      self.kind = kind
+      self.lower = lower #CHECK_SCALAR and CHECK_ARRAY: smallest valid value
+      self.upper = upper #CHECK_SCALAR and CHECK_ARRAY: largest valid value
+      self.count = count #CHECK_ARRAY, CHECK_STR and CHECK_RECORD_ARRAY: array length (max number of bytes for CHECK_STR)
+      self.fields = fields #CHECK_RECORD: list of (key, BoundsCheck) tuples
+      self.element = element #CHECK_RECORD_ARRAY: BoundsCheck of each array element
+      self._getter = None
+      if kind == CHECK_RECORD and len(fields) > 1 and all(check.kind == CHECK_SCALAR for key, check in fields):
+         self._getter = operator.itemgetter(*[key for key, check in fields])
+         self._limits = [(check.lower, check.upper) for key, check in fields]
+
+   def check(self, value, path='value'):
+      """
+      Raises ValueError when value doesn't fit the data element. path is used as name of value in the error message.
+      """
+      kind = self.kind
+      try:
+         if kind == CHECK_SCALAR:
+            if not self.lower <= value <= self.upper:
+               raise ValueError('{}: value {} is out of range [{:d}, {:d}]'.format(path, value, self.lower, self.upper))
+         elif kind == CHECK_ARRAY:
+            self._check_len(value, path)
+            if self.count > 0 and (min(value) < self.lower or max(value) > self.upper):
+               for i, item in enumerate(value):
+                  if not self.lower <= item <= self.upper:
+                     raise ValueError('{}[{:d}]: value {} is out of range [{:d}, {:d}]'.format(path, i, item, self.lower, self.upper))
+         elif kind == CHECK_STR:
+            if not isinstance(value, (str, bytes, bytearray)):
+               raise ValueError('{}: value must be of type str or bytes, got {}'.format(path, type(value).__name__))
+            if len(value.encode('utf-8') if isinstance(value, str) else value) > self.count:
+               raise ValueError('{}: string "{}" is longer than {:d} bytes'.format(path, value, self.count))
+         elif kind == CHECK_RECORD:
+            if not isinstance(value, dict):
+               raise ValueError('{}: value must be of type dict, got {}'.format(path, type(value).__name__))
+            if self._getter is not None:
+               try:
+                  items = self._getter(value)
+               except KeyError:
+                  pass
+               else:
+                  if all(lower <= item <= upper for item, (lower, upper) in zip(items, self._limits)):
+                     return
+            for key, check in self.fields:
+               if key not in value:
+                  raise ValueError('{}: missing record field "{}"'.format(path, key))
+               check.check(value[key], '{}.{}'.format(path, key))
+         elif kind == CHECK_RECORD_ARRAY:
+            self._check_len(value, path)
+            for i, item in enumerate(value):
+               self.element.check(item, '{}[{:d}]'.format(path, i))
+      except TypeError:
+         raise ValueError('{}: invalid value type {}'.format(path, type(value).__name__))
+
+   def _check_len(self, value, path):
+      if not isinstance(value, (list, tuple, array.array)):
+         raise ValueError('{}: value must be a list, got {}'.format(path, type(value).__name__))
+      if len(value) != self.count:
+         raise ValueError('{}: expected {:d} items, got {:d}'.format(path, self.count, len(value)))
@@ -1,10 +1,141 @@
 from apx.base import *
 from apx.vm_base import *
+from apx.base import _typeCodeToStr
+from apx.codec import *
+from apx.optimizer import optimize_program
+import struct
+import array
+import copy
+import re
+import threading
+import collections
 
+#struct format characters of scalar types that can be handled by StructCodec
+_struct_format_map = {
+   UINT8_TYPE_CODE: 'B',
+   UINT16_TYPE_CODE: 'H',
+   UINT32_TYPE_CODE: 'I',
+   SINT8_TYPE_CODE: 'b',
+   SINT16_TYPE_CODE: 'h',
+   SINT32_TYPE_CODE: 'i',
+   UINT64_TYPE_CODE: 'Q',
+   SINT64_TYPE_CODE: 'q',
+}
+
+
+DEFAULT_PROGRAM_CACHE_SIZE = 4096
+DEFAULT_CODEC_CACHE_SIZE = 1024
+
+_field_path_regex = re.compile(r'^([^\[\]]*)(?:\[(\d+)\])?$')
+
+def _signature_string(dataElement):
+   """
+   Returns the data signature of dataElement with all type references resolved and all range limits removed.
+   Two data elements with the same result have identical memory layout and python value representation.
+   """
+   dataElement = dataElement.resolve_data_element()
+   if dataElement.typeCode == RECORD_TYPE_CODE:
+      result = '{'+''.join('"{}"{}'.format(elem.name, _signature_string(elem)) for elem in dataElement.elements)+'}'
+   else:
+      result = _typeCodeToStr(dataElement.typeCode)
+   if dataElement.arrayLen is not None:
+      result += '[{:d}]'.format(dataElement.arrayLen)
+   return result
+
+def load_py_codec(signature, fmt, source, compactArrays=False, rawStrings=False):
+   """
+   Compiles generated python source (see Compiler.compilePyCodec) into a PyCodec
+   """
+   namespace = {'_struct': struct.Struct(fmt), '_array': array.array, '_encode_str': encode_str}
+   exec(compile(source, '<apx codec {}>'.format(signature), 'exec'), namespace)
+   return PyCodec(signature, namespace['_struct'].size, source, namespace, compactArrays, rawStrings)
+
+def _data_element_size(dataElement):
+   """
+   Returns number of bytes used by dataElement in port data
+   """
+   dataElement = dataElement.resolve_data_element()
+   if dataElement.typeCode == RECORD_TYPE_CODE:
+      size = sum(_data_element_size(elem) for elem in dataElement.elements)
+   elif dataElement.typeCode == STRING_TYPE_CODE:
+      size = 1
+   else:
+      try:
+         size = struct.calcsize('<'+_struct_format_map[dataElement.typeCode])
+      except KeyError:
+         raise NotImplementedError(dataElement.typeCode)
+   if dataElement.isArray():
+      return size*dataElement.arrayLen
+   return size
+
+class ProgramCache:
+   """
+   Bounded LRU cache of compiled byte code programs keyed by (program type, normalized data signature, optimize flag).
+   One instance (apx.program_cache) is shared by all compilers in the process, further instances hold generated codecs
+   and record field indexes.
+   """
+   def __init__(self, maxsize=DEFAULT_PROGRAM_CACHE_SIZE):
+      self.maxsize = maxsize
+      self.lock = threading.Lock()
+      self.programs = collections.OrderedDict()
+      self.hits = 0
+      self.misses = 0
+
+   def get(self, key, compile_func):
+      """
+      Returns cached program for key, calls compile_func() to create the program when it's not in the cache.
+      A None result is returned but not cached.
+      """
+      with self.lock:
+         program = self.programs.get(key)
+         if program is not None:
+            self.programs.move_to_end(key)
+            self.hits+=1
+            return program
+         self.misses+=1
+      program = compile_func()
+      if program is None:
+         return None
+      with self.lock:
+         self.programs[key] = program
+         while len(self.programs) > self.maxsize:
+            self.programs.popitem(last=False)
+      return program
+
+   def clear(self):
+      """
+      Removes all programs and resets the statistics
+      """
+      with self.lock:
+         self.programs.clear()
+         self.hits = 0
+         self.misses = 0
+
+   def resize(self, maxsize):
+      with self.lock:
+         self.maxsize = maxsize
+         while len(self.programs) > self.maxsize:
+            self.programs.popitem(last=False)
+
+   def stats(self):
+      """
+      Returns dict with the keys 'hits', 'misses', 'size' and 'maxsize'
+      """
+      with self.lock:
+         return {'hits': self.hits, 'misses': self.misses, 'size': len(self.programs), 'maxsize': self.maxsize}
+
+program_cache = ProgramCache()
+_py_codec_cache = ProgramCache(DEFAULT_CODEC_CACHE_SIZE) #PyCodec objects keyed by (normalized signature string, compactArrays, rawStrings)
+_field_index_cache = ProgramCache(DEFAULT_CODEC_CACHE_SIZE) #record field indexes (see Compiler.compileFieldIndex) keyed by normalized signature string
 
 class Compiler:
-   def __init__(self):
-      pass
+   """
+   APX byte code compiler
+
+   optimize: when True, programs are rewritten by the peephole optimizer (see apx.optimizer)
+   """
+   def __init__(self, optimize=False):
+      self.optimize = optimize
    
    def exec(self, port):
       """
@@ -22,6 +153,8 @@ class Compiler:
       self._packDataElement(dataElement, True)
       tmp = self.prog
       self.prog = None
+      if self.optimize:
+         return optimize_program(tmp)
       return bytes(tmp)
    
    def compileUnpackProg(self, dataElement):
@@ -29,8 +162,343 @@ class Compiler:
       self._unpackDataElement(dataElement, True)
       tmp = self.prog
       self.prog = None
+      if self.optimize:
+         return optimize_program(tmp)
       return bytes(tmp)
    
+   def getPackProg(self, dataElement):
+      """
+      Same as compilePackProg but the program is shared (through apx.program_cache) with all data elements having the same normalized data signature
+      """
+      key = (PACK_PROG, _signature_string(dataElement), self.optimize)
+      return program_cache.get(key, lambda: self.compilePackProg(dataElement))
+
+   def getUnpackProg(self, dataElement):
+      """
+      Same as compileUnpackProg but the program is shared (through apx.program_cache) with all data elements having the same normalized data signature
+      """
+      key = (UNPACK_PROG, _signature_string(dataElement), self.optimize)
+      return program_cache.get(key, lambda: self.compileUnpackProg(dataElement))
+
+   def compileStructCodec(self, dataElement, compactArrays=False, rawStrings=False):
+      """
+      Compiles data element into a StructCodec.
+      Returns None when the data element is not flat (e.g. nested records), use the VM programs for those.
+      compactArrays: when True, integer arrays are unpacked as array.array instead of list
+      rawStrings: when True, strings are unpacked as bytes (without trailing NUL characters) and packed from bytes
+      """
+      dataElement = dataElement.resolve_data_element()
+      fmt = '<'
+      fields = []
+      index = 0
+      if dataElement.typeCode == RECORD_TYPE_CODE:
+         if dataElement.isArray():
+            return None
+         isRecord = True
+         elements = dataElement.elements
+      else:
+         isRecord = False
+         elements = [dataElement]
+      for childElement in elements:
+         name = childElement.name if isRecord else None
+         childElement = childElement.resolve_data_element()
+         if childElement.typeCode == STRING_TYPE_CODE:
+            fmt += '{:d}s'.format(childElement.arrayLen)
+            fields.append(StructField(name, FIELD_BYTES if rawStrings else FIELD_STR, 1, index))
+            index += 1
+         elif childElement.typeCode in _struct_format_map:
+            code = _struct_format_map[childElement.typeCode]
+            if childElement.isArray():
+               fmt += '{:d}{}'.format(childElement.arrayLen, code)
+               typecode = ARRAY_TYPECODE_MAP[code] if compactArrays else None
+               fields.append(StructField(name, FIELD_ARRAY, childElement.arrayLen, index, typecode))
+               index += childElement.arrayLen
+            else:
+               fmt += code
+               fields.append(StructField(name, FIELD_SCALAR, 1, index))
+               index += 1
+         else:
+            return None
+      return StructCodec(fmt, fields, isRecord)
+
+   def compileBoundsCheck(self, dataElement):
+      """
+      Compiles the range limits of data element into a BoundsCheck
+      """
+      dataElement = dataElement.resolve_data_element()
+      if dataElement.typeCode == RECORD_TYPE_CODE:
+         check = BoundsCheck(CHECK_RECORD, fields=[(elem.name, self.compileBoundsCheck(elem)) for elem in dataElement.elements])
+         if dataElement.isArray():
+            return BoundsCheck(CHECK_RECORD_ARRAY, count=dataElement.arrayLen, element=check)
+         return check
+      elif dataElement.typeCode == STRING_TYPE_CODE:
+         return BoundsCheck(CHECK_STR, count=dataElement.arrayLen)
+      elif dataElement.typeCode in _struct_format_map:
+         kind = CHECK_ARRAY if dataElement.isArray() else CHECK_SCALAR
+         return BoundsCheck(kind, dataElement.minValWithDefault, dataElement.maxValWithDefault, dataElement.arrayLen)
+      else:
+         raise NotImplementedError(dataElement.typeCode)
+
+   def compileFieldIndex(self, dataElement):
+      """
+      Returns dict which maps the name of each element in record dataElement to tuple (byte offset, resolved data element).
+      Indexes are shared between all records with the same normalized data signature.
+      """
+      dataElement = dataElement.resolve_data_element()
+      if dataElement.typeCode != RECORD_TYPE_CODE or dataElement.isArray():
+         raise ValueError('Field index requires a record data element')
+      return _field_index_cache.get(_signature_string(dataElement), lambda: self._createFieldIndex(dataElement))
+
+   def _createFieldIndex(self, dataElement):
+      index = {}
+      offset = 0
+      for elem in dataElement.elements:
+         index[elem.name] = (offset, elem.resolve_data_element())
+         offset += _data_element_size(elem)
+      return index
+
+   def compileFieldCodec(self, dataElement, path, compactArrays=False, rawStrings=False):
+      """
+      Compiles codec for the part of dataElement selected by path, e.g. "Id", "SensorData.x", "Data[3]" or "Items[1].Name".
+      Returns tuple (offset, codec) where offset is the byte offset of the selected field relative to the start of dataElement.
+      """
+      offset = 0
+      dataElement = dataElement.resolve_data_element()
+      for part in path.split('.'):
+         match = _field_path_regex.match(part)
+         if match is None:
+            raise ValueError('Invalid field path: {}'.format(path))
+         name, arrayIndex = match.groups()
+         if len(name)>0:
+            if dataElement.typeCode != RECORD_TYPE_CODE or dataElement.isArray():
+               raise ValueError('Invalid field path: {} ({} is not a record)'.format(path, name))
+            try:
+               fieldOffset, dataElement = self.compileFieldIndex(dataElement)[name]
+            except KeyError:
+               raise ValueError('Invalid field path: {} (no field named {})'.format(path, name))
+            offset += fieldOffset
+         if arrayIndex is not None:
+            arrayIndex = int(arrayIndex)
+            if not dataElement.isArray() or dataElement.typeCode == STRING_TYPE_CODE:
+               raise ValueError('Invalid field path: {} ({} is not an array)'.format(path, part))
+            if arrayIndex >= dataElement.arrayLen:
+               raise ValueError('Invalid field path: {} (index out of range)'.format(path))
+            dataElement = copy.copy(dataElement)
+            dataElement.arrayLen = None
+            offset += arrayIndex*_data_element_size(dataElement)
+      codec = self.compileStructCodec(dataElement, compactArrays, rawStrings)
+      if codec is None:
+         codec = self.compilePyCodec(dataElement, compactArrays, rawStrings)
+      if codec is None:
+         raise NotImplementedError(_signature_string(dataElement))
+      return offset, codec
+
+   def compileCodec(self, dataElement, backend, compactArrays=False, rawStrings=False):
+      """
+      Compiles data element into a codec object for the selected backend (BACKEND_VM, BACKEND_STRUCT or BACKEND_PYTHON).
+      Returns None when the VM programs shall be used.
+      """
+      if backend == BACKEND_STRUCT:
+         return self.compileStructCodec(dataElement, compactArrays, rawStrings)
+      elif backend == BACKEND_PYTHON:
+         return self.compilePyCodec(dataElement, compactArrays, rawStrings)
+      elif backend == BACKEND_VM:
+         return None
+      else:
+         raise ValueError('Unknown backend: {}'.format(backend))
+
+   def compilePyCodec(self, dataElement, compactArrays=False, rawStrings=False):
+      """
+      Generates python source code with straight-line pack/unpack functions for data element and compiles it into a PyCodec.
+      Codecs are shared between all data elements with the same normalized data signature.
+      Returns None when the data element contains types not supported by the generator.
+      compactArrays: when True, integer arrays are unpacked as array.array instead of list
+      rawStrings: when True, strings are unpacked as bytes (without trailing NUL characters) and packed from bytes
+      """
+      signature = _signature_string(dataElement)
+      key = (signature, compactArrays, rawStrings)
+      return _py_codec_cache.get(key, lambda: self._generatePyCodec(dataElement, signature, compactArrays, rawStrings))
+
+   def _generatePyCodec(self, dataElement, signature, compactArrays, rawStrings):
+      self.compactArrays = compactArrays
+      self.rawStrings = rawStrings
+      self.fmt = '<'
+      self.itemCount = 0
+      self.lines = []
+      try:
+         unpackExpr = self._pyUnpackExpr(dataElement)
+         packArgs = self._pyPackArgs(dataElement, 'value')
+         fmt, checkLines = self.fmt, self.lines
+         self.fmt = '<'
+         self.itemCount = 0
+         intoLines = self._pyUnpackIntoLines(dataElement)
+         assert(self.fmt == fmt)
+      except NotImplementedError:
+         return None
+      finally:
+         self.fmt, self.lines = None, None
+      size = struct.calcsize(fmt)
+      source = '\n'.join([
+         'def unpack(data, offset=0):',
+         '   t = _struct.unpack_from(data, offset)',
+         '   return {}'.format(unpackExpr),
+         '',
+         'def unpack_into(target, data, offset=0):',
+         '   t = _struct.unpack_from(data, offset)'] +
+         intoLines + [
+         '',
+         'def pack(value, data, offset=0):'] +
+         checkLines + [
+         '   _struct.pack_into(data, offset, {})'.format(', '.join(packArgs)),
+         '   return offset+{:d}'.format(size),
+         ''])
+      return load_py_codec(signature, fmt, source, compactArrays, rawStrings)
+
+   def compileSpanCodec(self, dataElements, compactArrays=False, rawStrings=False):
+      """
+      Generates a python function which unpacks a sequence of consecutive data elements in a single pass (one
+      struct.unpack_from call) and compiles it into a SpanCodec.
+      Returns None when one of the data elements contains types not supported by the generator.
+      """
+      self.compactArrays = compactArrays
+      self.rawStrings = rawStrings
+      self.fmt = '<'
+      self.itemCount = 0
+      self.lines = []
+      try:
+         unpackExprs = [self._pyUnpackExpr(dataElement) for dataElement in dataElements]
+         fmt = self.fmt
+      except NotImplementedError:
+         return None
+      finally:
+         self.fmt, self.lines = None, None
+      source = '\n'.join([
+         'def unpack(data, offset=0):',
+         '   t = _struct.unpack_from(data, offset)',
+         '   return [{}]'.format(',\n      '.join(unpackExprs)),
+         ''])
+      namespace = {'_struct': struct.Struct(fmt), '_array': array.array}
+      exec(compile(source, '<apx span codec>', 'exec'), namespace)
+      return SpanCodec(namespace['_struct'].size, source, namespace)
+
+   def _pyUnpackExpr(self, dataElement, isArrayElem=False):
+      """
+      Appends the struct format of dataElement to self.fmt and returns python expression that builds its value from the tuple t
+      """
+      dataElement = dataElement.resolve_data_element()
+      if dataElement.isArray() and not isArrayElem and dataElement.typeCode != STRING_TYPE_CODE:
+         if dataElement.typeCode == RECORD_TYPE_CODE:
+            return '['+', '.join(self._pyUnpackExpr(dataElement, True) for i in range(dataElement.arrayLen))+']'
+         code = self._structCode(dataElement)
+         begin = self.itemCount
+         self.fmt += '{:d}{}'.format(dataElement.arrayLen, code)
+         self.itemCount += dataElement.arrayLen
+         if self.compactArrays:
+            return "_array('{}', t[{:d}:{:d}])".format(ARRAY_TYPECODE_MAP[code], begin, self.itemCount)
+         return 'list(t[{:d}:{:d}])'.format(begin, self.itemCount)
+      elif dataElement.typeCode == RECORD_TYPE_CODE:
+         return '{'+', '.join('{!r}: {}'.format(elem.name, self._pyUnpackExpr(elem)) for elem in dataElement.elements)+'}'
+      elif dataElement.typeCode == STRING_TYPE_CODE:
+         self.fmt += '{:d}s'.format(dataElement.arrayLen)
+         self.itemCount += 1
+         if self.rawStrings:
+            return "t[{:d}].partition(b'\\0')[0]".format(self.itemCount-1)
+         return "t[{:d}].partition(b'\\0')[0].decode('utf-8')".format(self.itemCount-1)
+      else:
+         self.fmt += self._structCode(dataElement)
+         self.itemCount += 1
+         return 't[{:d}]'.format(self.itemCount-1)
+
+   def _pyUnpackIntoLines(self, dataElement):
+      """
+      Returns body lines of the generated unpack_into function, which updates the caller-owned container target in-place.
+      Nested dicts and lists of correct length are reused, everything else is replaced by a new value.
+      """
+      dataElement = dataElement.resolve_data_element()
+      if dataElement.typeCode == RECORD_TYPE_CODE and not dataElement.isArray():
+         lines = ["   if not isinstance(target, dict): raise ValueError('target must be of type dict')"]
+         for elem in dataElement.elements:
+            self._pyUnpackIntoElement(elem, 'target', lines)
+         lines.append('   return target')
+         return lines
+      begin = self.itemCount
+      expr = self._pyUnpackExpr(dataElement)
+      if self._isListArray(dataElement):
+         return ['   if type(target) is list and len(target) == {:d}:'.format(dataElement.arrayLen),
+                 '      target[:] = t[{:d}:{:d}]'.format(begin, self.itemCount),
+                 '      return target',
+                 '   return {}'.format(expr)]
+      return ['   return {}'.format(expr)]
+
+   def _pyUnpackIntoElement(self, dataElement, container, lines):
+      """
+      Appends lines that store the value of record element dataElement into container[dataElement.name]
+      """
+      key = dataElement.name
+      dataElement = dataElement.resolve_data_element()
+      if dataElement.typeCode == RECORD_TYPE_CODE and not dataElement.isArray():
+         var = 'r{:d}'.format(len(lines))
+         lines.append('   {0} = {1}.get({2!r})\n'
+                      '   if type({0}) is not dict: {0} = {1}[{2!r}] = {{}}'.format(var, container, key))
+         for elem in dataElement.elements:
+            self._pyUnpackIntoElement(elem, var, lines)
+         return
+      begin = self.itemCount
+      expr = self._pyUnpackExpr(dataElement)
+      if self._isListArray(dataElement):
+         var = 'x{:d}'.format(len(lines))
+         lines.append('   {0} = {1}.get({2!r})\n'
+                      '   if type({0}) is list and len({0}) == {3:d}: {0}[:] = t[{4:d}:{5:d}]\n'
+                      '   else: {1}[{2!r}] = {6}'.format(var, container, key, dataElement.arrayLen, begin, self.itemCount, expr))
+      else:
+         lines.append('   {}[{!r}] = {}'.format(container, key, expr))
+
+   def _isListArray(self, dataElement):
+      """
+      Returns True when dataElement (resolved) is unpacked as a list of integers
+      """
+      return (dataElement.isArray() and not self.compactArrays and
+              dataElement.typeCode not in (STRING_TYPE_CODE, RECORD_TYPE_CODE))
+
+   def _pyPackArgs(self, dataElement, expr, isArrayElem=False):
+      """
+      Returns list of python expressions (arguments to pack_into) that extracts the struct items of dataElement from expr.
+      Array length checks are added to self.lines
+      """
+      dataElement = dataElement.resolve_data_element()
+      if dataElement.isArray() and not isArrayElem and dataElement.typeCode != STRING_TYPE_CODE:
+         var = 'v{:d}'.format(len(self.lines))
+         self.lines.append('   {0} = {1}\n'
+                           '   if len({0}) < {2:d}: raise ValueError("Not enough elements in list value list {{0}}. Expected {2:d} items".format(repr({0})))'
+                           .format(var, expr, dataElement.arrayLen))
+         if dataElement.typeCode == RECORD_TYPE_CODE:
+            args = []
+            for i in range(dataElement.arrayLen):
+               args.extend(self._pyPackArgs(dataElement, '{}[{:d}]'.format(var, i), True))
+            return args
+         self._structCode(dataElement)
+         return ['*{}[:{:d}]'.format(var, dataElement.arrayLen)]
+      elif dataElement.typeCode == RECORD_TYPE_CODE:
+         var = 'v{:d}'.format(len(self.lines))
+         self.lines.append('   {} = {}'.format(var, expr))
+         args = []
+         for elem in dataElement.elements:
+            args.extend(self._pyPackArgs(elem, '{}[{!r}]'.format(var, elem.name)))
+         return args
+      elif dataElement.typeCode == STRING_TYPE_CODE:
+         if self.rawStrings:
+            return [expr]
+         return ['_encode_str({})'.format(expr)]
+      else:
+         self._structCode(dataElement)
+         return [expr]
+
+   def _structCode(self, dataElement):
+      try:
+         return _struct_format_map[dataElement.typeCode]
+      except KeyError:
+         raise NotImplementedError(dataElement.typeCode)
+
    def _packProgHeader(self, progLen, insert=False):
       tmp = bytearray()
       tmp.append(OPCODE_PACK_PROG)
@@ -97,6 +565,14 @@ class Compiler:
          if header: self._packProgHeader(SINT32_LEN)
          self.prog.append(OPCODE_PACK_S32)
          return SINT32_LEN
+      elif dataElement.typeCode == UINT64_TYPE_CODE:
+         if header: self._packProgHeader(UINT64_LEN)
+         self.prog.append(OPCODE_PACK_U64)
+         return UINT64_LEN
+      elif dataElement.typeCode == SINT64_TYPE_CODE:
+         if header: self._packProgHeader(SINT64_LEN)
+         self.prog.append(OPCODE_PACK_S64)
+         return SINT64_LEN
       elif dataElement.typeCode == RECORD_TYPE_CODE:
          packLen = 0
          self.prog.append(OPCODE_RECORD_ENTER)
@@ -138,6 +614,14 @@ class Compiler:
          if header: self._unpackProgHeader(SINT32_LEN)
          self.prog.append(OPCODE_UNPACK_S32)
          return SINT32_LEN
+      elif dataElement.typeCode == UINT64_TYPE_CODE:
+         if header: self._unpackProgHeader(UINT64_LEN)
+         self.prog.append(OPCODE_UNPACK_U64)
+         return UINT64_LEN
+      elif dataElement.typeCode == SINT64_TYPE_CODE:
+         if header: self._unpackProgHeader(SINT64_LEN)
+         self.prog.append(OPCODE_UNPACK_S64)
+         return SINT64_LEN
       elif dataElement.typeCode == RECORD_TYPE_CODE:
          packLen = 0
          self.prog.append(OPCODE_RECORD_ENTER)
@@ -151,6 +635,7 @@ class Compiler:
          raise NotImplementedError(dataElement.typeCode)      
   
    def _packArray(self, dataElement, header):
+      dataElement = dataElement.resolve_data_element()
       arrayLen = dataElement.arrayLen
       if dataElement.typeCode == UINT8_TYPE_CODE:
          if header: self._packProgHeader(UINT8_LEN * arrayLen)
@@ -170,13 +655,24 @@ class Compiler:
       elif dataElement.typeCode == SINT32_TYPE_CODE:
          if header: self._packProgHeader(SINT32_LEN * arrayLen)
          return self._packS32AR(arrayLen)
+      elif dataElement.typeCode == UINT64_TYPE_CODE:
+         if header: self._packProgHeader(UINT64_LEN * arrayLen)
+         return self._packU64AR(arrayLen)
+      elif dataElement.typeCode == SINT64_TYPE_CODE:
+         if header: self._packProgHeader(SINT64_LEN * arrayLen)
+         return self._packS64AR(arrayLen)
       elif dataElement.typeCode == STRING_TYPE_CODE:
          if header: self._packProgHeader(UINT8_LEN * arrayLen)
          return self._packSTR(arrayLen)
+      elif dataElement.typeCode == RECORD_TYPE_CODE:
+         packLen = self._recordArray(dataElement, self._packSingleElement)
+         if header: self._packProgHeader(packLen, insert = True)
+         return packLen
       else:
          raise NotImplementedError(dataElement.typeCode)
 
    def _unpackArray(self, dataElement, header):
+      dataElement = dataElement.resolve_data_element()
       arrayLen = dataElement.arrayLen
       if dataElement.typeCode == UINT8_TYPE_CODE:
          if header: self._unpackProgHeader(UINT8_LEN * arrayLen)
@@ -196,11 +692,33 @@ class Compiler:
       elif dataElement.typeCode == SINT32_TYPE_CODE:
          if header: self._unpackProgHeader(SINT32_LEN * arrayLen)
          return self._unpackS32AR(arrayLen)
+      elif dataElement.typeCode == UINT64_TYPE_CODE:
+         if header: self._unpackProgHeader(UINT64_LEN * arrayLen)
+         return self._unpackU64AR(arrayLen)
+      elif dataElement.typeCode == SINT64_TYPE_CODE:
+         if header: self._unpackProgHeader(SINT64_LEN * arrayLen)
+         return self._unpackS64AR(arrayLen)
       elif dataElement.typeCode == STRING_TYPE_CODE:
          if header: self._unpackProgHeader(UINT8_LEN * arrayLen)
          return self._unpackSTR(arrayLen)
+      elif dataElement.typeCode == RECORD_TYPE_CODE:
+         packLen = self._recordArray(dataElement, self._unpackSingleElement)
+         if header: self._unpackProgHeader(packLen, insert = True)
+         return packLen
       else:
          raise NotImplementedError(dataElement.typeCode)
+
+   def _recordArray(self, dataElement, compileRecord):
+      """
+      Compiles array of records, the record instructions are emitted once and executed by the VM once per array element
+      """
+      arrayLen = dataElement.arrayLen
+      self.prog.append(OPCODE_RECORD_ARRAY)
+      self.prog.append( (arrayLen) & 0xFF)
+      self.prog.append( (arrayLen >> 8) & 0xFF)
+      packLen = compileRecord(dataElement, False) * arrayLen
+      self.prog.append(OPCODE_ARRAY_LEAVE)
+      return packLen
    
    def _packU8AR(self, arrayLen):
       self.prog.append(OPCODE_PACK_U8AR)
@@ -274,6 +792,30 @@ class Compiler:
       self.prog.append( (arrayLen >> 8) & 0xFF)      
       return SINT32_LEN * arrayLen
 
+   def _packU64AR(self, arrayLen):
+      self.prog.append(OPCODE_PACK_U64AR)
+      self.prog.append( (arrayLen) & 0xFF)
+      self.prog.append( (arrayLen >> 8) & 0xFF)
+      return UINT64_LEN * arrayLen
+
+   def _unpackU64AR(self, arrayLen):
+      self.prog.append(OPCODE_UNPACK_U64AR)
+      self.prog.append( (arrayLen) & 0xFF)
+      self.prog.append( (arrayLen >> 8) & 0xFF)
+      return UINT64_LEN * arrayLen
+
+   def _packS64AR(self, arrayLen):
+      self.prog.append(OPCODE_PACK_S64AR)
+      self.prog.append( (arrayLen) & 0xFF)
+      self.prog.append( (arrayLen >> 8) & 0xFF)
+      return SINT64_LEN * arrayLen
+
+   def _unpackS64AR(self, arrayLen):
+      self.prog.append(OPCODE_UNPACK_S64AR)
+      self.prog.append( (arrayLen) & 0xFF)
+      self.prog.append( (arrayLen >> 8) & 0xFF)
+      return SINT64_LEN * arrayLen
+
    def _packSTR(self, arrayLen):
       self.prog.append(OPCODE_PACK_STR)
       self.prog.append( (arrayLen) & 0xFF)
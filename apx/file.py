@@ -37,7 +37,7 @@ class File(remotefile.File):
       reads data from the given offset, returns bytes array or None in case of error
       """
       if(offset < 0) or (offset+length>len(self.data) ):
-         print('file read outside file boundary detected, file=%s, off=%d, len=%d'%(self.name, offset, len(data)),file=sys.stderr)
+         print('file read outside file boundary detected, file=%s, off=%d, len=%d'%(self.name, offset, length),file=sys.stderr)
          return None
       self.dataLock.acquire()
       retval = bytes(self.data[offset:offset+length])
@@ -61,18 +61,54 @@ class File(remotefile.File):
 
 class InputFile(File):
    """
-   An APX input file. when written to, it notifies the upper layer (NodeDataHandler) about the change
+   An APX input file. when written to, it notifies the upper layer (NodeDataHandler) about the change.
+   Writes with more_bit set are held back and notified together with the next write without more_bit.
    """
    def __init__(self, name, length, init_data=None):
       super().__init__(name, length, init_data)
       self.nodeDataHandler=None
+      self.portIndex=None #optional apx.PortIntervalIndex, generation counters of the ports touched by a write are bumped
+      self.pendingRanges=[] #(offset, length) of writes received with more_bit, not yet notified
+
+   def open(self):
+      super().open()
+      self.pendingRanges=[]
+      if self.nodeDataHandler is not None:
+         self.nodeDataHandler.inPortDataOpen(self)
    
    def write(self, offset: int, data: bytes, more_bit : bool = False):
       retval = super().write(offset, data)      
-      if (retval>=0) and (more_bit == False):
-         if self.nodeDataHandler is not None:
-            self.nodeDataHandler.inPortDataWriteNotify(self, offset, len(data))
+      if (retval>=0) and (self.portIndex is not None):
+         #bumped after the data is written, a reader can never cache old data with the new generation
+         self.portIndex.touch(offset, len(data))
+      if retval>=0:
+         if more_bit:
+            self.pendingRanges.append((offset, len(data)))
+         else:
+            ranges = self._takePendingRanges(offset, len(data))
+            if self.nodeDataHandler is not None:
+               for (range_offset, range_len) in ranges:
+                  self.nodeDataHandler.inPortDataWriteNotify(self, range_offset, range_len)
       return retval
+
+   def _takePendingRanges(self, offset, length):
+      """
+      Returns the pending ranges plus the given range, sorted with overlapping or adjacent ranges merged, and clears
+      self.pendingRanges
+      """
+      if len(self.pendingRanges) == 0:
+         return [(offset, length)]
+      pending = sorted(self.pendingRanges+[(offset, length)])
+      self.pendingRanges = []
+      ranges = []
+      for (start, length) in pending:
+         end = start+length
+         if len(ranges)>0 and start <= ranges[-1][1]:
+            if end > ranges[-1][1]:
+               ranges[-1][1] = end
+         else:
+            ranges.append([start, end])
+      return [(start, end-start) for (start, end) in ranges]
          
 
 class OutputFile(File):
@@ -81,10 +117,43 @@ class OutputFile(File):
    """
    def __init__(self, name, length, init_data=None):
       super().__init__(name, length, init_data)
+      self.notifyLock = threading.Lock() #keeps the notifications of grouped writes (see write_ranges) together
             
    def write(self, offset: int, data: bytes):
       retval = super().write(offset, data)
       if (retval >=0) and (self.fileManager is not None) and (self.isOpen==True):
-         self.fileManager.outPortDataWriteNotify(self, offset, len(data))
+         with self.notifyLock:
+            self.fileManager.outPortDataWriteNotify(self, offset, len(data))
       return retval
+
+   def write_ranges(self, chunks, more_bit: bool = False):
+      """
+      writes a sequence of (offset, data) tuples into the file while holding the data lock once.
+      The FileManager is notified once per contiguous range of written bytes (adjacent or overlapping chunks are coalesced).
+      When more_bit is True, all notifications but the last one carry the RMF more bit, the receiver then handles the ranges
+      as a single update.
+      returns list of (offset, length) tuples of the written ranges or None on error (nothing is written)
+      """
+      chunks = sorted(chunks, key=lambda chunk: chunk[0])
+      for (offset, data) in chunks:
+         if(offset < 0) or (offset+len(data)>len(self.data) ):
+            print('file write outside file boundary detected, file=%s, off=%d, len=%d'%(self.name, offset, len(data)),file=sys.stderr)
+            return None
+      ranges = []
+      with self.dataLock:
+         for (offset, data) in chunks:
+            end = offset+len(data)
+            self.data[offset:end]=data
+            if len(ranges)>0 and offset <= ranges[-1][1]:
+               if end > ranges[-1][1]:
+                  ranges[-1][1] = end
+            else:
+               ranges.append([offset, end])
+      ranges = [(start, end-start) for (start, end) in ranges]
+      if (self.fileManager is not None) and (self.isOpen==True):
+         last = len(ranges)-1
+         with self.notifyLock:
+            for i, (offset, length) in enumerate(ranges):
+               self.fileManager.outPortDataWriteNotify(self, offset, length, more_bit and (i < last))
+      return ranges
       
\ No newline at end of file
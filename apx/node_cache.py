@@ -0,0 +1,175 @@
+"""
+On-disk cache of the artefacts NodeData derives from APX text: the node structure, port offsets, pack lengths, compiled programs,
+codecs and init data. A cache hit skips parsing the APX text.
+
+Cache files are JSON documents. The file name is the SHA-256 hash of the APX text together with the NodeData options that
+affect the artefacts, a modified APX text therefore never loads a stale cache file.
+
+Data signatures, port attributes, programs and codecs are stored once in tables that ports refer to by index. Each table entry is
+decoded once when the cache is loaded and the resulting object is shared by all ports referring to it.
+Generated python codecs are stored by data signature only, their source code is regenerated when the cache is loaded.
+No code read from the cache directory is ever executed.
+"""
+import os
+import json
+import hashlib
+import tempfile
+import apx
+from apx.codec import *
+
+CACHE_FORMAT_VERSION = 4
+
+def cache_key(apx_text, *options):
+   """
+   Returns hash (hex string) of apx_text and options
+   """
+   sha = hashlib.sha256()
+   sha.update('{:d};{};{}\n'.format(CACHE_FORMAT_VERSION, apx.__version__, ';'.join(str(x) for x in options)).encode('utf-8'))
+   sha.update(apx_text.encode('utf-8'))
+   return sha.hexdigest()
+
+def cache_path(cache_dir, apx_text, *options):
+   return os.path.join(cache_dir, cache_key(apx_text, *options)+'.json')
+
+def load(path):
+   """
+   Returns artefacts dict previously stored by save (the node is rebuilt from the cache file),
+   None when the file does not exist or can't be used
+   """
+   try:
+      with open(path, 'r', encoding='utf-8') as fh:
+         document = json.load(fh)
+   except (OSError, ValueError):
+      return None
+   if not isinstance(document, dict) or document.get('version') != CACHE_FORMAT_VERSION:
+      return None
+   try:
+      programs = [bytes.fromhex(program) for program in document['programs']]
+      codecs = [_decode_codec(spec) for spec in document['codecs']]
+      return {'node': _decode_node(document['node']),
+              'in': _decode_ports(document['in'], programs, codecs),
+              'out': _decode_ports(document['out'], programs, codecs)}
+   except (KeyError, TypeError, ValueError, IndexError, apx.ParseError, apx.ApxTypeError):
+      return None
+
+def save(path, artefacts):
+   """
+   Atomically writes artefacts to path.
+   artefacts: dict with keys 'node' (apx.Node), 'in' and 'out'. 'in' and 'out' are tuples (ports, init_data) where ports is a
+              list of (data_offset, data_len, program, codec) tuples
+   """
+   programs = _Table()
+   codecs = _Table()
+   document = {'version': CACHE_FORMAT_VERSION,
+               'node': _encode_node(artefacts['node']),
+               'in': _encode_ports(*artefacts['in'], programs, codecs),
+               'out': _encode_ports(*artefacts['out'], programs, codecs),
+               'programs': [program.hex() for program in programs.items],
+               'codecs': [_encode_codec(codec) for codec in codecs.items]}
+   dirname = os.path.dirname(path)
+   if len(dirname) > 0:
+      os.makedirs(dirname, exist_ok=True)
+   fd, tmp_path = tempfile.mkstemp(dir=dirname if len(dirname) > 0 else '.', suffix='.tmp')
+   try:
+      with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+         fh.write(json.dumps(document)) #json.dumps uses the C encoder, json.dump does not
+      os.replace(tmp_path, path)
+   except Exception:
+      os.unlink(tmp_path)
+      raise
+
+class _Table:
+   """
+   List of unique items, index returns the position of an item (appending it the first time it is seen).
+   Items are identified by key, which defaults to the item itself.
+   """
+   def __init__(self):
+      self.items = []
+      self.indexes = {}
+
+   def index(self, item, key=None):
+      if key is None:
+         key = item
+      i = self.indexes.get(key)
+      if i is None:
+         i = self.indexes[key] = len(self.items)
+         self.items.append(item)
+      return i
+
+def _encode_node(node):
+   signatures = _Table()
+   attributes = _Table()
+   def encode_port(port):
+      return [port.name, signatures.index(port.dsg.to_string(normalized=True)),
+              attributes.index(str(port.attr)) if port.attr is not None else None]
+   require = [encode_port(port) for port in node.requirePorts]
+   provide = [encode_port(port) for port in node.providePorts]
+   return {'name': node.name,
+           'types': [[dataType.name, dataType.dsg.to_string(normalized=True), str(dataType.attr) if dataType.attr is not None else None]
+                     for dataType in node.dataTypes],
+           'signatures': signatures.items, 'attributes': attributes.items,
+           'require': require, 'provide': provide}
+
+def _decode_node(document):
+   """
+   Creates the node stored by _encode_node. Ports with equal data signatures (or attributes) share one DataSignature (PortAttribute).
+   """
+   node = apx.Node(document['name'])
+   for name, dsg, attr in document['types']:
+      node.add_type(apx.DataType(name, dsg, attr))
+   signatures = [apx.DataSignature(dsg) for dsg in document['signatures']]
+   attributes = [apx.PortAttribute(attr) for attr in document['attributes']]
+   for name, dsg, attr in document['require']:
+      node.add_require_port(apx.RequirePort(name, signatures[dsg], attributes[attr] if attr is not None else None))
+   for name, dsg, attr in document['provide']:
+      node.add_provide_port(apx.ProvidePort(name, signatures[dsg], attributes[attr] if attr is not None else None))
+   return node
+
+def _encode_ports(ports, init_data, programs, codecs):
+   return {'ports': [[data_offset, data_len, programs.index(bytes(program)), _codec_index(codecs, codec)]
+                     for data_offset, data_len, program, codec in ports],
+           'init': bytes(init_data).hex()}
+
+def _codec_index(codecs, codec):
+   if codec is None:
+      return None
+   if isinstance(codec, StructCodec):
+      key = (BACKEND_STRUCT, codec.struct.format, codec.is_record,
+             tuple((field.name, field.kind, field.count, field.index, field.typecode) for field in codec.fields))
+   else:
+      key = (BACKEND_PYTHON, codec.signature, codec.compact_arrays, codec.raw_strings)
+   return codecs.index(codec, key)
+
+def _decode_ports(document, programs, codecs):
+   ports = [(int(data_offset), int(data_len), programs[program], codecs[codec] if codec is not None else None)
+            for data_offset, data_len, program, codec in document['ports']]
+   return ports, bytearray.fromhex(document['init'])
+
+def _encode_codec(codec):
+   if codec is None:
+      return None
+   elif isinstance(codec, StructCodec):
+      return {'type': BACKEND_STRUCT, 'format': codec.struct.format, 'record': codec.is_record,
+              'fields': [[field.name, field.kind, field.count, field.index, field.typecode] for field in codec.fields]}
+   elif isinstance(codec, PyCodec):
+      return {'type': BACKEND_PYTHON, 'signature': codec.signature, 'format': codec.struct.format,
+              'compact': codec.compact_arrays, 'raw': codec.raw_strings}
+   else:
+      raise NotImplementedError(type(codec))
+
+def _decode_codec(spec):
+   if spec is None:
+      return None
+   elif spec['type'] == BACKEND_STRUCT:
+      return StructCodec(spec['format'], [StructField(*field) for field in spec['fields']], spec['record'])
+   elif spec['type'] == BACKEND_PYTHON:
+      try:
+         dataElement = apx.DataSignature(spec['signature']).dataElement
+      except apx.ParseError:
+         raise ValueError(spec['signature'])
+      codec = apx.compiler.Compiler().compilePyCodec(dataElement, bool(spec['compact']), bool(spec['raw']))
+      if codec is None or codec.struct.format != spec['format']:
+         raise ValueError(spec['signature'])
+      return codec
+   else:
+      raise ValueError(spec['type'])
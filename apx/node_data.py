@@ -3,9 +3,103 @@ import abc
 import struct
 from collections import namedtuple
 import threading
+import bisect
+import weakref
+import itertools
 
 PortMapRange = namedtuple('PortMapRange', "data_offset data_len port")
 
+SPAN_CHUNK_PORTS = 32 #require ports are grouped into chunks of this many ports, each chunk has its own span codec
+SPAN_UNPACK_MIN_PORTS = 8 #notified ports of one chunk that are decoded using the chunk's span codec instead of one by one
+SPAN_CHUNK_BUILD_AFTER = 2 #the span codec of a chunk is generated by the chunk's second notification of SPAN_UNPACK_MIN_PORTS ports
+SPAN_UNSUPPORTED = object() #stored in NodeData.inPortSpanCodecs for chunks the span codec generator can't handle
+
+class PortIntervalIndex:
+   """
+   Maps byte offsets of a port data file to ports using the sorted start offsets of the ports and binary search.
+   Memory usage is proportional to the number of ports, not to the length of the file.
+
+   len(index) is the number of mapped bytes, index[offset] returns the port containing the byte at offset.
+   generations[port.id] is incremented each time the data of the port is written to (see touch).
+   """
+   def __init__(self):
+      self.starts = [] #start offset of each port (ascending)
+      self.ports = []
+      self.end = 0 #end offset of the last port
+      self.generations = [] #length: highest port id + 1
+
+   def append(self, port, start_offset, data_len):
+      """
+      Adds port which occupies data_len bytes from start_offset. Ports must be appended in offset order without gaps.
+      """
+      if start_offset != self.end:
+         raise ValueError('Port {} must start at offset {:d}, got {:d}'.format(port.name, self.end, start_offset))
+      while len(self.generations) <= port.id:
+         self.generations.append(0)
+      if data_len > 0:
+         self.starts.append(start_offset)
+         self.ports.append(port)
+         self.end = start_offset+data_len
+
+   def find(self, offset):
+      """
+      Returns position in self.ports of the port containing the byte at offset
+      """
+      if offset < 0 or offset >= self.end:
+         raise IndexError('offset {:d} is outside of mapped range (0..{:d})'.format(offset, self.end))
+      return bisect.bisect_right(self.starts, offset)-1
+
+   def touch(self, start_offset, data_len):
+      """
+      Increments the generation counter of each port overlapping data_len bytes from start_offset
+      """
+      end_offset = min(start_offset+data_len, self.end)
+      if data_len <= 0 or start_offset >= end_offset:
+         return
+      starts = self.starts
+      ports = self.ports
+      generations = self.generations
+      i = bisect.bisect_right(starts, start_offset)-1
+      num_ports = len(starts)
+      while i < num_ports and starts[i] < end_offset:
+         generations[ports[i].id]+=1
+         i+=1
+
+   def __len__(self):
+      return self.end
+
+   def __getitem__(self, offset):
+      return self.ports[self.find(offset)]
+
+class WriteTransaction:
+   """
+   Context manager returned by NodeData.transaction.
+
+   Provide port writes made by the thread inside the with-block are packed immediately (invalid values raise at the
+   write) but only reach the output file when the outermost transaction of the thread ends without an exception.
+   The buffered ports are then written as a minimal set of byte ranges sent with the RMF more bit, so the receiver sees
+   them as one update. Leaving the block with an exception discards the buffered writes.
+   """
+   def __init__(self, node_data):
+      self.node_data = node_data
+      self.pending = None #dict port_id -> (value, packed data), None for nested transactions
+      self.ranges = None #(offset, length) tuples written by commit
+
+   def __enter__(self):
+      local = self.node_data.threadLocal
+      if getattr(local, 'transaction', None) is None:
+         self.pending = {}
+         local.transaction = self
+      return self
+
+   def __exit__(self, exc_type, exc_value, traceback):
+      if self.pending is not None:
+         self.node_data.threadLocal.transaction = None
+         if exc_type is None:
+            self.ranges = self.node_data._commitTransaction(self.pending)
+         self.pending = None
+      return False
+
 class NodeDataClient(metaclass=abc.ABCMeta):
    @abc.abstractmethod
    def on_require_port_data(self, port, value):
@@ -18,38 +112,132 @@ class NodeDataClient(metaclass=abc.ABCMeta):
 class NodeData():
    """
    APX NodeData class
+
+   backend: selects how port data is packed/unpacked (apx.BACKEND_STRUCT, apx.BACKEND_PYTHON or apx.BACKEND_VM)
+   compact_arrays: when True, integer array ports are read as array.array instead of list
+   raw_strings: when True, string ports (and string fields) are read as bytes without UTF-8 decoding (trailing NUL
+                characters are removed) and must be written as bytes
+   detect_changes: when True, remote writes only notify nodeDataClient about require ports whose data actually changed
+                   since the previous notification (see notification_stats). The first write after the option is enabled
+                   or the input file is (re)opened always notifies all ports it covers. Can be switched at any time by
+                   setting the detect_changes attribute.
+   reuse_containers: when True, the dict/list returned for a require port is cached and updated in-place on every
+                     subsequent read (and notification) of that port instead of being reallocated
+   cache_dir: directory of the on-disk artefact cache (see apx.node_cache). When set, port offsets, programs, codecs and
+              init data are loaded from the cache file matching the APX text, or written to it after being computed.
+   checked_pack: when True, values written to provide ports are validated against the range limits of the port's data
+                 signature before being packed (ValueError is raised for invalid values). Can be switched at any time
+                 by setting the checked_pack attribute.
+   cache_values: when True, the decoded value of each require port is cached until the port's data is written to again
+                 (tracked by the generation counters of inPortByteMap). Repeated reads of an unchanged port return the
+                 same object, dict/list values must therefore not be modified by the caller.
    """
 
-   def __init__(self,node):
+   def __init__(self, node, backend=apx.BACKEND_STRUCT, compact_arrays=False, reuse_containers=False, cache_dir=None, checked_pack=False, raw_strings=False, detect_changes=False, cache_values=False):
       if isinstance(node, apx.Node):
           self.node=node
           context=apx.Context()
           context.append(node)
           apx_text=context.dumps()
       elif isinstance(node, str):
-         parser = apx.Parser()
          apx_text=node
-         self.node = parser.loads(apx_text)
       else:
          raise NotImplementedError(type(node))
+      artefacts = None
+      if cache_dir is not None:
+         cache_file = apx.node_cache.cache_path(cache_dir, apx_text, backend, compact_arrays, raw_strings)
+         artefacts = apx.node_cache.load(cache_file)
+      if isinstance(node, str):
+         if artefacts is not None:
+            self.node = artefacts['node'] #cache hit, the APX text does not need to be parsed
+            self.node.text = apx_text
+         else:
+            self.node = apx.Parser().loads(apx_text)
 
       compiler = apx.compiler.Compiler()
       self.name=self.node.name
-      self.inPortByteMap = [] #length: length of self.inPortDataFile
+      self.backend=backend
+      self.compact_arrays=compact_arrays
+      self.raw_strings=raw_strings
+      self.reuse_containers=reuse_containers
+      self.checked_pack=checked_pack
+      self.inPortByteMap = PortIntervalIndex() #maps byte offsets of self.inPortDataFile to require ports
       self.inPortDataMap = [] #length: number of require ports
       self.outPortDataMap = [] #length: number of provide ports
       self.inPortPrograms = [] #length: number of require ports
       self.outPortPrograms = [] #length: number of provide ports
+      self.inPortCodecs = [] #length: number of require ports, None where the VM program must be used
+      self.outPortCodecs = [] #length: number of provide ports, None where the VM program must be used
       self.outPortValues = [] #length: number of provide ports
-      self.inPortDataFile = self._createInPortDataFile(self.node, compiler) if len(self.node.requirePorts)>0 else None
-      self.outPortDataFile = self._createOutPortDataFile(self.node, compiler) if len(self.node.providePorts)>0 else None
-      self.definitionFile = self._createDefinitionFile(node.name,apx_text)      
-      self.vm = apx.VM()
-      self.lock=threading.Lock() #the virtual machine is not thread-safe, use this lock to protect it in case users try to read/write ports from multiple threads
+      self.outPortBoundsChecks = [None]*len(self.node.providePorts) #length: number of provide ports, compiled on first checked write
+      self.inPortValues = [None]*len(self.node.requirePorts) #length: number of require ports, only used when reuse_containers is True
+      self.inPortFieldCodecs = [{} for port in self.node.requirePorts] #length: number of require ports, (offset, codec) keyed by field path
+      #length: number of chunks of require ports (see SPAN_CHUNK_PORTS), SpanCodec, SPAN_UNSUPPORTED or number of notifications before the codec is generated
+      self.inPortSpanCodecs = [0]*((len(self.node.requirePorts)+SPAN_CHUNK_PORTS-1)//SPAN_CHUNK_PORTS)
+      self.inPortNotifyCount = [0]*len(self.node.requirePorts) #length: number of require ports, notifications sent to nodeDataClient
+      self.inPortSuppressedCount = [0]*len(self.node.requirePorts) #length: number of require ports, notifications skipped (data unchanged)
+      self.inPortValueCache = [None]*len(self.node.requirePorts) #length: number of require ports, (generation, value) when cache_values is True
+      if artefacts is not None and self._isValidArtefacts(artefacts):
+         self.inPortDataFile = self._loadPortDataFile(self.node.requirePorts, artefacts['in'], True)
+         self.outPortDataFile = self._loadPortDataFile(self.node.providePorts, artefacts['out'], False)
+      else:
+         self.inPortDataFile = self._createInPortDataFile(self.node, compiler) if len(self.node.requirePorts)>0 else None
+         self.outPortDataFile = self._createOutPortDataFile(self.node, compiler) if len(self.node.providePorts)>0 else None
+         if cache_dir is not None:
+            apx.node_cache.save(cache_file, self._cacheArtefacts())
+      self.definitionFile = self._createDefinitionFile(self.name,apx_text)
+      self.threadLocal = threading.local() #the virtual machine is not thread-safe, each thread gets its own VM (see self.vm)
+      self.vms = weakref.WeakSet() #VMs created by self.vm, a VM is dropped when its thread ends
+      self.vmsLock = threading.Lock()
+      self.profiler = None
+      #copy of inPortDataFile.data as of the latest notification of each port, used to detect changed ports.
+      #Allocated by the first remote write after detect_changes is enabled or the input file is opened.
+      self.inPortNotifiedData = None
+      self.detect_changes=detect_changes
       if self.inPortDataFile is not None:
          self.inPortDataFile.nodeDataHandler=self
+      self.cache_values=cache_values
       self.nodeDataClient=None
 
+   @property
+   def vm(self):
+      """
+      The VM of the calling thread. Ports can be read and written from multiple threads in parallel without sharing a VM.
+      """
+      try:
+         return self.threadLocal.vm
+      except AttributeError:
+         vm = apx.VM(compact_arrays=self.compact_arrays, raw_strings=self.raw_strings)
+         if self.profiler is not None:
+            vm.enable_profiling(self.profiler)
+         self.threadLocal.vm = vm
+         with self.vmsLock:
+            self.vms.add(vm)
+         return vm
+
+   def enable_profiling(self):
+      """
+      Enables profiling of the VMs used by this node (ports using the VM programs, see backend).
+      Programs are labeled with their port names. Returns the shared apx.VmProfiler.
+      """
+      self.profiler = apx.VmProfiler()
+      for program, port in zip(self.inPortPrograms, self.node.requirePorts):
+         self.profiler.set_label(program, port.name)
+      for program, port in zip(self.outPortPrograms, self.node.providePorts):
+         self.profiler.set_label(program, port.name)
+      with self.vmsLock:
+         vms = list(self.vms)
+      for vm in vms:
+         vm.enable_profiling(self.profiler)
+      return self.profiler
+
+   def disable_profiling(self):
+      self.profiler = None
+      with self.vmsLock:
+         vms = list(self.vms)
+      for vm in vms:
+         vm.disable_profiling()
+
    def _createInPortDataFile(self, node, compiler):
       offset=0
       init_data = bytearray()
@@ -59,6 +247,7 @@ class NodeData():
          packLen = port.dsg.packLen()
          self.mapInPort(port, offset, packLen)
          self.createUnpackProg(port, dataElement, compiler)
+         self.inPortCodecs.append(compiler.compileCodec(dataElement, self.backend, self.compact_arrays, self.raw_strings))
          offset+=packLen
          if port.attr is not None and port.attr.initValue is not None:
             init_data.extend(dataElement.createInitData(port.attr.initValue))
@@ -79,6 +268,7 @@ class NodeData():
          packLen = port.dsg.packLen()
          self.mapOutPort(port, offset, packLen)
          self.createPackProg(port, dataElement, compiler)
+         self.outPortCodecs.append(compiler.compileCodec(dataElement, self.backend, self.compact_arrays, self.raw_strings))
          self.createOutPortValue(port)
          offset+=packLen
          if port.attr is not None and port.attr.initValue is not None:
@@ -93,38 +283,158 @@ class NodeData():
       return None
 
 
+   def _isValidArtefacts(self, artefacts):
+      return (len(artefacts['in'][0]) == len(self.node.requirePorts)) and (len(artefacts['out'][0]) == len(self.node.providePorts))
+
+   def _loadPortDataFile(self, ports, artefacts, isInput):
+      """
+      Creates port maps, programs, codecs and the port data file from artefacts loaded from the cache
+      """
+      portArtefacts, init_data = artefacts
+      for port, (data_offset, data_len, program, codec) in zip(ports, portArtefacts):
+         if isInput:
+            self.mapInPort(port, data_offset, data_len)
+            self.inPortPrograms.append(program)
+            self.inPortCodecs.append(codec)
+         else:
+            self.mapOutPort(port, data_offset, data_len)
+            self.outPortPrograms.append(program)
+            self.outPortCodecs.append(codec)
+            self.createOutPortValue(port)
+      if len(init_data) > 0:
+         if isInput:
+            return apx.InputFile(self.name+'.in', len(init_data), init_data)
+         return apx.OutputFile(self.name+'.out', len(init_data), init_data)
+      return None
+
+   def _cacheArtefacts(self):
+      """
+      Returns the derived artefacts (see apx.node_cache.save) of a newly created NodeData
+      """
+      result = {'node': self.node}
+      for key, portMap, programs, codecs, file in [('in', self.inPortDataMap, self.inPortPrograms, self.inPortCodecs, self.inPortDataFile),
+                                                   ('out', self.outPortDataMap, self.outPortPrograms, self.outPortCodecs, self.outPortDataFile)]:
+         ports = [(elem.data_offset, elem.data_len, program, codec) for elem, program, codec in zip(portMap, programs, codecs)]
+         result[key] = (ports, file.data if file is not None else bytes())
+      return result
+
    def _createDefinitionFile(self, node_name, apx_text):
       file = apx.OutputFile(node_name+'.apx', len(apx_text))
       file.write(0,bytes(apx_text, encoding='ascii'))
       return file
 
+   @property
+   def detect_changes(self):
+      return self._detect_changes
+
+   @detect_changes.setter
+   def detect_changes(self, value):
+      self._detect_changes = value
+      self.inPortNotifiedData = None #data notified before the option was (re)enabled is not known
+
+   @property
+   def cache_values(self):
+      return self._cache_values
+
+   @cache_values.setter
+   def cache_values(self, value):
+      self._cache_values = value
+      #writes are only tracked (inPortDataFile.portIndex) while values are cached, entries from before are stale
+      self.inPortValueCache = [None]*len(self.node.requirePorts)
+      if self.inPortDataFile is not None:
+         self.inPortDataFile.portIndex = self.inPortByteMap if value else None
+
+   def inPortDataOpen(self, file):
+      """
+      Called when the input file is opened, the next write is notified in full (even data equal to the init data)
+      """
+      self.inPortNotifiedData = None
+
    def inPortDataWriteNotify(self, file, write_offset: int, write_len : int):
       """
       Called by FileManager when it receives a remote write in the node's inPortData file
       """
       if self.nodeDataClient is not None:
-         for (port, data_offset, data_len) in self.byte_to_port(write_offset, write_len):
-            value = self._unpackRequirePort(port.id, data_offset, data_len)
-            self.nodeDataClient.on_require_port_data(port, value)
+         ports = list(self.byte_to_port(write_offset, write_len))
+         if self._detect_changes:
+            ports = self._changedPorts(file, ports)
+         if len(ports) >= SPAN_UNPACK_MIN_PORTS and not self.reuse_containers:
+            for chunk, items in itertools.groupby(ports, key=lambda item: item[0].id // SPAN_CHUNK_PORTS):
+               items = list(items)
+               codec = self._spanCodec(chunk, False) if len(items) >= SPAN_UNPACK_MIN_PORTS else None
+               if codec is not None:
+                  start = chunk*SPAN_CHUNK_PORTS
+                  values = self._unpackChunk(chunk, codec)
+                  values = [values[port.id-start] for (port, data_offset, data_len) in items]
+               else:
+                  values = [self._readRequirePort(port.id, data_offset, data_len) for (port, data_offset, data_len) in items]
+               for (port, data_offset, data_len), value in zip(items, values):
+                  self.inPortNotifyCount[port.id]+=1
+                  self.nodeDataClient.on_require_port_data(port, value)
+         else:
+            for (port, data_offset, data_len) in ports:
+               value = self._readRequirePort(port.id, data_offset, data_len)
+               self.inPortNotifyCount[port.id]+=1
+               self.nodeDataClient.on_require_port_data(port, value)
+
+   def _changedPorts(self, file, ports):
+      """
+      Returns the items of ports (see byte_to_port) whose data differs from the data of their previous notification
+      """
+      if len(ports) == 0:
+         return ports
+      changed = []
+      with file.dataLock:
+         data = file.data
+         notified = self.inPortNotifiedData
+         if notified is None:
+            #nothing to compare with yet, all ports are treated as changed
+            self.inPortNotifiedData = bytearray(data)
+            return ports
+         begin = ports[0][1]
+         end = ports[-1][1]+ports[-1][2]
+         if data[begin:end] != notified[begin:end]:
+            for item in ports:
+               port, data_offset, data_len = item
+               port_end = data_offset+data_len
+               if data[data_offset:port_end] != notified[data_offset:port_end]:
+                  notified[data_offset:port_end] = data[data_offset:port_end]
+                  changed.append(item)
+      if len(changed) < len(ports):
+         changed_ids = {port.id for port, data_offset, data_len in changed}
+         for port, data_offset, data_len in ports:
+            if port.id not in changed_ids:
+               self.inPortSuppressedCount[port.id]+=1
+      return changed
+
+   def notification_stats(self):
+      """
+      Returns dict with the total number of require port notifications sent to nodeDataClient ('notified') and the number of
+      notifications skipped because the port data was unchanged ('suppressed'). Per-port counters are found in
+      inPortNotifyCount and inPortSuppressedCount.
+      """
+      return {'notified': sum(self.inPortNotifyCount), 'suppressed': sum(self.inPortSuppressedCount)}
 
    def byte_to_port(self, start_offset, data_len):
       """
       Returns an iterator which yields a sequence of ports triggered by the data update
       """
-      data_offset = start_offset
       end_offset = start_offset+data_len
-      file_len = len(self.inPortByteMap)
+      index = self.inPortByteMap
+      file_len = len(index)
       if start_offset > file_len:
          raise ValueError('start_offset ({:d}) is beyond length of file ({:d})'.format(start_offset, file_len))
       if end_offset > file_len:
          raise ValueError('end_offset ({:d}) is beyond length of file ({:d})'.format(end_offset, file_len))
-      while data_offset < end_offset:
-         port = self.inPortByteMap[data_offset]
-         mapping = self.inPortDataMap[port.id]
-         assert(mapping.port is port)
-         next_offset = mapping.data_offset+mapping.data_len
-         yield port,mapping.data_offset,mapping.data_len
-         data_offset=next_offset
+      if start_offset < end_offset:
+         i = index.find(start_offset)
+         num_ports = len(index.ports)
+         while i < num_ports and index.starts[i] < end_offset:
+            port = index.ports[i]
+            mapping = self.inPortDataMap[port.id]
+            assert(mapping.port is port)
+            yield port,mapping.data_offset,mapping.data_len
+            i+=1
 
 
    def write_provide_port(self, port_id, value):
@@ -136,6 +446,53 @@ class NodeData():
       assert(port_id == port_map.port.id)
       return self._packProvidePort(port_id, port_map.data_offset, port_map.data_len, value)
 
+   def write_many(self, values):
+      """
+      Writes several provide ports at once, values is a dict (or sequence of key-value pairs) of port (or port id) and value.
+      All values are packed (and checked when checked_pack is set) before the output file is modified, the file manager is
+      then notified once per contiguous range of written bytes instead of once per port.
+      Returns list of (offset, length) tuples of the written ranges.
+      """
+      if isinstance(values, dict):
+         values = values.items()
+      chunks = []
+      packed = []
+      for (port_id, value) in values:
+         if isinstance(port_id, apx.Port):
+            port_id = port_id.id
+         if not isinstance(port_id, int):
+            raise ValueError('port_id must be integer')
+         port_map = self.outPortDataMap[port_id]
+         assert(port_id == port_map.port.id)
+         chunks.append((port_map.data_offset, self._packProvidePortData(port_id, port_map.data_len, value)))
+         packed.append((port_id, value))
+      if len(chunks) == 0:
+         return []
+      transaction = getattr(self.threadLocal, 'transaction', None)
+      if transaction is not None:
+         for (port_id, value), (offset, data) in zip(packed, chunks):
+            transaction.pending[port_id] = (value, data)
+         return []
+      for (port_id, value) in packed:
+         self.outPortValues[port_id]=value
+      return self.outPortDataFile.write_ranges(chunks)
+
+   def transaction(self):
+      """
+      Returns a context manager (WriteTransaction) which buffers the provide port writes of the calling thread and writes
+      them to the output file as one update when the with-block ends. Nested transactions join the outermost one.
+      """
+      return WriteTransaction(self)
+
+   def _commitTransaction(self, pending):
+      if len(pending) == 0:
+         return []
+      chunks = []
+      for port_id, (value, data) in pending.items():
+         self.outPortValues[port_id]=value
+         chunks.append((self.outPortDataMap[port_id].data_offset, data))
+      return self.outPortDataFile.write_ranges(chunks, more_bit=True)
+
    def read_provide_port(self, port_id):
       if isinstance(port_id, apx.Port):
          port_id = port_id.id
@@ -143,42 +500,223 @@ class NodeData():
          raise ValueError('port_id must be integer')
       port_map = self.outPortDataMap[port_id]
       assert(port_id == port_map.port.id)
+      transaction = getattr(self.threadLocal, 'transaction', None)
+      if transaction is not None and port_id in transaction.pending:
+         return transaction.pending[port_id][0]
       return self.outPortValues[port_id]      
 
    def _packProvidePort(self, port_id, data_offset, data_len, value):
-      program = self.outPortPrograms[port_id]
-      data = bytearray(data_len)
-      self.lock.acquire()
-      self.vm.exec_pack_prog(program, data, 0, value)
+      data = self._packProvidePortData(port_id, data_len, value)
+      transaction = getattr(self.threadLocal, 'transaction', None)
+      if transaction is not None:
+         transaction.pending[port_id] = (value, data)
+         return
       self.outPortValues[port_id]=value
-      self.lock.release()      
       self.outPortDataFile.write(data_offset, data)
 
-   def read_require_port(self, port_id):
+   def _packProvidePortData(self, port_id, data_len, value):
+      """
+      Returns bytearray containing the packed port value
+      """
+      if self.checked_pack:
+         self._checkProvidePort(port_id, value)
+      codec = self.outPortCodecs[port_id]
+      data = bytearray(data_len)
+      if codec is not None:
+         codec.pack(value, data, 0)
+      else:
+         self.vm.exec_pack_prog(self.outPortPrograms[port_id], data, 0, value)
+      return data
+
+   def _checkProvidePort(self, port_id, value):
+      check = self.outPortBoundsChecks[port_id]
+      port = self.outPortDataMap[port_id].port
+      if check is None:
+         dataElement = port.dsg.resolve_data_element(self.node.dataTypes)
+         check = apx.compiler.Compiler().compileBoundsCheck(dataElement)
+         self.outPortBoundsChecks[port_id] = check
+      check.check(value, port.name)
+
+   def read_require_port(self, port_id, target=None):
+      """
+      Returns the current value of require port.
+      target: optional dict (record ports) or list (array ports) owned by the caller which is updated in-place
+      """
       if isinstance(port_id, apx.Port):
          port_id = port_id.id
       if not isinstance(port_id, int):
          raise ValueError('port_id must be integer')
       port_map = self.inPortDataMap[port_id]
       assert(port_id == port_map.port.id)
-      return self._unpackRequirePort(port_id, port_map.data_offset, port_map.data_len)
+      if target is not None:
+         return self._unpackRequirePort(port_id, port_map.data_offset, port_map.data_len, target)
+      return self._readRequirePort(port_id, port_map.data_offset, port_map.data_len)
 
-   def _unpackRequirePort(self, port_id, data_offset, data_len):
-      program = self.inPortPrograms[port_id]
-      data=self.inPortDataFile.read(data_offset, data_len)
-      if data is None:
-         raise RuntimeError('Failed to read data at offset={:d}, len={:d}'.format(data_offset, data_len))
-      self.lock.acquire()
-      self.vm.exec_unpack_prog(program, data, 0)
-      value = self.vm.value
-      self.lock.release()
+   def _readRequirePort(self, port_id, data_offset, data_len):
+      """
+      Returns the value of require port from the value cache when its generation is current, unpacks (and caches) it otherwise
+      """
+      if not self.cache_values:
+         return self._unpackRequirePort(port_id, data_offset, data_len)
+      generation = self.inPortByteMap.generations[port_id] #read before unpacking, a concurrent write invalidates the entry
+      entry = self.inPortValueCache[port_id]
+      if entry is not None and entry[0] == generation:
+         return entry[1]
+      value = self._unpackRequirePort(port_id, data_offset, data_len)
+      self.inPortValueCache[port_id] = (generation, value)
+      return value
+
+   def read_require_ports(self, start=0, stop=None):
+      """
+      Returns list with the current values of the require ports with port id start, start+1, ..., stop-1 (all require ports by default).
+      The ports are decoded from a single copy of the input file and form a consistent snapshot of the file.
+      """
+      num_ports = len(self.node.requirePorts)
+      if stop is None:
+         stop = num_ports
+      if start < 0 or stop > num_ports or start > stop:
+         raise ValueError('Invalid port span: {:d}..{:d} (number of require ports: {:d})'.format(start, stop, num_ports))
+      if start == stop:
+         return []
+      first_chunk = start // SPAN_CHUNK_PORTS
+      last_chunk = (stop-1) // SPAN_CHUNK_PORTS
+      base = self.inPortDataMap[first_chunk*SPAN_CHUNK_PORTS].data_offset
+      end = self.inPortDataMap[min((last_chunk+1)*SPAN_CHUNK_PORTS, num_ports)-1]
+      data = self._snapshot(base, end.data_offset+end.data_len-base)
+      values = []
+      for chunk in range(first_chunk, last_chunk+1):
+         chunk_start = chunk*SPAN_CHUNK_PORTS
+         begin, end = max(start, chunk_start), min(stop, chunk_start+SPAN_CHUNK_PORTS)
+         codec = self._spanCodec(chunk, True)
+         if codec is not None:
+            values.extend(codec.unpack(data, self.inPortDataMap[chunk_start].data_offset-base)[begin-chunk_start:end-chunk_start])
+         else:
+            values.extend(self._decodeRequirePort(port_id, data, self.inPortDataMap[port_id].data_offset-base)
+                          for port_id in range(begin, end))
+      return values
+
+   def read_require_port_field(self, port_id, path):
+      """
+      Returns the value of a single field of require port, e.g. "Id", "SensorData.x" or "Data[3]".
+      Only the bytes of the selected field are decoded.
+      """
+      if isinstance(port_id, apx.Port):
+         port_id = port_id.id
+      if not isinstance(port_id, int):
+         raise ValueError('port_id must be integer')
+      port_map = self.inPortDataMap[port_id]
+      assert(port_id == port_map.port.id)
+      fieldCodecs = self.inPortFieldCodecs[port_id]
+      try:
+         offset, codec = fieldCodecs[path]
+      except KeyError:
+         dataElement = port_map.port.dsg.resolve_data_element(self.node.dataTypes)
+         offset, codec = apx.compiler.Compiler().compileFieldCodec(dataElement, path, self.compact_arrays, self.raw_strings)
+         fieldCodecs[path] = (offset, codec)
+      data = self._snapshot(port_map.data_offset+offset, codec.size)
+      return codec.unpack(data, 0)
+
+   def _snapshot(self, data_offset, data_len):
+      """
+      Returns copy of data_len bytes of inPortDataFile.data from data_offset.
+      The file's data lock is only held while copying, decoding is done outside of the lock on the (consistent) copy.
+      """
+      file = self.inPortDataFile
+      with file.dataLock:
+         return file.data[data_offset:data_offset+data_len]
+
+   def _unpackRequirePort(self, port_id, data_offset, data_len, target=None):
+      """
+      Unpacks the port value from a snapshot of the port data (see _snapshot), remote writes cannot modify the port data
+      in the middle of a read.
+      """
+      if target is None and self.reuse_containers:
+         target = self.inPortValues[port_id]
+      value = self._decodeRequirePort(port_id, self._snapshot(data_offset, data_len), 0, target)
+      if self.reuse_containers:
+         self.inPortValues[port_id] = value
       return value
 
+   def _decodeRequirePort(self, port_id, data, offset, target=None):
+      """
+      Decodes the value of require port from data (a snapshot of the input file) at offset
+      """
+      codec = self.inPortCodecs[port_id]
+      if codec is not None:
+         if target is None:
+            return codec.unpack(data, offset)
+         return codec.unpack_into(target, data, offset)
+      return self.vm.exec_unpack_prog(self.inPortPrograms[port_id], data, offset, target)
+
+   def _spanCodec(self, chunk, build):
+      """
+      Returns the span codec of chunk, None when the chunk's ports must be decoded one by one.
+      The codec is generated when build is True or by the SPAN_CHUNK_BUILD_AFTER:th call, a single large write (e.g. the
+      first write after connecting) is decoded port by port instead of waiting for the generator.
+      """
+      codec = self.inPortSpanCodecs[chunk]
+      if isinstance(codec, int):
+         if not build and codec+1 < SPAN_CHUNK_BUILD_AFTER:
+            self.inPortSpanCodecs[chunk] = codec+1
+            return None
+         codec = self.inPortSpanCodecs[chunk] = self._createSpanCodec(chunk)
+      return codec if codec is not SPAN_UNSUPPORTED else None
+
+   def _createSpanCodec(self, chunk):
+      """
+      Returns SpanCodec for the require ports of chunk, or SPAN_UNSUPPORTED (which is stored like a codec, so the
+      generator isn't run again for the same chunk) when one of the ports can't be handled by the generator
+      """
+      start = chunk*SPAN_CHUNK_PORTS
+      dataElements = [port.dsg.resolve_data_element(self.node.dataTypes) for port in self.node.requirePorts[start:start+SPAN_CHUNK_PORTS]]
+      codec = apx.compiler.Compiler().compileSpanCodec(dataElements, self.compact_arrays, self.raw_strings)
+      return codec if codec is not None else SPAN_UNSUPPORTED
+
+   def _unpackChunk(self, chunk, codec):
+      """
+      Returns the values of all require ports of chunk, decoded by codec (the chunk's span codec) from a snapshot of the chunk
+      """
+      start = chunk*SPAN_CHUNK_PORTS
+      stop = min(start+SPAN_CHUNK_PORTS, len(self.inPortDataMap))
+      generations = self.inPortByteMap.generations[start:stop] if self.cache_values else None
+      values = codec.unpack(self._snapshot(self.inPortDataMap[start].data_offset, codec.size), 0)
+      if generations is not None:
+         self.inPortValueCache[start:stop] = zip(generations, values)
+      return values
+
+   def in_port_dtype(self):
+      """
+      Returns structured NumPy dtype describing the layout of inPortDataFile (one field per require port)
+      """
+      return apx.numpy_dtype.ports_dtype(self.node.requirePorts, self.node.dataTypes)
+
+   def out_port_dtype(self):
+      """
+      Returns structured NumPy dtype describing the layout of outPortDataFile (one field per provide port)
+      """
+      return apx.numpy_dtype.ports_dtype(self.node.providePorts, self.node.dataTypes)
+
+   def in_port_view(self, data=None):
+      """
+      Returns zero-copy NumPy record array view of inPortDataFile.data, or of data when given
+      (e.g. a stack of recorded snapshots of the input file).
+      """
+      if data is None:
+         data = self.inPortDataFile.data
+      return apx.numpy_dtype.view_records(data, self.in_port_dtype())
+
+   def out_port_view(self, data=None):
+      """
+      Returns zero-copy NumPy record array view of outPortDataFile.data, or of data when given
+      """
+      if data is None:
+         data = self.outPortDataFile.data
+      return apx.numpy_dtype.view_records(data, self.out_port_dtype())
+
    def mapInPort(self, port, start_offset, data_len):
       elem = PortMapRange(start_offset, data_len, port)
       self.inPortDataMap.append(elem)
-      for i in range(data_len):
-         self.inPortByteMap.append(port)
+      self.inPortByteMap.append(port, start_offset, data_len)
 
    def mapOutPort(self, port, start_offset, data_len):
       elem = PortMapRange(start_offset, data_len, port)
@@ -186,13 +724,13 @@ class NodeData():
 
    def createPackProg(self, port, dataElement, compiler):
       assert(isinstance(dataElement, apx.DataElement))
-      program = compiler.compilePackProg(dataElement)
+      program = compiler.getPackProg(dataElement)
       if len(self.outPortPrograms) != port.id:
          raise RuntimeError('port id {:d} of port {} is out of sync'.format(port.id, port.name))
       self.outPortPrograms.append(program)
 
    def createUnpackProg(self, port, dataElement, compiler):
-      program = compiler.compileUnpackProg(dataElement)
+      program = compiler.getUnpackProg(dataElement)
       if len(self.inPortPrograms) != port.id:
          raise RuntimeError('port id {:d} of port {} is out of sync'.format(port.id, port.name))
       self.inPortPrograms.append(program)
@@ -0,0 +1,64 @@
+"""
+Maps APX data signatures to NumPy structured dtypes.
+
+NumPy is an optional dependency, it's only imported when one of the functions in this module is called.
+"""
+from apx.base import *
+
+_numpy_format_map = {
+   UINT8_TYPE_CODE: 'u1',
+   UINT16_TYPE_CODE: '<u2',
+   UINT32_TYPE_CODE: '<u4',
+   UINT64_TYPE_CODE: '<u8',
+   SINT8_TYPE_CODE: 'i1',
+   SINT16_TYPE_CODE: '<i2',
+   SINT32_TYPE_CODE: '<i4',
+   SINT64_TYPE_CODE: '<i8',
+}
+
+def _import_numpy():
+   try:
+      import numpy
+   except ImportError:
+      raise ImportError('numpy is required for this feature, install it using "pip install numpy"')
+   return numpy
+
+def numpy_dtype(item):
+   """
+   Returns NumPy dtype with the same memory layout as item (DataSignature or resolved DataElement).
+   Strings (a[n]) map to fixed length byte strings, records map to structured dtypes and arrays map to subarrays.
+   """
+   np = _import_numpy()
+   if isinstance(item, DataSignature):
+      item = item.dataElement
+   dataElement = item.resolve_data_element()
+   if dataElement.typeCode == STRING_TYPE_CODE:
+      return np.dtype('S{:d}'.format(dataElement.arrayLen))
+   elif dataElement.typeCode == RECORD_TYPE_CODE:
+      base = np.dtype([(elem.name, numpy_dtype(elem)) for elem in dataElement.elements])
+   else:
+      try:
+         base = np.dtype(_numpy_format_map[dataElement.typeCode])
+      except KeyError:
+         raise NotImplementedError(dataElement.typeCode)
+   if dataElement.arrayLen is not None:
+      return np.dtype((base, (dataElement.arrayLen,)))
+   return base
+
+def ports_dtype(ports, typeList=None):
+   """
+   Returns structured NumPy dtype with one field per port (named after the port).
+   The field offsets follow the port order, which is the layout of the node's .in/.out data files.
+   """
+   np = _import_numpy()
+   return np.dtype([(port.name, numpy_dtype(port.dsg.resolve_data_element(typeList))) for port in ports])
+
+def view_records(data, dtype):
+   """
+   Returns zero-copy record array view of data (bytes, bytearray or memoryview).
+   data can hold a single snapshot of a port data file or a stack of snapshots (one record per snapshot).
+   """
+   np = _import_numpy()
+   if len(data) % dtype.itemsize != 0:
+      raise ValueError('Length of data ({:d}) is not a multiple of the record size ({:d})'.format(len(data), dtype.itemsize))
+   return np.frombuffer(data, dtype=dtype).view(np.recarray)
@@ -0,0 +1,167 @@
+"""
+Peephole optimizer for APX byte code programs (enabled using apx.Compiler(optimize=True)).
+
+The optimizer rewrites the output of the compiler into an equivalent but shorter program:
+ - record field names are moved into a key table at the start of the program, OPCODE_RECORD_SELECT is replaced by
+   OPCODE_RECORD_SELECT_KEY which refers to its key by index. Each name is stored once (the fields of an array of
+   records share the keys of the first array element).
+ - runs of two or more consecutive record fields having the same scalar type are merged into a single
+   OPCODE_PACK_FIELDS/OPCODE_UNPACK_FIELDS instruction.
+ - enter/leave instructions that have no effect are removed (the final OPCODE_RECORD_LEAVE of the program and
+   empty records in pack programs).
+Key indexes are single bytes, programs using more than 255 record keys are returned unoptimized.
+
+The VM executes both optimized and unoptimized programs.
+"""
+from apx.vm_base import *
+
+MAX_KEYS = 255 #key indexes are encoded as single bytes
+
+_scalar_opcodes = {OPCODE_PACK_U8, OPCODE_PACK_U16, OPCODE_PACK_U32, OPCODE_PACK_U64,
+                   OPCODE_PACK_S8, OPCODE_PACK_S16, OPCODE_PACK_S32, OPCODE_PACK_S64,
+                   OPCODE_UNPACK_U8, OPCODE_UNPACK_U16, OPCODE_UNPACK_U32, OPCODE_UNPACK_U64,
+                   OPCODE_UNPACK_S8, OPCODE_UNPACK_S16, OPCODE_UNPACK_S32, OPCODE_UNPACK_S64}
+
+_operand_lengths = {
+   OPCODE_PACK_PROG: 4, OPCODE_UNPACK_PROG: 4,
+   OPCODE_PACK_STR: 2, OPCODE_PACK_U8AR: 2, OPCODE_PACK_U16AR: 2, OPCODE_PACK_U32AR: 2,
+   OPCODE_PACK_S8AR: 2, OPCODE_PACK_S16AR: 2, OPCODE_PACK_S32AR: 2,
+   OPCODE_UNPACK_STR: 2, OPCODE_UNPACK_U8AR: 2, OPCODE_UNPACK_U16AR: 2, OPCODE_UNPACK_U32AR: 2,
+   OPCODE_UNPACK_S8AR: 2, OPCODE_UNPACK_S16AR: 2, OPCODE_UNPACK_S32AR: 2,
+   OPCODE_PACK_U64AR: 2, OPCODE_PACK_S64AR: 2, OPCODE_UNPACK_U64AR: 2, OPCODE_UNPACK_S64AR: 2,
+   OPCODE_RECORD_ARRAY: 2,
+}
+
+def split_instructions(code):
+   """
+   Splits unoptimized byte code program into a list of (opcode, operand) tuples.
+   The operand of OPCODE_RECORD_SELECT is the key name (str), for all other opcodes it's the raw operand bytes.
+   """
+   result = []
+   code_next = 0
+   code_end = len(code)
+   while code_next < code_end:
+      opcode = code[code_next]
+      code_next+=1
+      if opcode == OPCODE_RECORD_SELECT:
+         end = code.find(0, code_next)
+         if end < 0:
+            raise InvalidInstructionError('Expected NULL terminator before end of program')
+         result.append((opcode, code[code_next:end].decode('ascii')))
+         code_next = end+1
+      elif opcode in _operand_lengths or opcode in _scalar_opcodes or opcode in (OPCODE_RECORD_ENTER, OPCODE_RECORD_LEAVE, OPCODE_ARRAY_ENTER, OPCODE_ARRAY_LEAVE):
+         operand_len = _operand_lengths.get(opcode, 0)
+         if code_next+operand_len > code_end:
+            raise InvalidInstructionError('Expected {:d} additional bytes after the opcode'.format(operand_len))
+         result.append((opcode, bytes(code[code_next:code_next+operand_len])))
+         code_next+=operand_len
+      else:
+         raise UnknownOpCodeError('op_code = %d'%opcode)
+   return result
+
+def optimize_program(code):
+   """
+   Returns optimized version (bytes) of the byte code program created by apx.Compiler
+   """
+   instructions = split_instructions(code)
+   if len(instructions) == 0 or instructions[0][0] not in (OPCODE_PACK_PROG, OPCODE_UNPACK_PROG):
+      raise InvalidInstructionError('First instruction must be of type OPCODE_PACK_PROG or OPCODE_UNPACK_PROG')
+   is_pack = instructions[0][0] == OPCODE_PACK_PROG
+   body = instructions[1:]
+   if is_pack:
+      body = _remove_empty_records(body)
+   if len(body) > 0 and body[-1][0] == OPCODE_RECORD_LEAVE and body[0][0] == OPCODE_RECORD_ENTER:
+      body = body[:-1]
+   keys = _KeyTable()
+   result = bytearray()
+   i = 0
+   while i < len(body):
+      opcode, operand = body[i]
+      if opcode == OPCODE_RECORD_SELECT:
+         field_opcode = body[i+1][0] if i+1 < len(body) else None
+         count = 1
+         if field_opcode in _scalar_opcodes:
+            while (i+2*count+1 < len(body) and body[i+2*count][0] == OPCODE_RECORD_SELECT and
+                   body[i+2*count+1][0] == field_opcode):
+               count+=1
+         count = min(count, MAX_KEYS)
+         if count > 1:
+            result.append(OPCODE_PACK_FIELDS if is_pack else OPCODE_UNPACK_FIELDS)
+            result.append(field_opcode)
+            result.append(count)
+            result.append(keys.run_index([body[i+2*j][1] for j in range(count)]) & 0xFF)
+            i+=2*count
+            continue
+         result.append(OPCODE_RECORD_SELECT_KEY)
+         result.append(keys.index(operand) & 0xFF)
+      else:
+         result.append(opcode)
+         result.extend(operand)
+      i+=1
+   if len(keys.names) > MAX_KEYS:
+      return bytes(code)
+   header = bytearray([instructions[0][0]])
+   header.extend(instructions[0][1])
+   if len(keys.names) > 0:
+      header.append(OPCODE_KEY_TABLE)
+      header.append(len(keys.names))
+      for key in keys.names:
+         header.extend(key.encode('ascii'))
+         header.append(0)
+   return bytes(header+result)
+
+class _KeyTable:
+   """
+   Key table under construction, names already in the table are reused
+   """
+   def __init__(self):
+      self.names = []
+      self.indexes = {} #name -> index of its first occurrence in names
+
+   def index(self, name):
+      """
+      Returns index of name, it's appended to the table when not found
+      """
+      i = self.indexes.get(name)
+      if i is None:
+         i = len(self.names)
+         self._append(name)
+      return i
+
+   def run_index(self, names):
+      """
+      Returns index of the first key of a run of consecutive keys equal to names (used by OPCODE_PACK_FIELDS/OPCODE_UNPACK_FIELDS).
+      The run is appended to the table when not found.
+      """
+      count = len(names)
+      i = self.indexes.get(names[0])
+      while i is not None and i+count <= len(self.names):
+         if self.names[i:i+count] == names:
+            return i
+         i = self._find(names[0], i+1)
+      i = len(self.names)
+      for name in names:
+         self._append(name)
+      return i
+
+   def _find(self, name, start):
+      try:
+         return self.names.index(name, start)
+      except ValueError:
+         return None
+
+   def _append(self, name):
+      self.indexes.setdefault(name, len(self.names))
+      self.names.append(name)
+
+def _remove_empty_records(body):
+   """
+   Removes RECORD_SELECT, RECORD_ENTER, RECORD_LEAVE sequences (empty nested records), these do nothing in pack programs
+   """
+   result = []
+   for instruction in body:
+      result.append(instruction)
+      if (len(result) >= 3 and result[-3][0] == OPCODE_RECORD_SELECT and result[-2][0] == OPCODE_RECORD_ENTER and
+          result[-1][0] == OPCODE_RECORD_LEAVE):
+         del result[-3:]
+   return result
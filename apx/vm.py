@@ -1,15 +1,37 @@
 from apx.base import *
 from apx.vm_base import *
 from apx.vm_state import *
-from apx.vm_state import *
+from apx.vm_profiler import VmProfiler
 import struct
 import functools
+import array
+
+#scalar opcodes that can be used as field opcode of OPCODE_PACK_FIELDS/OPCODE_UNPACK_FIELDS
+_pack_field_opcodes = frozenset([OPCODE_PACK_U8, OPCODE_PACK_U16, OPCODE_PACK_U32, OPCODE_PACK_U64,
+                                 OPCODE_PACK_S8, OPCODE_PACK_S16, OPCODE_PACK_S32, OPCODE_PACK_S64])
+_unpack_field_opcodes = frozenset([OPCODE_UNPACK_U8, OPCODE_UNPACK_U16, OPCODE_UNPACK_U32, OPCODE_UNPACK_U64,
+                                   OPCODE_UNPACK_S8, OPCODE_UNPACK_S16, OPCODE_UNPACK_S32, OPCODE_UNPACK_S64])
+
+class VmProgram:
+    """
+    A byte-code program that has been decoded into a flat list of bound VM instructions.
+    Created by VM.load_program
+    """
+    def __init__(self, prog_type, data_len, instructions, opcodes=None, code=None):
+        self.prog_type = prog_type #PACK_PROG or UNPACK_PROG
+        self.data_len = data_len #value from the program header
+        self.instructions = instructions #list of (instruction, args) tuples, args is always a tuple
+        self.opcodes = opcodes #opcode of each instruction
+        self.code = code #the byte code program
 
 class VM:
     """
     APX Virtual Machine
+
+    compact_arrays: when True, unpack programs return integer arrays as array.array instead of list
+    raw_strings: when True, unpack programs return strings as bytes (without trailing NUL characters) instead of str
     """
-    def __init__(self, little_endian_format=True):
+    def __init__(self, little_endian_format=True, compact_arrays=False, raw_strings=False):
         self.opcode_parser_map = {
             OPCODE_PACK_PROG: self.parse_pack_prog,
             OPCODE_UNPACK_PROG: self.parse_unpack_prog,
@@ -44,8 +66,45 @@ class VM:
             OPCODE_RECORD_LEAVE: self.parse_record_leave,
             OPCODE_ARRAY_ENTER: self.parse_array_enter,
             OPCODE_ARRAY_LEAVE: self.parse_array_leave,
+            OPCODE_KEY_TABLE: self.parse_key_table,
+            OPCODE_RECORD_SELECT_KEY: self.parse_record_select_key,
+            OPCODE_PACK_FIELDS: self.parse_pack_fields,
+            OPCODE_UNPACK_FIELDS: self.parse_unpack_fields,
+            OPCODE_PACK_U64: self.parse_pack_u64,
+            OPCODE_PACK_S64: self.parse_pack_s64,
+            OPCODE_PACK_U64AR: self.parse_pack_u64_array,
+            OPCODE_PACK_S64AR: self.parse_pack_s64_array,
+            OPCODE_UNPACK_U64: self.parse_unpack_u64,
+            OPCODE_UNPACK_S64: self.parse_unpack_s64,
+            OPCODE_UNPACK_U64AR: self.parse_unpack_u64_array,
+            OPCODE_UNPACK_S64AR: self.parse_unpack_s64_array,
+            OPCODE_RECORD_ARRAY: self.parse_record_array,
         }
-                        
+        self.field_struct_map = { #(struct, element length) of the scalar opcodes used by OPCODE_PACK_FIELDS/OPCODE_UNPACK_FIELDS
+            OPCODE_PACK_U8: (u8_struct, UINT8_LEN),
+            OPCODE_PACK_U16: (u16_struct, UINT16_LEN),
+            OPCODE_PACK_U32: (u32_struct, UINT32_LEN),
+            OPCODE_PACK_S8: (s8_struct, SINT8_LEN),
+            OPCODE_PACK_S16: (s16_struct, SINT16_LEN),
+            OPCODE_PACK_S32: (s32_struct, SINT32_LEN),
+            OPCODE_PACK_U64: (u64_struct, UINT64_LEN),
+            OPCODE_PACK_S64: (s64_struct, SINT64_LEN),
+            OPCODE_UNPACK_U8: (u8_struct, UINT8_LEN),
+            OPCODE_UNPACK_U16: (u16_struct, UINT16_LEN),
+            OPCODE_UNPACK_U32: (u32_struct, UINT32_LEN),
+            OPCODE_UNPACK_S8: (s8_struct, SINT8_LEN),
+            OPCODE_UNPACK_S16: (s16_struct, SINT16_LEN),
+            OPCODE_UNPACK_S32: (s32_struct, SINT32_LEN),
+            OPCODE_UNPACK_U64: (u64_struct, UINT64_LEN),
+            OPCODE_UNPACK_S64: (s64_struct, SINT64_LEN),
+        }
+        self.key_table = [] #key table of the program currently being decoded
+        self.programs = {} #decoded programs (VmProgram) keyed by byte code
+        self.compact_arrays = compact_arrays
+        self.raw_strings = raw_strings
+        self.profiler = None #VmProfiler, only set when profiling is enabled
+        self.pack_state = VmPackState() #states are reused between program executions
+        self.unpack_state = VmUnpackState(compact_arrays, raw_strings=raw_strings)
         self.reset()
     
     @property
@@ -71,14 +130,18 @@ class VM:
 
     def init_pack_prog(self, value, data_len, data, data_offset=0):
         self.verify_data_len(data_len, data, data_offset)
-        self.state = VmPackState(value)
+        self.pack_state.reset(value)
+        self.state = self.pack_state
         self.prog_type = PACK_PROG
         self.data=data
         self.data_offset = data_offset
             
-    def init_unpack_prog(self, data_len, data, data_offset=0):
+    def init_unpack_prog(self, data_len, data, data_offset=0, target=None):
         self.verify_data_len(data_len, data, data_offset)
-        self.state = VmUnpackState()
+        self.unpack_state.reset(None, target)
+        self.unpack_state.compact_arrays = self.compact_arrays
+        self.unpack_state.raw_strings = self.raw_strings
+        self.state = self.unpack_state
         self.prog_type = UNPACK_PROG
         self.data=data
         self.data_offset = data_offset
@@ -120,6 +183,12 @@ class VM:
     def parse_pack_s32(self, code, code_next, code_end):
         return code_next, self.exec_pack_s32, None
     
+    def parse_pack_u64(self, code, code_next, code_end):
+        return code_next, self.exec_pack_u64, None
+
+    def parse_pack_s64(self, code, code_next, code_end):
+        return code_next, self.exec_pack_s64, None
+
     def parse_pack_u8_array(self, code, code_next, code_end):
         if code_next+2 <= code_end:
             array_len = (int(code[code_next])) | (int(code[code_next+1])<<8)            
@@ -162,6 +231,20 @@ class VM:
         else:
             raise InvalidInstructionError('Expected 2 additional bytes after the opcode')
 
+    def parse_pack_u64_array(self, code, code_next, code_end):
+        if code_next+2 <= code_end:
+            array_len = (int(code[code_next])) | (int(code[code_next+1])<<8)
+            return code_next+2, self.exec_pack_u64, [array_len]
+        else:
+            raise InvalidInstructionError('Expected 2 additional bytes after the opcode')
+
+    def parse_pack_s64_array(self, code, code_next, code_end):
+        if code_next+2 <= code_end:
+            array_len = (int(code[code_next])) | (int(code[code_next+1])<<8)
+            return code_next+2, self.exec_pack_s64, [array_len]
+        else:
+            raise InvalidInstructionError('Expected 2 additional bytes after the opcode')
+
     def parse_pack_str(self, code, code_next, code_end):
         if code_next+2 <= code_end:
             array_len = (int(code[code_next])) | (int(code[code_next+1])<<8)            
@@ -187,6 +270,12 @@ class VM:
     def parse_unpack_s32(self, code, code_next, code_end):
         return code_next, self.exec_unpack_s32, None
     
+    def parse_unpack_u64(self, code, code_next, code_end):
+        return code_next, self.exec_unpack_u64, None
+
+    def parse_unpack_s64(self, code, code_next, code_end):
+        return code_next, self.exec_unpack_s64, None
+
     def parse_unpack_u8_array(self, code, code_next, code_end):
         if code_next+2 <= code_end:
             array_len = (int(code[code_next])) | (int(code[code_next+1])<<8)            
@@ -229,6 +318,20 @@ class VM:
         else:
             raise InvalidInstructionError('Expected 2 additional bytes after the opcode')
 
+    def parse_unpack_u64_array(self, code, code_next, code_end):
+        if code_next+2 <= code_end:
+            array_len = (int(code[code_next])) | (int(code[code_next+1])<<8)
+            return code_next+2, self.exec_unpack_u64, [array_len]
+        else:
+            raise InvalidInstructionError('Expected 2 additional bytes after the opcode')
+
+    def parse_unpack_s64_array(self, code, code_next, code_end):
+        if code_next+2 <= code_end:
+            array_len = (int(code[code_next])) | (int(code[code_next+1])<<8)
+            return code_next+2, self.exec_unpack_s64, [array_len]
+        else:
+            raise InvalidInstructionError('Expected 2 additional bytes after the opcode')
+
     def parse_unpack_str(self, code, code_next, code_end):
         if code_next+2 <= code_end:
             array_len = (int(code[code_next])) | (int(code[code_next+1])<<8)            
@@ -258,6 +361,60 @@ class VM:
     def parse_array_leave(self, code, code_next, code_end):
         return code_next, self.exec_array_leave, None
 
+    def parse_record_array(self, code, code_next, code_end):
+        if code_next+2 <= code_end:
+            array_len = (int(code[code_next])) | (int(code[code_next+1])<<8)
+            return code_next+2, self.exec_record_array, [array_len]
+        else:
+            raise InvalidInstructionError('Expected 2 additional bytes after the opcode')
+
+    def parse_key_table(self, code, code_next, code_end):
+        if code_next+1 > code_end:
+            raise InvalidInstructionError('Expected 1 additional byte after the opcode')
+        num_keys = int(code[code_next])
+        code_next+=1
+        keys = []
+        for i in range(num_keys):
+            end = code.find(0, code_next, code_end)
+            if end < 0:
+                raise InvalidInstructionError('Expected NULL terminator before end of program')
+            keys.append(bytes(code[code_next:end]).decode("ascii"))
+            code_next = end+1
+        self.key_table = keys
+        return code_next, self.exec_key_table, [keys]
+
+    def parse_record_select_key(self, code, code_next, code_end):
+        if code_next+1 <= code_end:
+            return code_next+1, self.exec_record_select, [self._get_key(int(code[code_next]))]
+        else:
+            raise InvalidInstructionError('Expected 1 additional byte after the opcode')
+
+    def parse_pack_fields(self, code, code_next, code_end):
+        code_next, struct_obj, elem_len, keys = self._parse_fields(code, code_next, code_end, _pack_field_opcodes)
+        return code_next, self.exec_pack_fields, [struct_obj, elem_len, keys]
+
+    def parse_unpack_fields(self, code, code_next, code_end):
+        code_next, struct_obj, elem_len, keys = self._parse_fields(code, code_next, code_end, _unpack_field_opcodes)
+        return code_next, self.exec_unpack_fields, [struct_obj, elem_len, keys]
+
+    def _parse_fields(self, code, code_next, code_end, valid_opcodes):
+        if code_next+3 > code_end:
+            raise InvalidInstructionError('Expected 3 additional bytes after the opcode')
+        field_opcode = code[code_next]
+        if field_opcode not in valid_opcodes:
+            raise InvalidInstructionError('Invalid field opcode: {:d}'.format(field_opcode))
+        num_fields = int(code[code_next+1])
+        first_key = int(code[code_next+2])
+        keys = tuple(self._get_key(i) for i in range(first_key, first_key+num_fields))
+        struct_obj, elem_len = self.field_struct_map[field_opcode]
+        return code_next+3, array_struct(struct_obj, num_fields), elem_len*num_fields, keys
+
+    def _get_key(self, index):
+        try:
+            return self.key_table[index]
+        except IndexError:
+            raise InvalidInstructionError('Key index {:d} is not in key table'.format(index))
+
     def exec_pack_u8(self, array_len=0):
         self.data_offset=self.state.pack_u8(self.data, self.data_offset, array_len)
     
@@ -276,6 +433,12 @@ class VM:
     def exec_pack_s32(self, array_len=0):
         self.data_offset=self.state.pack_s32(self.data, self.data_offset, array_len)
 
+    def exec_pack_u64(self, array_len=0):
+        self.data_offset=self.state.pack_u64(self.data, self.data_offset, array_len)
+
+    def exec_pack_s64(self, array_len=0):
+        self.data_offset=self.state.pack_s64(self.data, self.data_offset, array_len)
+
     def exec_pack_str(self, array_len=0):
         self.data_offset=self.state.pack_str(self.data, self.data_offset, array_len)
 
@@ -297,6 +460,12 @@ class VM:
     def exec_unpack_s32(self, array_len=0):
         self.data_offset=self.state.unpack_s32(self.data, self.data_offset, array_len)
 
+    def exec_unpack_u64(self, array_len=0):
+        self.data_offset=self.state.unpack_u64(self.data, self.data_offset, array_len)
+
+    def exec_unpack_s64(self, array_len=0):
+        self.data_offset=self.state.unpack_s64(self.data, self.data_offset, array_len)
+
     def exec_unpack_str(self, array_len=0):
         self.data_offset=self.state.unpack_str(self.data, self.data_offset, array_len)
 
@@ -315,6 +484,101 @@ class VM:
     def exec_array_leave(self):
         self.state.array_leave()
 
+    def exec_record_array(self, array_len, body):
+        """
+        Executes the instructions of body (one record) once per array element, see decode_program
+        """
+        state = self.state
+        state.array_enter()
+        for i in range(array_len):
+            for instruction, args in body:
+                instruction(*args)
+        state.array_leave()
+
+    def exec_key_table(self, keys):
+        pass #key table is only used while decoding the program
+
+    def exec_pack_fields(self, struct_obj, data_len, keys):
+        self.data_offset=self.state.pack_fields(struct_obj, data_len, keys, self.data, self.data_offset)
+
+    def exec_unpack_fields(self, struct_obj, data_len, keys):
+        self.data_offset=self.state.unpack_fields(struct_obj, data_len, keys, self.data, self.data_offset)
+
+    def load_program(self, code):
+        """
+        Returns the decoded form (VmProgram) of the byte code program.
+        Each program is only decoded once, the result is cached in self.programs
+        """
+        try:
+            return self.programs[code]
+        except KeyError:
+            pass
+        except TypeError: #unhashable type such as bytearray
+            code = bytes(code)
+            if code in self.programs:
+                return self.programs[code]
+        program = self.decode_program(code)
+        self.programs[code] = program
+        return program
+
+    def decode_program(self, code):
+        """
+        Decodes byte code program into a VmProgram without executing it.
+        The instructions between OPCODE_RECORD_ARRAY and its OPCODE_ARRAY_LEAVE become the body of a single exec_record_array
+        instruction (the profiler accounts the whole array to OPCODE_RECORD_ARRAY).
+        """
+        code_next = 0
+        code_end = len(code)
+        instructions = []
+        opcodes = []
+        prog_type = NO_PROG
+        data_len = None
+        self.key_table = []
+        arrays = [] #index of the instruction of each enclosing OPCODE_RECORD_ARRAY (None for OPCODE_ARRAY_ENTER)
+        while True:
+            opcode = code[code_next] if code_next < code_end else None
+            code_next, instruction, args = self.parse_next_instruction(code, code_next, code_end)
+            if instruction is None:
+                break
+            if len(instructions) == 0:
+                if instruction == self.exec_pack_prog_instruction:
+                    prog_type = PACK_PROG
+                elif instruction == self.exec_unpack_prog_instruction:
+                    prog_type = UNPACK_PROG
+                else:
+                    raise InvalidInstructionError('First instruction must be of type OPCODE_PACK_PROG or OPCODE_UNPACK_PROG')
+                data_len = args[0]
+            if opcode == OPCODE_KEY_TABLE:
+                continue #nothing to execute
+            if opcode == OPCODE_ARRAY_LEAVE and len(arrays) > 0 and arrays[-1] is not None:
+                begin = arrays.pop()
+                body = tuple(instructions[begin+1:])
+                del instructions[begin+1:], opcodes[begin+1:]
+                instructions[begin] = (instructions[begin][0], instructions[begin][1]+(body,))
+                continue
+            if opcode == OPCODE_RECORD_ARRAY:
+                arrays.append(len(instructions))
+            elif opcode == OPCODE_ARRAY_ENTER:
+                arrays.append(None)
+            elif opcode == OPCODE_ARRAY_LEAVE and len(arrays) > 0:
+                arrays.pop()
+            instructions.append((instruction, tuple(args) if args is not None else ()))
+            opcodes.append(opcode)
+        if any(begin is not None for begin in arrays):
+            raise InvalidInstructionError('Expected OPCODE_ARRAY_LEAVE before end of program')
+        return VmProgram(prog_type, data_len, instructions, opcodes, code)
+
+    def enable_profiling(self, profiler=None):
+        """
+        Enables per-opcode and per-program profiling, returns the VmProfiler that collects the statistics.
+        An existing profiler can be given to share it between several VMs.
+        """
+        self.profiler = profiler if profiler is not None else VmProfiler()
+        return self.profiler
+
+    def disable_profiling(self):
+        self.profiler = None
+
     def exec_pack_prog(self, code, data, data_offset, value):
         """
         Executes the pack program
@@ -323,54 +587,103 @@ class VM:
         data_offset: start offset (int)
         value: the python value that shall be packed (int, string, list or dict)
         """
-        code_next = 0
-        code_end = len(code)
+        program = self.load_program(code)
+        if program.prog_type != PACK_PROG:
+            raise RuntimeError('First instuction must be of type OPCODE_PACK_PROG')
         self.reset()
         self.init_pack_prog(value, len(data)-data_offset, data, data_offset)
-        self.first_instruction=True
-        while True:
-            code_next, instruction, args = self.parse_next_instruction(code, code_next, code_end)
-            if instruction is None:
-                break
-            else:
-                if self.first_instruction:
-                    self.first_instruction = False
-                    if instruction != self.exec_pack_prog_instruction:
-                        raise RuntimeError('First instuction must be of type OPCODE_PACK_PROG')
-                self.exec_instruction(instruction, args)
-        
-    
-    def exec_unpack_prog(self, code, data, data_offset):
+        if self.profiler is None:
+            for instruction, args in program.instructions:
+                instruction(*args)
+        else:
+            self.profiler.execute(program)
+
+    def exec_unpack_prog(self, code, data, data_offset, target=None):
         """
         Executes the unpack program
         code: Compiled program (bytes)
         data: data to operate on (bytearray)
         data_offset: start offset (int)
+        target: optional existing dict (record) or list (array) that is updated in-place instead of allocating a new value
         returns: unpacked python value (int, string, list or dict)
         """
+        program = self.load_program(code)
+        if program.prog_type != UNPACK_PROG:
+            raise RuntimeError('First instuction must be of type OPCODE_UNPACK_PROG')
+        self.reset()
+        self.init_unpack_prog(len(data)-data_offset, data, data_offset, target)
+        if self.profiler is None:
+            for instruction, args in program.instructions:
+                instruction(*args)
+        else:
+            self.profiler.execute(program)
+        return self.state.value
+
+    def exec_unpack_many(self, code, data, offsets_or_stride, columns=False):
         """
-        Executes the pack program
-        code: compiled program (bytes)
-        data: data to operate on (bytearray)
-        data_offset: start offset (int)
-        value: the python value that shall be packed (int, string, list or dict)
+        Executes the unpack program on many frames (samples of the same port) in one call
+        code: Compiled program (bytes)
+        data: data to operate on (bytearray), contains all frames
+        offsets_or_stride: list of frame start offsets (list of int) or distance in bytes between consecutive frames (int).
+                           When a stride is given the first frame starts at offset 0 and all complete frames in data are unpacked.
+        columns: when True, a record program returns a dict with one list per record field instead of a list of dicts.
+                 The field lists are preallocated and filled frame by frame, no dict is allocated per frame.
+        returns: list of unpacked python values (or dict of lists when columns is True)
         """
-        code_next = 0
-        code_end = len(code)
+        program = self.load_program(code)
+        if program.prog_type != UNPACK_PROG:
+            raise RuntimeError('First instuction must be of type OPCODE_UNPACK_PROG')
+        if isinstance(offsets_or_stride, int):
+            if offsets_or_stride <= 0:
+                raise ValueError('stride must be a positive integer')
+            offsets = range(0, len(data)-program.data_len+1, offsets_or_stride)
+        else:
+            offsets = offsets_or_stride
+        num_frames = len(offsets)
+        if num_frames > 0:
+            if min(offsets) < 0:
+                raise ValueError('frame offsets must not be negative')
+            self.verify_data_len(program.data_len, data, max(offsets))
+        instructions = program.instructions[1:] #data length has been verified for all frames above
+        profiler = self.profiler
+        if profiler is not None:
+            frame_program = VmProgram(program.prog_type, program.data_len, instructions, program.opcodes[1:], program.code)
         self.reset()
-        self.init_unpack_prog(len(data)-data_offset, data, data_offset)
-        self.first_instruction=True
-        while True:
-            code_next, instruction, args = self.parse_next_instruction(code, code_next, code_end)
-            if instruction is None:
-                break
+        self.init_unpack_prog(0, data, 0)
+        state = self.state
+        if columns:
+            #each frame is unpacked in-place into the same scratch record, then moved into the preallocated columns
+            scratch = {}
+            result = {}
+            column_items = None
+            container_keys = None
+        else:
+            scratch = None
+            values = [None]*num_frames
+        for i, offset in enumerate(offsets):
+            state.reset(None, scratch)
+            self.data_offset = offset
+            if profiler is None:
+                for instruction, args in instructions:
+                    instruction(*args)
             else:
-                if self.first_instruction:
-                    self.first_instruction = False
-                    if instruction != self.exec_unpack_prog_instruction:
-                        raise RuntimeError('First instuction must be of type OPCODE_UNPACK_PROG')
-                self.exec_instruction(instruction, args)        
-        
+                profiler.execute(frame_program)
+            if scratch is None:
+                values[i] = state.value
+                continue
+            if column_items is None:
+                if state.value is not scratch:
+                    raise ValueError('columns requires a program that unpacks a record')
+                result = {key: [None]*num_frames for key in scratch}
+                column_items = list(result.items())
+                container_keys = [key for key, value in scratch.items() if isinstance(value, (dict, list, array.array))]
+            for key, column in column_items:
+                column[i] = scratch[key]
+            for key in container_keys:
+                scratch[key] = None #containers were moved to the columns, must not be reused by the next frame
+        if columns:
+            return result
+        return values
 
     def parse_next_instruction(self, code, code_next, code_end):
         """
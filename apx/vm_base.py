@@ -32,6 +32,20 @@ OPCODE_RECORD_SELECT = 30
 OPCODE_RECORD_LEAVE  = 31
 OPCODE_ARRAY_ENTER   = 32
 OPCODE_ARRAY_LEAVE   = 33
+#opcodes only emitted by the optimizer (see apx.optimizer)
+OPCODE_KEY_TABLE     = 34 #u8 number of keys followed by NULL-terminated key names
+OPCODE_RECORD_SELECT_KEY = 35 #u8 index into key table
+OPCODE_PACK_FIELDS   = 36 #u8 scalar pack opcode, u8 number of fields, u8 key table index of first field
+OPCODE_UNPACK_FIELDS = 37 #u8 scalar unpack opcode, u8 number of fields, u8 key table index of first field
+OPCODE_PACK_U64      = 38
+OPCODE_PACK_S64      = 39
+OPCODE_PACK_U64AR    = 40
+OPCODE_PACK_S64AR    = 41
+OPCODE_UNPACK_U64    = 42
+OPCODE_UNPACK_S64    = 43
+OPCODE_UNPACK_U64AR  = 44
+OPCODE_UNPACK_S64AR  = 45
+OPCODE_RECORD_ARRAY  = 46 #u16 number of array elements followed by the instructions of a single record and OPCODE_ARRAY_LEAVE
 
 NO_PROG      = -1
 PACK_PROG    = 0
@@ -40,9 +54,31 @@ UNPACK_PROG  = 1
 UINT8_LEN   = 1
 UINT16_LEN  = 2
 UINT32_LEN  = 4
+UINT64_LEN  = 8
 SINT8_LEN   = 1
 SINT16_LEN  = 2
 SINT32_LEN  = 4
+SINT64_LEN  = 8
+
+#array.array type codes for the struct format characters of the APX integer types
+#(item sizes of array.array type codes vary between platforms, select them by size)
+def _select_array_typecode(candidates, size):
+    import array
+    for typecode in candidates:
+        if array.array(typecode).itemsize == size:
+            return typecode
+    raise RuntimeError('No array type code with item size {:d}'.format(size))
+
+ARRAY_TYPECODE_MAP = {
+    'B': 'B',
+    'H': _select_array_typecode('HI', 2),
+    'I': _select_array_typecode('ILQ', 4),
+    'Q': _select_array_typecode('LQ', 8),
+    'b': 'b',
+    'h': _select_array_typecode('hi', 2),
+    'i': _select_array_typecode('ilq', 4),
+    'q': _select_array_typecode('lq', 8),
+}
 
 #Errors
 class InvalidInstructionError(RuntimeError):
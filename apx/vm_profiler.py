@@ -0,0 +1,82 @@
+import sys
+import time
+import threading
+import apx.vm_base
+
+OPCODE_NAMES = {value: name for name, value in vars(apx.vm_base).items() if name.startswith('OPCODE_')}
+
+class VmProfiler:
+    """
+    Collects per-opcode and per-program statistics for apx.VM.
+    Attach it using VM.enable_profiling(), a VM without profiler runs the normal (uninstrumented) loop.
+    """
+    def __init__(self, timer=time.perf_counter):
+        self.timer = timer
+        self.lock = threading.Lock() #the same profiler may be shared between VMs running in different threads
+        self.labels = {} #program label (e.g. port name) keyed by byte code
+        self.reset()
+
+    def reset(self):
+        """
+        Clears all collected statistics (labels are kept)
+        """
+        self.opcode_counts = {} #number of executions keyed by opcode
+        self.opcode_times = {} #cumulative execution time (seconds) keyed by opcode
+        self.program_counts = {} #number of executions keyed by program label
+        self.program_times = {} #cumulative execution time (seconds) keyed by program label
+
+    def set_label(self, code, label):
+        """
+        Sets the name used for the program in reports, e.g. the name of the port it belongs to
+        """
+        self.labels[bytes(code)] = label
+
+    def execute(self, program):
+        """
+        Executes all instructions of the VmProgram while measuring them
+        """
+        timer = self.timer
+        opcode_counts = {}
+        opcode_times = {}
+        program_begin = timer()
+        for opcode, (instruction, args) in zip(program.opcodes, program.instructions):
+            begin = timer()
+            instruction(*args)
+            elapsed = timer()-begin
+            opcode_counts[opcode] = opcode_counts.get(opcode, 0)+1
+            opcode_times[opcode] = opcode_times.get(opcode, 0.0)+elapsed
+        program_elapsed = timer()-program_begin
+        label = self.labels.get(program.code, program.code)
+        with self.lock:
+            for opcode, count in opcode_counts.items():
+                self.opcode_counts[opcode] = self.opcode_counts.get(opcode, 0)+count
+                self.opcode_times[opcode] = self.opcode_times.get(opcode, 0.0)+opcode_times[opcode]
+            self.program_counts[label] = self.program_counts.get(label, 0)+1
+            self.program_times[label] = self.program_times.get(label, 0.0)+program_elapsed
+
+    def opcode_stats(self):
+        """
+        Returns list of (opcode name, count, total time) tuples, ranked by total time (highest first)
+        """
+        with self.lock:
+            result = [(OPCODE_NAMES.get(opcode, str(opcode)), count, self.opcode_times[opcode]) for opcode, count in self.opcode_counts.items()]
+        return sorted(result, key=lambda x: x[2], reverse=True)
+
+    def program_stats(self):
+        """
+        Returns list of (program label, count, total time) tuples, ranked by total time (highest first).
+        Programs without label are identified by their byte code in hex format.
+        """
+        with self.lock:
+            result = [(label if isinstance(label, str) else label.hex(), count, self.program_times[label]) for label, count in self.program_counts.items()]
+        return sorted(result, key=lambda x: x[2], reverse=True)
+
+    def report(self, file=sys.stdout):
+        """
+        Writes ranked report of opcodes and programs to file
+        """
+        for title, stats in [('opcode', self.opcode_stats()), ('program', self.program_stats())]:
+            print('{:<32} {:>10} {:>12} {:>12}'.format(title, 'count', 'total (ms)', 'avg (us)'), file=file)
+            for name, count, total in stats:
+                print('{:<32} {:>10d} {:>12.3f} {:>12.3f}'.format(name, count, total*1000, total*1000000/count), file=file)
+            print('', file=file)
@@ -1,4 +1,5 @@
 import struct
+import array
 from apx.vm_base import *
 
 u8_struct = struct.Struct("B")
@@ -7,14 +8,90 @@ u32_struct = struct.Struct("<I")
 s8_struct = struct.Struct("<b")
 s16_struct = struct.Struct("<h")
 s32_struct = struct.Struct("<i")
+u64_struct = struct.Struct("<Q")
+s64_struct = struct.Struct("<q")
+
+INITIAL_STACK_DEPTH = 8 #number of preallocated stack frames, the stack grows automatically for deeper data structures
+
+_array_structs = {} #struct.Struct objects for whole arrays, keyed by (format character, array length)
+
+def array_struct(struct_obj, array_len):
+    """
+    Returns (cached) struct.Struct that packs/unpacks array_len elements of struct_obj in a single call
+    """
+    key = (struct_obj.format[-1], array_len)
+    try:
+        return _array_structs[key]
+    except KeyError:
+        result = struct.Struct('<{:d}{}'.format(array_len, key[0]))
+        _array_structs[key] = result
+        return result
+
+_string_structs = {} #struct.Struct objects for strings, keyed by string length
+
+def string_struct(str_len):
+    """
+    Returns (cached) struct.Struct that packs/unpacks a string of str_len bytes
+    """
+    try:
+        return _string_structs[str_len]
+    except KeyError:
+        result = struct.Struct('{:d}s'.format(str_len))
+        _string_structs[str_len] = result
+        return result
 
 
 class VmState:
+    """
+    Base class of the VM states.
+    Complex data structures (records inside records, arrays of records etc.) use a preallocated stack of
+    (value, key, array_index) frames stored in three parallel lists, entering a level doesn't allocate anything.
+    """
     def __init__(self, value=None):
         self.value=value
         self.key=None #when self.value is dict
         self.array_index = None #used when we have array of records/dict
-        self.stack = [] #used for complex data structures (records inside records etc.)
+        self.depth = 0 #number of frames currently on the stack
+        self.stack_values = [None]*INITIAL_STACK_DEPTH
+        self.stack_keys = [None]*INITIAL_STACK_DEPTH
+        self.stack_indexes = [None]*INITIAL_STACK_DEPTH
+
+    def reset(self, value=None):
+        """
+        Prepares the state for another program execution
+        """
+        for i in range(self.depth):
+            self.stack_values[i] = None
+        self.value = value
+        self.key = None
+        self.array_index = None
+        self.depth = 0
+
+    @property
+    def stack(self):
+        """
+        The frames currently on the stack as a list of (value, key, array_index) tuples (for debugging and tests)
+        """
+        return list(zip(self.stack_values[:self.depth], self.stack_keys[:self.depth], self.stack_indexes[:self.depth]))
+
+    def push(self):
+        depth = self.depth
+        if depth == len(self.stack_values):
+            self.stack_values.append(None)
+            self.stack_keys.append(None)
+            self.stack_indexes.append(None)
+        self.stack_values[depth] = self.value
+        self.stack_keys[depth] = self.key
+        self.stack_indexes[depth] = self.array_index
+        self.depth = depth+1
+
+    def pop(self):
+        depth = self.depth-1
+        self.value = self.stack_values[depth]
+        self.key = self.stack_keys[depth]
+        self.array_index = self.stack_indexes[depth]
+        self.stack_values[depth] = None #don't keep references to values of previous executions
+        self.depth = depth
 
 
 class VmPackState(VmState):
@@ -29,16 +106,15 @@ class VmPackState(VmState):
             if not isinstance(self.value, dict):
                 raise ValueError('value must be of type dict')
         else:
+            self.push()
             if self.array_index is not None:
-                self.stack.append((self.value, self.key, self.array_index))
                 self.value = self.value[self.array_index]
-                self.key=None
-                self.array_index=None
             else:
-                self.stack.append((self.value, self.key, self.array_index))
                 self.value = self.value[self.key]
-                self.key=None
-                self.array_index=None
+            self.key=None
+            self.array_index=None
+            if not isinstance(self.value, dict):
+                raise ValueError('value must be of type dict')
 
 
     def record_select(self, name):
@@ -47,8 +123,8 @@ class VmPackState(VmState):
         self.key = name
 
     def record_leave(self):
-        if len(self.stack)>0:
-            self.value, self.key, self.array_index = self.stack.pop()
+        if self.depth>0:
+            self.pop()
             if self.array_index is not None:
                 self.array_index+=1
         self.key = None
@@ -59,19 +135,19 @@ class VmPackState(VmState):
                 raise ValueError('value must be of type list')
             self.array_index = 0
         else:
-            self.stack.append((self.value, self.key, self.array_index))
+            self.push()
             if self.key is not None:
                 self.value = self.value[self.key]
-            elif self.array_index is not None:
-                self.value = self.value[self.array_index]
             else:
-                raise RuntimeError('array_enter called out of context')
+                self.value = self.value[self.array_index]
+            if not isinstance(self.value, list):
+                raise ValueError('value must be of type list')
             self.key=None
             self.array_index=0
 
     def array_leave(self):
-        if len(self.stack)>0:
-            self.value, self.key, self.array_index = self.stack.pop()
+        if self.depth>0:
+            self.pop()
             if self.array_index is not None:
                 self.array_index+=1
         else:
@@ -86,6 +162,9 @@ class VmPackState(VmState):
     def pack_u32(self, data, data_offset, array_len = 0):
         return self.pack_struct(u32_struct, UINT32_LEN, data, data_offset, array_len)
 
+    def pack_u64(self, data, data_offset, array_len = 0):
+        return self.pack_struct(u64_struct, UINT64_LEN, data, data_offset, array_len)
+
     def pack_s8(self, data, data_offset, array_len = 0):
         return self.pack_struct(s8_struct, SINT8_LEN, data, data_offset, array_len)
 
@@ -95,18 +174,23 @@ class VmPackState(VmState):
     def pack_s32(self, data, data_offset, array_len = 0):
         return self.pack_struct(s32_struct, SINT32_LEN, data, data_offset, array_len)
 
+    def pack_s64(self, data, data_offset, array_len = 0):
+        return self.pack_struct(s64_struct, SINT64_LEN, data, data_offset, array_len)
+
     def pack_str(self, data, data_offset, str_len):
+        """
+        Packs str (utf-8 encoded) or bytes value into str_len bytes, longer values are truncated and shorter values are NUL-padded
+        """
         if isinstance(self.value, dict):
             if self.key is None:
                 raise RuntimeError('key must not be None')
-            value = self.value[self.key].encode('utf-8')
+            value = self.value[self.key]
         else:
-            value = self.value.encode('utf-8')
-        if str_len < len(data):
-            truncated = data[0:str_len]
-        struct.pack_into('{:d}s'.format(str_len), data, data_offset, value)
-        data_offset+=str_len
-        return data_offset
+            value = self.value
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        string_struct(str_len).pack_into(data, data_offset, value)
+        return data_offset+str_len
 
     def pack_struct(self, struct_obj: struct.Struct, elem_len: int, data: bytearray, data_offset: int, array_len: int):
         """
@@ -119,33 +203,69 @@ class VmPackState(VmState):
         else:
             value = self.value
         if array_len > 0:
-            if not isinstance(value, list):
+            if not isinstance(value, (list, array.array)):
                 raise ValueError('value must be a list, got {}'.format(str(value)))
-            if len(self.value)<array_len:
-                raise ValueError('Not enough elements in list value list {0}. Expected {1} items'.format(repr(self.value), array_len))
-            for i in range(array_len):
-                struct_obj.pack_into(data, data_offset, value[i])
-                data_offset+=elem_len
+            if len(value)<array_len:
+                raise ValueError('Not enough elements in list value list {0}. Expected {1} items'.format(repr(value), array_len))
+            array_struct(struct_obj, array_len).pack_into(data, data_offset, *value[:array_len])
+            data_offset+=elem_len*array_len
         else:
             struct_obj.pack_into(data, data_offset, value)
             data_offset+=elem_len
         return data_offset
 
+    def pack_fields(self, struct_obj: struct.Struct, data_len: int, keys: tuple, data: bytearray, data_offset: int):
+        """
+        Packs several consecutive record fields of the same type using a single struct_obj.pack_into call
+        """
+        if not isinstance(self.value, dict):
+            raise RuntimeError('Expected dict, got {}'.format(type(self.value)))
+        value = self.value
+        struct_obj.pack_into(data, data_offset, *[value[key] for key in keys])
+        self.key = keys[-1]
+        return data_offset+data_len
+
 class VmUnpackState(VmState):
-    def __init__(self):
+    """
+    compact_arrays: when True, integer arrays are unpacked as array.array instead of list
+    raw_strings: when True, strings are unpacked as bytes (without trailing NUL characters) instead of str
+    target: existing container (dict for records, list for arrays) that is updated in-place instead of creating a new value.
+            Lists found in the target record are also reused when they have the correct length.
+    """
+    def __init__(self, compact_arrays=False, target=None, raw_strings=False):
         super().__init__()
+        self.compact_arrays = compact_arrays
+        self.raw_strings = raw_strings
+        self.target = target
+
+    def reset(self, value=None, target=None):
+        super().reset(value)
+        self.target = target
+
+    def _child_container(self, container_type):
+        """
+        Returns the existing container (dict or list) at the current key/array index when unpacking in-place, otherwise a new one
+        """
+        if self.target is not None:
+            if self.key is not None:
+                child = self.value.get(self.key)
+            elif self.array_index < len(self.value):
+                child = self.value[self.array_index]
+            else:
+                child = None
+            if type(child) is container_type:
+                return child
+        return container_type()
 
     def record_enter(self):
         if (self.key is None) and (self.array_index is None):
-            self.value = {}
+            self.value = self.target if isinstance(self.target, dict) else {}
         else:
-            if self.array_index is not None:
-                self.stack.append((self.value, self.key, self.array_index))
-                self.value = {}
-                self.key=None
-                self.array_index=None
-            else:
-                raise NotImplementedError('nested records')
+            child = self._child_container(dict)
+            self.push()
+            self.value = child
+            self.key=None
+            self.array_index=None
 
 
     def record_select(self, name):
@@ -154,41 +274,47 @@ class VmUnpackState(VmState):
         self.key=name
 
     def record_leave(self):
-        if len(self.stack)>0:
-            child_value = self.value
-            self.value, self.key, self.array_index = self.stack.pop()
-            if self.array_index is not None:
-                self.value.append(child_value)
-                self.array_index+=1
-            elif self.key is not None:
-                self.value[self.key] = child_value
+        if self.depth>0:
+            self._leave_child()
         self.key = None
 
     def array_enter(self):
         if (self.key is None) and (self.array_index is None):
-            self.value = []
+            self.value = self.target if isinstance(self.target, list) else []
             self.array_index=0
         else:
-            self.stack.append((self.value, self.key, self.array_index))
-            self.value = []
+            child = self._child_container(list)
+            self.push()
+            self.value = child
             self.key=None
             self.array_index=0
 
     def array_leave(self):
         if self.array_index is None:
             raise RuntimeError('array_leave called before array_enter')
-        if len(self.stack)>0:
-            child_value = self.value
-            self.value, self.key, self.array_index = self.stack.pop()
-            if self.array_index is not None:
-                self.value.append(child_value)
-                self.array_index+=1
-            elif self.key is not None:
-                self.value[self.key]=child_value
-                self.key=None
+        if self.target is not None and 0 < self.array_index < len(self.value):
+            del self.value[self.array_index:] #reused list was longer
+        if self.depth>0:
+            self._leave_child()
+            self.key=None
         else:
             self.array_index = None
 
+    def _leave_child(self):
+        """
+        Pops the stack and stores the completed child value in its parent
+        """
+        child_value = self.value
+        self.pop()
+        if self.array_index is not None:
+            if self.array_index < len(self.value):
+                self.value[self.array_index] = child_value
+            else:
+                self.value.append(child_value)
+            self.array_index+=1
+        elif self.key is not None:
+            self.value[self.key] = child_value
+
 
     def unpack_u8(self, data, data_offset, array_len=0):
         return self.unpack_struct(u8_struct, UINT8_LEN, data, data_offset, array_len)
@@ -199,6 +325,9 @@ class VmUnpackState(VmState):
     def unpack_u32(self, data, data_offset, array_len=0):
         return self.unpack_struct(u32_struct, UINT32_LEN, data, data_offset, array_len)
 
+    def unpack_u64(self, data, data_offset, array_len=0):
+        return self.unpack_struct(u64_struct, UINT64_LEN, data, data_offset, array_len)
+
     def unpack_s8(self, data, data_offset, array_len=0):
         return self.unpack_struct(s8_struct, SINT8_LEN, data, data_offset, array_len)
 
@@ -207,21 +336,21 @@ class VmUnpackState(VmState):
 
     def unpack_s32(self, data, data_offset, array_len=0):
         return self.unpack_struct(s32_struct, SINT32_LEN, data, data_offset, array_len)
+
+    def unpack_s64(self, data, data_offset, array_len=0):
+        return self.unpack_struct(s64_struct, SINT64_LEN, data, data_offset, array_len)
     
     def unpack_str(self, data, data_offset, str_len=0):
         data_len = len(data)-data_offset
         if data_len < str_len:
             raise ValueError('Not enough bytes available in data array. Need {:d}, bytes, got {:d}'.format(str_len, data_len))
-        struct.unpack_from('{:d}s'.format(str_len), data, data_offset)
-        #in case of trailing null terminators we want to get rid of those in the final string.
-        str_end = data_offset+str_len
-        data_begin=data_end=data_offset
-        vale = None
-        while(data_end < str_end):
-            if data[data_end] == 0:                
-                break
-            data_end+=1
-        value = data[data_offset:data_end].decode('utf-8')
+        value, = string_struct(str_len).unpack_from(data, data_offset)
+        #the string ends at the first null terminator
+        end = value.find(0)
+        if end >= 0:
+            value = value[:end]
+        if not self.raw_strings:
+            value = value.decode('utf-8')
         if isinstance(self.value, dict):
             if self.key is None:
                 raise RuntimeError('key must not be None')
@@ -233,11 +362,24 @@ class VmUnpackState(VmState):
 
     def unpack_struct(self, struct_obj: struct.Struct, elem_len: int, data: bytearray, data_offset: int, array_len: int):
         if array_len > 0:
-            value = []
-            for i in range(array_len):
-                tmp, = struct_obj.unpack_from(data, data_offset)
-                value.append(tmp)
-                data_offset+=elem_len
+            items = array_struct(struct_obj, array_len).unpack_from(data, data_offset)
+            if self.target is not None:
+                if isinstance(self.value, dict):
+                    container = self.value.get(self.key)
+                elif self.value is None and self.depth == 0:
+                    container = self.target
+                else:
+                    container = None
+                if type(container) is list and len(container) == array_len:
+                    container[:] = items
+                    if self.value is None:
+                        self.value = container
+                    return data_offset+elem_len*array_len
+            if self.compact_arrays:
+                value = array.array(ARRAY_TYPECODE_MAP[struct_obj.format[-1]], items)
+            else:
+                value = list(items)
+            data_offset+=elem_len*array_len
         else:
             value, = struct_obj.unpack_from(data, data_offset)
             data_offset+=elem_len
@@ -247,4 +389,14 @@ class VmUnpackState(VmState):
             self.value[self.key] = value
         else:
             self.value = value
-        return data_offset
\ No newline at end of file
+        return data_offset
+
+    def unpack_fields(self, struct_obj: struct.Struct, data_len: int, keys: tuple, data: bytearray, data_offset: int):
+        """
+        Unpacks several consecutive record fields of the same type using a single struct_obj.unpack_from call
+        """
+        if not isinstance(self.value, dict):
+            raise RuntimeError("unpack_fields performed before record_enter")
+        self.value.update(zip(keys, struct_obj.unpack_from(data, data_offset)))
+        self.key = keys[-1]
+        return data_offset+data_len
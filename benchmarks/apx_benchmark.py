@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the APX parser, compiler, VM and NodeData.
+
+Generates synthetic nodes of configurable size and shape and measures:
+ - Parser.loads
+ - Node.finalize
+ - Compiler.compilePackProg/compileUnpackProg
+ - VM.exec_pack_prog/exec_unpack_prog
+ - NodeData construction with cold and warm process-wide compiler caches, and port IO including span reads of all
+   require ports (one set of results per backend)
+
+Results are written as JSON, e.g.:
+    python3 benchmarks/apx_benchmark.py --ports 1000 --output results-0.3.1.json
+"""
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import apx
+import argparse
+import json
+import platform
+import statistics
+import time
+
+SHAPES = ['scalar', 'array', 'record', 'deep', 'shared']
+BACKENDS = [apx.BACKEND_VM, apx.BACKEND_STRUCT, apx.BACKEND_PYTHON]
+
+_scalar_types = ['C', 'S', 'L', 'c', 's', 'l']
+_array_types = ['C[8]', 'S[16]', 'L[4]', 's[8]', 'a[16]']
+_num_shared_types = 8
+
+def _record_signature(depth, width=4):
+    fields = ''.join('"f{:d}"{}'.format(i, _scalar_types[i % len(_scalar_types)]) for i in range(width))
+    if depth > 1:
+        fields += '"child"' + _record_signature(depth-1, width)
+    return '{' + fields + '}'
+
+def port_signature(shape, i):
+    """
+    Returns data signature of port number i in a node of the given shape
+    """
+    if shape == 'scalar':
+        return _scalar_types[i % len(_scalar_types)]
+    elif shape == 'array':
+        return _array_types[i % len(_array_types)]
+    elif shape == 'record':
+        return _record_signature(1, width=8+(i % 8))
+    elif shape == 'deep':
+        return _record_signature(4)
+    elif shape == 'shared':
+        return 'T["Type{:d}_T"]'.format(i % _num_shared_types)
+    else:
+        raise ValueError('Unknown shape: {}'.format(shape))
+
+def generate_apx_text(shape, num_ports, name='BenchmarkNode'):
+    """
+    Returns APX text of a synthetic node with num_ports ports (half require ports, half provide ports)
+    """
+    lines = ['APX/1.2', 'N"{}"'.format(name)]
+    if shape == 'shared':
+        for i in range(_num_shared_types):
+            lines.append('T"Type{:d}_T"{}'.format(i, _record_signature(1, 2+i) if i % 2 else _scalar_types[i % len(_scalar_types)]))
+    num_provide = num_ports // 2
+    for i in range(num_ports):
+        port_type = 'P' if i < num_provide else 'R'
+        lines.append('{}"Port{:d}"{}'.format(port_type, i, port_signature(shape, i)))
+    return '\n'.join(lines)+'\n'
+
+def sample_value(dataElement):
+    """
+    Returns a python value that can be packed using the data element
+    """
+    dataElement = dataElement.resolve_data_element()
+    if dataElement.typeCode == apx.STRING_TYPE_CODE:
+        return 'abc'
+    if dataElement.typeCode == apx.RECORD_TYPE_CODE:
+        value = {elem.name: sample_value(elem) for elem in dataElement.elements}
+    else:
+        value = 1
+    if dataElement.isArray():
+        return [value]*dataElement.arrayLen
+    return value
+
+def measure(func, repeat, number, setup=None):
+    """
+    Calls func number times, repeat times. setup (when given) is called before each repetition and its result is passed to func.
+    Returns dict with the min and median time per call (seconds).
+    """
+    samples = []
+    for i in range(repeat):
+        arg = setup() if setup is not None else None
+        begin = time.perf_counter()
+        if setup is not None:
+            for j in range(number):
+                func(arg)
+        else:
+            for j in range(number):
+                func()
+        samples.append((time.perf_counter()-begin)/number)
+    return {'min': min(samples), 'median': statistics.median(samples), 'repeat': repeat, 'number': number}
+
+def clear_compiler_caches():
+    """
+    Empties the process-wide caches of compiled programs, generated codecs and record field indexes
+    """
+    apx.compiler.program_cache.clear()
+    apx.compiler._py_codec_cache.clear()
+    apx.compiler._field_index_cache.clear()
+
+def run_shape(shape, num_ports, repeat, number):
+    """
+    Runs all benchmarks for one node shape, returns dict of results keyed by benchmark name
+    """
+    results = {}
+    apx_text = generate_apx_text(shape, num_ports)
+    results['parse'] = measure(lambda: apx.Parser().loads(apx_text), repeat, 1)
+    results['finalize'] = measure(lambda node: node.finalize(), repeat, 1, setup=lambda: apx.Parser().loads(apx_text))
+    node = apx.Parser().loads(apx_text).finalize()
+    elements = [(port, port.dsg.resolve_data_element(node.dataTypes)) for port in node.providePorts+node.requirePorts]
+    compiler = apx.Compiler()
+    results['compile_pack'] = measure(lambda: [compiler.compilePackProg(elem) for port, elem in elements], repeat, 1)
+    results['compile_unpack'] = measure(lambda: [compiler.compileUnpackProg(elem) for port, elem in elements], repeat, 1)
+    vm = apx.VM()
+    programs = []
+    for port, elem in elements:
+        value = sample_value(elem)
+        data = bytearray(port.dsg.packLen())
+        programs.append((compiler.compilePackProg(elem), compiler.compileUnpackProg(elem), data, value))
+    def vm_pack():
+        for pack_prog, unpack_prog, data, value in programs:
+            vm.exec_pack_prog(pack_prog, data, 0, value)
+    def vm_unpack():
+        for pack_prog, unpack_prog, data, value in programs:
+            vm.exec_unpack_prog(unpack_prog, data, 0)
+    vm_pack()
+    for name, func in [('vm_pack', vm_pack), ('vm_unpack', vm_unpack)]:
+        try:
+            results[name] = measure(func, repeat, number)
+        except NotImplementedError as err:
+            results[name] = {'error': 'NotImplementedError: {}'.format(err)}
+    for backend in BACKENDS:
+        try:
+            results['node_data_create_cold[{}]'.format(backend)] = measure(lambda arg: apx.NodeData(apx_text, backend=backend), repeat, 1, clear_compiler_caches)
+            results['node_data_create_warm[{}]'.format(backend)] = measure(lambda: apx.NodeData(apx_text, backend=backend), repeat, 1)
+            node_data = apx.NodeData(apx_text, backend=backend)
+            provide_values = [(port, sample_value(port.dsg.resolve_data_element(node_data.node.dataTypes))) for port in node_data.node.providePorts]
+            require_ports = node_data.node.requirePorts
+            def write_ports():
+                for port, value in provide_values:
+                    node_data.write_provide_port(port, value)
+            def read_ports():
+                for port in require_ports:
+                    node_data.read_require_port(port)
+            results['node_data_write[{}]'.format(backend)] = measure(write_ports, repeat, number)
+            results['node_data_read[{}]'.format(backend)] = measure(read_ports, repeat, number)
+            results['node_data_read_span[{}]'.format(backend)] = measure(node_data.read_require_ports, repeat, number)
+        except NotImplementedError as err:
+            results['node_data[{}]'.format(backend)] = {'error': 'NotImplementedError: {}'.format(err)}
+    return results
+
+def run(shapes, num_ports, repeat, number):
+    return {
+        'apx_version': apx.__version__,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime()),
+        'parameters': {'ports': num_ports, 'repeat': repeat, 'number': number},
+        'results': {shape: run_shape(shape, num_ports, repeat, number) for shape in shapes},
+    }
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='APX benchmark suite')
+    arg_parser.add_argument('--shape', action='append', choices=SHAPES, help='node shape to benchmark (default: all shapes)')
+    arg_parser.add_argument('--ports', type=int, default=200, help='number of ports in each generated node')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='number of repetitions of each measurement')
+    arg_parser.add_argument('--number', type=int, default=10, help='number of calls per repetition (IO benchmarks)')
+    arg_parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+    args = arg_parser.parse_args(argv)
+    result = run(args.shape if args.shape else SHAPES, args.ports, args.repeat, args.number)
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            fp.write(text+'\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
@@ -238,8 +238,8 @@ class FileManager:
                if transmitHandler is not None:
                   transmitHandler.send(header+fileInfo)
             elif msgType == RMF_MSG_WRITE_DATA:
-               (address,data)=msg[1:3]
-               header = packHeader(address)
+               (address,data,more_bit)=msg[1:4]
+               header = packHeader(address, more_bit)
                if transmitHandler is not None:
                   transmitHandler.send(header+data)         
             elif msgType == RMF_MSG_FILEOPEN:
@@ -337,7 +337,7 @@ class FileManager:
                file.open()               
                fileContent = file.read(0,file.length)
                if fileContent is not None:
-                  msg=(RMF_MSG_WRITE_DATA,file.address, fileContent)
+                  msg=(RMF_MSG_WRITE_DATA,file.address, fileContent, False)
                   self.msgQueue.put(msg)
          elif cmd==RMF_CMD_FILE_CLOSE:
             address = unpackFileClose(data, self.byteOrder)            
@@ -355,11 +355,11 @@ class FileManager:
          if (offset>=0) and (offset+len(data)<=remoteFile.length):
             remoteFile.write(offset, data, more_bit)
    
-   def outPortDataWriteNotify(self, file: File, offset : int, length : int):
+   def outPortDataWriteNotify(self, file: File, offset : int, length : int, more_bit : bool = False):
       assert(file.address is not None)
       fileContent=file.read(offset, length)
       if fileContent is not None:
-         msg=(RMF_MSG_WRITE_DATA,file.address+offset, fileContent)
+         msg=(RMF_MSG_WRITE_DATA,file.address+offset, fileContent, more_bit)
          self.msgQueue.put(msg)
    
 from remotefile.socket_adapter import TcpSocketAdapter
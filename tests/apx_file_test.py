@@ -46,6 +46,19 @@ class TestApxFile(unittest.TestCase):
       self.assertEqual(len(data), 3)
       self.assertEqual(data, b"\x01\x02\x03")
 
+   def test_input_file_more_bit(self):
+      mockDataHandler = MockNodeDataHandler()
+      inFile = apx.InputFile('test1.in', 10)
+      inFile.nodeDataHandler=mockDataHandler
+      inFile.write(6, b"\x01\x02", True)
+      inFile.write(0, b"\x03", True)
+      self.assertEqual(len(mockDataHandler.calls), 0)
+      inFile.write(8, b"\x04", False)
+      self.assertEqual([(call.offset, call.length) for call in mockDataHandler.calls], [(0, 1), (6, 3)])
+      inFile.write(1, b"\x05")
+      self.assertEqual(mockDataHandler.calls[-1], FileWrite(inFile, 1, 1))
+      self.assertEqual(len(mockDataHandler.calls), 3)
+
    def test_output_file(self):
       outFile = apx.OutputFile('test1.out', 5)
       self.assertIsInstance(outFile.data, bytearray)
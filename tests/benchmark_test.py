@@ -0,0 +1,30 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+import apx
+import unittest
+import json
+import apx_benchmark
+
+class TestBenchmark(unittest.TestCase):
+
+   def test_generated_nodes(self):
+      for shape in apx_benchmark.SHAPES:
+         node = apx.Parser().loads(apx_benchmark.generate_apx_text(shape, 10))
+         self.assertEqual(len(node.providePorts), 5)
+         self.assertEqual(len(node.requirePorts), 5)
+         for port in node.providePorts:
+            dataElement = port.dsg.resolve_data_element(node.dataTypes)
+            data = bytearray(port.dsg.packLen())
+            apx.VM().exec_pack_prog(apx.Compiler().compilePackProg(dataElement), data, 0, apx_benchmark.sample_value(dataElement))
+
+   def test_run(self):
+      result = apx_benchmark.run(['scalar', 'record'], 4, 1, 1)
+      self.assertEqual(result['apx_version'], apx.__version__)
+      self.assertEqual(sorted(result['results'].keys()), ['record', 'scalar'])
+      for name in ['parse', 'finalize', 'compile_pack', 'compile_unpack', 'vm_pack', 'vm_unpack', 'node_data_create_cold[vm]', 'node_data_create_warm[python]', 'node_data_read[struct]', 'node_data_write[python]']:
+         self.assertIn('min', result['results']['scalar'][name])
+      json.dumps(result)
+
+if __name__ == '__main__':
+   unittest.main()
@@ -21,6 +21,16 @@ P"EngineSpeed"T[1]
         client.write('EngineSpeed', 0xFFFF)
         self.assertEqual(client.nodeData.outPortDataFile.read(0,2), bytes([0x34, 0x12]))
         self.assertEqual(client.nodeData.outPortDataFile.read(2,2), bytes([0xFF, 0xFF]))
+        client.write_many({'VehicleSpeed': 0x5678, 1: 0x9ABC})
+        self.assertEqual(client.nodeData.outPortDataFile.read(0,4), bytes([0x78, 0x56, 0xBC, 0x9A]))
+        with client.transaction():
+            client.write('VehicleSpeed', 1)
+            client.write('EngineSpeed', 2)
+            self.assertEqual(client.nodeData.outPortDataFile.read(0,4), bytes([0x78, 0x56, 0xBC, 0x9A]))
+        self.assertEqual(client.nodeData.outPortDataFile.read(0,4), bytes([1, 0, 2, 0]))
+        client = apx.Client()
+        with client.transaction():
+            client.write('VehicleSpeed', 1)
 
     def test_create_require_ports(self):
         apx_text = """APX/1.2
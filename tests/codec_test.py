@@ -0,0 +1,184 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import apx
+import unittest
+import struct
+import array
+
+def compile_codec(dsg):
+   return apx.Compiler().compileStructCodec(apx.DataSignature(dsg).dataElement)
+
+class TestStructCodec(unittest.TestCase):
+
+   def test_scalar(self):
+      codec = compile_codec('L')
+      data = bytearray(6)
+      self.assertEqual(codec.pack(0x12345678, data, 2), 6)
+      self.assertEqual(data, bytearray([0, 0, 0x78, 0x56, 0x34, 0x12]))
+      self.assertEqual(codec.unpack(data, 2), 0x12345678)
+
+   def test_signed_array(self):
+      codec = compile_codec('s[3]')
+      data = bytearray(6)
+      codec.pack([-918, 600, 42], data)
+      self.assertEqual(data, bytearray([0x6a,0xfc, 0x58,0x02, 42,0]))
+      self.assertEqual(codec.unpack(data), [-918, 600, 42])
+      with self.assertRaises(ValueError):
+         codec.pack([1, 2], data)
+
+   def test_string(self):
+      codec = compile_codec('a[8]')
+      data = bytearray(8)
+      codec.pack('Hello', data)
+      self.assertEqual(data, bytearray('Hello\0\0\0'.encode('utf-8')))
+      self.assertEqual(codec.unpack(data), 'Hello')
+      codec.pack('Selected', data)
+      self.assertEqual(codec.unpack(data), 'Selected')
+      self.assertEqual(codec.unpack(bytes(8)), '')
+
+   def test_raw_strings(self):
+      for codec in [apx.Compiler().compileStructCodec(apx.DataSignature('{"Id"C"Name"a[6]}').dataElement, rawStrings=True),
+                    apx.Compiler().compilePyCodec(apx.DataSignature('{"Id"C"Name"a[6]}').dataElement, rawStrings=True)]:
+         data = bytearray(7)
+         codec.pack({'Id': 1, 'Name': b'Abc'}, data)
+         self.assertEqual(data, bytearray(b'\x01Abc\0\0\0'))
+         self.assertEqual(codec.unpack(data), {'Id': 1, 'Name': b'Abc'})
+         self.assertEqual(codec.unpack(bytearray(b'\x02\xff\xfeXYZW')), {'Id': 2, 'Name': b'\xff\xfeXYZW'})
+      self.assertIsNot(apx.Compiler().compilePyCodec(apx.DataSignature('a[6]').dataElement, rawStrings=True),
+                       apx.Compiler().compilePyCodec(apx.DataSignature('a[6]').dataElement))
+
+   def test_scalar_record(self):
+      codec = compile_codec('{"SoundId"S"Volume"C"Repetitions"C}')
+      data = bytearray(4)
+      codec.pack({'SoundId': 63, 'Volume': 12, 'Repetitions': 1}, data)
+      self.assertEqual(data, bytearray([63, 0, 12, 1]))
+      self.assertEqual(codec.unpack(data), {'SoundId': 63, 'Volume': 12, 'Repetitions': 1})
+
+   def test_single_field_record(self):
+      codec = compile_codec('{"Id"S}')
+      data = bytearray(2)
+      codec.pack({'Id': 0x1234}, data)
+      self.assertEqual(data, bytearray([0x34, 0x12]))
+      self.assertEqual(codec.unpack(data), {'Id': 0x1234})
+
+   def test_mixed_record(self):
+      codec = compile_codec('{"Name"a[8]"Id"L"Data"S[3]}')
+      data = bytearray(18)
+      value = {'Name': 'Abc', 'Id': 918, 'Data': [1000, 2000, 4000]}
+      codec.pack(value, data)
+      self.assertEqual(data, bytearray("Abc\0\0\0\0\0".encode('utf-8')+struct.pack('<L',918)+struct.pack('<HHH', 1000, 2000, 4000)))
+      self.assertEqual(codec.unpack(data), value)
+      with self.assertRaises(ValueError):
+         codec.pack([1, 2, 3], data)
+
+   def test_compact_arrays(self):
+      dataElement = apx.DataSignature('{"Id"S"Data"l[3]}').dataElement
+      codec = apx.Compiler().compileStructCodec(dataElement, compactArrays=True)
+      data = bytearray(struct.pack('<Hiii', 7, -1, 0, 1))
+      value = codec.unpack(data)
+      self.assertIsInstance(value['Data'], array.array)
+      self.assertEqual(value['Data'].itemsize, 4)
+      self.assertEqual(value['Data'].tolist(), [-1, 0, 1])
+      packed = bytearray(len(data))
+      codec.pack(value, packed)
+      self.assertEqual(packed, data)
+
+   def test_matches_vm(self):
+      compiler = apx.Compiler()
+      dataElement = apx.DataSignature('{"Name"a[4]"Flags"c[2]"Id"l}').dataElement
+      codec = compiler.compileStructCodec(dataElement)
+      data = bytearray([0x41, 0x42, 0, 0, 0xFF, 0x01, 0x78, 0x56, 0x34, 0x12])
+      vm = apx.VM()
+      self.assertEqual(codec.unpack(data), vm.exec_unpack_prog(compiler.compileUnpackProg(dataElement), data, 0))
+      vm_data = bytearray(len(data))
+      vm.exec_pack_prog(compiler.compilePackProg(dataElement), vm_data, 0, codec.unpack(data))
+      codec_data = bytearray(len(data))
+      codec.pack(codec.unpack(data), codec_data)
+      self.assertEqual(codec_data, vm_data)
+
+   def test_unpack_into(self):
+      codec = compile_codec('{"Id"C"Data"S[2]"Name"a[4]}')
+      target = codec.unpack(struct.pack('<BHH4s', 1, 2, 3, b'ab'))
+      data_list = target['Data']
+      self.assertIs(codec.unpack_into(target, struct.pack('<BHH4s', 4, 5, 6, b'cd')), target)
+      self.assertIs(target['Data'], data_list)
+      self.assertEqual(target, {'Id': 4, 'Data': [5, 6], 'Name': 'cd'})
+      with self.assertRaises(ValueError):
+         codec.unpack_into([], bytes(codec.size))
+      codec = compile_codec('S[2]')
+      target = [0, 0]
+      self.assertIs(codec.unpack_into(target, struct.pack('<HH', 7, 8)), target)
+      self.assertEqual(target, [7, 8])
+
+class TestPyCodec(unittest.TestCase):
+
+   def test_scalar(self):
+      codec = apx.Compiler().compilePyCodec(apx.DataElement.SInt16())
+      self.assertIsInstance(codec, apx.PyCodec)
+      self.assertEqual(codec.signature, 's')
+      data = bytearray(2)
+      self.assertEqual(codec.pack(-2, data), 2)
+      self.assertEqual(data, bytearray([0xFE, 0xFF]))
+      self.assertEqual(codec.unpack(data), -2)
+
+   def test_nested_record(self):
+      codec = apx.Compiler().compilePyCodec(apx.DataSignature('{"SensorData"{"x"S"y"S"z"S}"TimeStamp"L"Name"a[4]}').dataElement)
+      data = bytearray(codec.size)
+      value = {"SensorData": dict(x = 1, y =2, z= 3), 'TimeStamp':0x12345678, 'Name': 'ab'}
+      codec.pack(value, data)
+      self.assertEqual(data, bytearray(struct.pack("<HHHL4s", 1, 2, 3, 0x12345678, b'ab')))
+      self.assertEqual(codec.unpack(data), value)
+
+   def test_unpack_into(self):
+      codec = apx.Compiler().compilePyCodec(apx.DataSignature('{"SensorData"{"x"S"y"S}"Data"C[2]"Name"a[4]}').dataElement)
+      target = codec.unpack(struct.pack("<HHBB4s", 1, 2, 3, 4, b'ab'))
+      sensor_data, data_list = target['SensorData'], target['Data']
+      self.assertIs(codec.unpack_into(target, struct.pack("<HHBB4s", 5, 6, 7, 8, b'cd')), target)
+      self.assertIs(target['SensorData'], sensor_data)
+      self.assertIs(target['Data'], data_list)
+      self.assertEqual(target, {"SensorData": dict(x = 5, y = 6), 'Data': [7, 8], 'Name': 'cd'})
+      self.assertEqual(codec.unpack_into({}, struct.pack("<HHBB4s", 5, 6, 7, 8, b'cd')), target)
+      with self.assertRaises(ValueError):
+         codec.unpack_into(None, bytes(codec.size))
+      codec = apx.Compiler().compilePyCodec(apx.DataElement.UInt32(arrayLen=2))
+      target = [0, 0]
+      self.assertIs(codec.unpack_into(target, struct.pack("<LL", 1, 2)), target)
+      self.assertEqual(target, [1, 2])
+
+   def test_array(self):
+      codec = apx.Compiler().compilePyCodec(apx.DataElement.UInt32(arrayLen=3))
+      data = bytearray(codec.size)
+      codec.pack([1, 2, 3], data)
+      self.assertEqual(codec.unpack(data), [1, 2, 3])
+      with self.assertRaises(ValueError):
+         codec.pack([1, 2], data)
+
+   def test_compact_arrays(self):
+      compiler = apx.Compiler()
+      dataElement = apx.DataElement.UInt16(arrayLen=3)
+      codec = compiler.compilePyCodec(dataElement, compactArrays=True)
+      self.assertIsNot(codec, compiler.compilePyCodec(dataElement))
+      data = bytearray(struct.pack('<HHH', 1, 2, 0xFFFF))
+      value = codec.unpack(data)
+      self.assertIsInstance(value, array.array)
+      self.assertEqual(value.tolist(), [1, 2, 0xFFFF])
+      packed = bytearray(6)
+      codec.pack(value, packed)
+      self.assertEqual(packed, data)
+
+   def test_shared_by_signature(self):
+      compiler = apx.Compiler()
+      node1 = apx.Node('Node1')
+      node1.append(apx.DataType('Speed_T', 'S(0,10000)'))
+      node1.append(apx.RequirePort('Speed', '{"Value"T["Speed_T"]"Valid"C}'))
+      node2 = apx.Node('Node2')
+      node2.append(apx.ProvidePort('Speed', '{"Value"S"Valid"C(0,1)}'))
+      port1 = node1.find('Speed')
+      port2 = node2.find('Speed')
+      codec1 = compiler.compilePyCodec(port1.dsg.resolve_data_element(node1.dataTypes))
+      codec2 = compiler.compilePyCodec(port2.dsg.resolve_data_element(node2.dataTypes))
+      self.assertIs(codec1, codec2)
+      self.assertEqual(codec1.signature, '{"Value"S"Valid"C}')
+
+if __name__ == '__main__':
+   unittest.main()
@@ -2,6 +2,7 @@ import os, sys, io
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import apx
 import unittest
+import struct
 
 class TestCompilePackProg(unittest.TestCase):
 
@@ -26,6 +27,12 @@ class TestCompilePackProg(unittest.TestCase):
       self.assertIsInstance(prog, bytes)
       self.assertEqual(prog, bytes([apx.OPCODE_PACK_PROG, apx.UINT32_LEN, 0, 0, 0, apx.OPCODE_PACK_U32]))
 
+   def test_packU64(self):
+      prog = apx.Compiler().compilePackProg(apx.DataElement.UInt64())
+      self.assertEqual(prog, bytes([apx.OPCODE_PACK_PROG, apx.UINT64_LEN, 0, 0, 0, apx.OPCODE_PACK_U64]))
+      prog = apx.Compiler().compilePackProg(apx.DataElement.SInt64(arrayLen=3))
+      self.assertEqual(prog, bytes([apx.OPCODE_PACK_PROG, apx.SINT64_LEN*3, 0, 0, 0, apx.OPCODE_PACK_S64AR, 3, 0]))
+
    def test_packS8(self):
       dataElement = apx.DataElement.SInt8(minVal=0, maxVal=3)
       compiler = apx.Compiler()
@@ -136,6 +143,12 @@ class TestCompileUnpackProg(unittest.TestCase):
       self.assertIsInstance(prog, bytes)
       self.assertEqual(prog, bytes([apx.OPCODE_UNPACK_PROG, apx.UINT32_LEN, 0, 0, 0, apx.OPCODE_UNPACK_U32]))
 
+   def test_unpackU64(self):
+      prog = apx.Compiler().compileUnpackProg(apx.DataElement.SInt64())
+      self.assertEqual(prog, bytes([apx.OPCODE_UNPACK_PROG, apx.SINT64_LEN, 0, 0, 0, apx.OPCODE_UNPACK_S64]))
+      prog = apx.Compiler().compileUnpackProg(apx.DataElement.UInt64(arrayLen=2))
+      self.assertEqual(prog, bytes([apx.OPCODE_UNPACK_PROG, apx.UINT64_LEN*2, 0, 0, 0, apx.OPCODE_UNPACK_U64AR, 2, 0]))
+
    def test_unpackS8(self):
       dataElement = apx.DataElement.SInt8(minVal=0, maxVal=3)
       compiler = apx.Compiler()
@@ -221,6 +234,25 @@ class TestCompileUnpackProg(unittest.TestCase):
       ])
       self.assertEqual(prog, expected)
 
+   def test_unpackRecordArray(self):
+      dataElement = apx.DataSignature('{"Id"C"Value"S}[2]').dataElement
+      prog = apx.Compiler().compileUnpackProg(dataElement)
+      record = bytes([apx.OPCODE_RECORD_ENTER, apx.OPCODE_RECORD_SELECT])+"Id\0".encode('ascii')+bytes([
+         apx.OPCODE_UNPACK_U8, apx.OPCODE_RECORD_SELECT])+"Value\0".encode('ascii')+bytes([
+         apx.OPCODE_UNPACK_U16, apx.OPCODE_RECORD_LEAVE])
+      expected = bytes([apx.OPCODE_UNPACK_PROG, 6, 0, 0, 0, apx.OPCODE_RECORD_ARRAY, 2, 0]) + record + bytes([apx.OPCODE_ARRAY_LEAVE])
+      self.assertEqual(prog, expected)
+      large = apx.Compiler().compileUnpackProg(apx.DataSignature('{"Id"C"Value"S}[1000]').dataElement)
+      self.assertEqual(large, bytes([apx.OPCODE_UNPACK_PROG, 0xB8, 0x0B, 0, 0, apx.OPCODE_RECORD_ARRAY, 0xE8, 0x03]) + record + bytes([apx.OPCODE_ARRAY_LEAVE]))
+
+   def test_unpackArrayOfReferences(self):
+      node = apx.Node('TestNode')
+      node.append(apx.DataType('Data_T', 'S[3]'))
+      node.append(apx.RequirePort('Data', 'T["Data_T"]'))
+      port = node.find('Data')
+      prog = apx.Compiler().compileUnpackProg(port.dsg.resolve_data_element(node.dataTypes))
+      self.assertEqual(prog, bytes([apx.OPCODE_UNPACK_PROG, 6, 0, 0, 0, apx.OPCODE_UNPACK_U16AR, 3, 0]))
+
 
 class TestCompilerFromApxNode(unittest.TestCase):
 
@@ -352,5 +384,137 @@ class TestCompilerFromApxNode(unittest.TestCase):
       ])
       self.assertEqual(prog, expected)
 
+class TestCompileStructCodec(unittest.TestCase):
+
+   def test_compile_scalar(self):
+      compiler = apx.Compiler()
+      codec = compiler.compileStructCodec(apx.DataElement.UInt16())
+      self.assertIsInstance(codec, apx.StructCodec)
+      self.assertEqual(codec.struct.format, '<H')
+      self.assertEqual(codec.size, apx.UINT16_LEN)
+
+   def test_compile_array_and_string(self):
+      compiler = apx.Compiler()
+      codec = compiler.compileStructCodec(apx.DataElement.SInt32(arrayLen=4))
+      self.assertEqual(codec.struct.format, '<4i')
+      codec = compiler.compileStructCodec(apx.DataElement.String(arrayLen=10))
+      self.assertEqual(codec.struct.format, '<10s')
+
+   def test_compile_record(self):
+      compiler = apx.Compiler()
+      node = apx.Node('TestNode')
+      node.append(apx.DataType('SoundId_T', 'S'))
+      node.append(apx.RequirePort('SoundRequest', '{"SoundId"T["SoundId_T"]"Name"a[10]"Data"C[3]}'))
+      port = node.find('SoundRequest')
+      codec = compiler.compileStructCodec(port.dsg.resolve_data_element(node.dataTypes))
+      self.assertEqual(codec.struct.format, '<H10s3B')
+      self.assertEqual(codec.keys, ('SoundId', 'Name', 'Data'))
+      self.assertEqual(codec.size, port.dsg.packLen())
+
+   def test_compile_nested_record_returns_none(self):
+      compiler = apx.Compiler()
+      dataElement = apx.DataSignature('{"SensorData"{"x"S"y"S}"TimeStamp"L}').dataElement
+      self.assertIsNone(compiler.compileStructCodec(dataElement))
+
+class TestCompileBoundsCheck(unittest.TestCase):
+
+   def test_scalar_and_array(self):
+      compiler = apx.Compiler()
+      check = compiler.compileBoundsCheck(apx.DataSignature('C(0,3)').dataElement)
+      self.assertEqual((check.kind, check.lower, check.upper), (apx.CHECK_SCALAR, 0, 3))
+      check.check(3)
+      with self.assertRaises(ValueError):
+         check.check(4)
+      check = compiler.compileBoundsCheck(apx.DataSignature('s[3]').dataElement)
+      self.assertEqual((check.kind, check.lower, check.upper, check.count), (apx.CHECK_ARRAY, -32768, 32767, 3))
+      check.check([-32768, 0, 32767])
+      for value in [[0, 0], [0, 0, 0, 0], [0, 32768, 0], 0]:
+         with self.assertRaises(ValueError):
+            check.check(value)
+
+   def test_record(self):
+      node = apx.Node('TestNode')
+      node.append(apx.DataType('Level_T', 'C(0,7)'))
+      node.append(apx.ProvidePort('Status', '{"Level"T["Level_T"]"Name"a[4]"Items"{"Id"S}[2]}'))
+      dataElement = node.find('Status').dsg.resolve_data_element(node.dataTypes)
+      check = apx.Compiler().compileBoundsCheck(dataElement)
+      self.assertEqual([key for key, child in check.fields], ['Level', 'Name', 'Items'])
+      self.assertEqual(check.fields[2][1].kind, apx.CHECK_RECORD_ARRAY)
+      check.check({'Level': 7, 'Name': 'abcd', 'Items': [{'Id': 1}, {'Id': 2}]})
+      with self.assertRaisesRegex(ValueError, r'^Status\.Level: value 8 is out of range \[0, 7\]$'):
+         check.check({'Level': 8, 'Name': '', 'Items': [{'Id': 1}, {'Id': 2}]}, 'Status')
+      with self.assertRaisesRegex(ValueError, r'^Status\.Name: '):
+         check.check({'Level': 0, 'Name': 'abcde', 'Items': [{'Id': 1}, {'Id': 2}]}, 'Status')
+      with self.assertRaisesRegex(ValueError, r'^Status\.Items\[1\]\.Id: '):
+         check.check({'Level': 0, 'Name': '', 'Items': [{'Id': 1}, {'Id': -1}]}, 'Status')
+      with self.assertRaisesRegex(ValueError, r'^Status\.Items\[0\]: missing record field "Id"$'):
+         check.check({'Level': 0, 'Name': '', 'Items': [{}, {'Id': 1}]}, 'Status')
+
+class TestCompileFieldCodec(unittest.TestCase):
+
+   def test_field_index(self):
+      compiler = apx.Compiler()
+      dataElement = apx.DataSignature('{"Name"a[10]"Id"S"SensorData"{"x"S"y"S}"Data"L[3]}').dataElement
+      index = compiler.compileFieldIndex(dataElement)
+      self.assertEqual([(name, offset) for name, (offset, elem) in index.items()],
+                       [('Name', 0), ('Id', 10), ('SensorData', 12), ('Data', 16)])
+      self.assertIs(compiler.compileFieldIndex(apx.DataSignature('{"Name"a[10]"Id"S(0,10)"SensorData"{"x"S"y"S}"Data"L[3]}').dataElement), index)
+      with self.assertRaises(ValueError):
+         compiler.compileFieldIndex(apx.DataElement.UInt8())
+
+   def test_field_paths(self):
+      compiler = apx.Compiler()
+      dataElement = apx.DataSignature('{"Name"a[10]"Id"S"SensorData"{"x"S"y"S}"Data"L[3]}').dataElement
+      data = struct.pack('<10sHHHLLL', b'Abc', 918, 1, 2, 100, 200, 300)
+      for path, offset, value in [('Id', 10, 918), ('Name', 0, 'Abc'), ('SensorData', 12, {'x': 1, 'y': 2}),
+                                  ('SensorData.y', 14, 2), ('Data', 16, [100, 200, 300]), ('Data[2]', 24, 300)]:
+         fieldOffset, codec = compiler.compileFieldCodec(dataElement, path)
+         self.assertEqual(fieldOffset, offset)
+         self.assertEqual(codec.unpack(data, fieldOffset), value)
+      for path in ['Missing', 'Id.x', 'Id[0]', 'Name[1]', 'Data[3]', 'Data[x]']:
+         with self.assertRaises(ValueError):
+            compiler.compileFieldCodec(dataElement, path)
+
+class TestProgramCache(unittest.TestCase):
+
+   def test_lru_eviction(self):
+      cache = apx.ProgramCache(maxsize=2)
+      self.assertEqual(cache.get('a', lambda: b'A'), b'A')
+      self.assertEqual(cache.get('b', lambda: b'B'), b'B')
+      self.assertEqual(cache.get('a', lambda: b'X'), b'A')
+      self.assertEqual(cache.get('c', lambda: b'C'), b'C') #evicts 'b'
+      self.assertEqual(cache.get('b', lambda: b'B2'), b'B2')
+      self.assertEqual(cache.stats(), {'hits': 1, 'misses': 4, 'size': 2, 'maxsize': 2})
+      cache.resize(1)
+      self.assertEqual(list(cache.programs.keys()), ['b'])
+      cache.clear()
+      self.assertEqual(cache.stats(), {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 1})
+
+   def test_shared_by_signature(self):
+      compiler = apx.Compiler()
+      node = apx.Node('TestNode')
+      node.append(apx.DataType('Speed_T', 'S(0,10000)'))
+      node.append(apx.RequirePort('Speed1', 'T["Speed_T"]'))
+      node.append(apx.RequirePort('Speed2', 'S'))
+      prog1 = compiler.getUnpackProg(node.find('Speed1').dsg.resolve_data_element(node.dataTypes))
+      stats = apx.program_cache.stats()
+      prog2 = compiler.getUnpackProg(node.find('Speed2').dsg.resolve_data_element(node.dataTypes))
+      self.assertIs(prog1, prog2)
+      self.assertEqual(prog1, compiler.compileUnpackProg(apx.DataElement.UInt16()))
+      self.assertEqual(apx.program_cache.stats()['hits'], stats['hits']+1)
+      self.assertNotEqual(compiler.getPackProg(apx.DataElement.UInt16()), prog1)
+
+   def test_codecs_and_field_indexes_are_bounded(self):
+      compiler = apx.Compiler()
+      dataElement = apx.DataSignature('{"Id"C"Value"S}').dataElement
+      for cache in [apx.compiler._py_codec_cache, apx.compiler._field_index_cache]:
+         self.assertIsInstance(cache, apx.ProgramCache)
+         self.assertEqual(cache.maxsize, apx.compiler.DEFAULT_CODEC_CACHE_SIZE)
+      self.assertIs(compiler.compilePyCodec(dataElement), compiler.compilePyCodec(dataElement))
+      self.assertIs(compiler.compileFieldIndex(dataElement), compiler.compileFieldIndex(dataElement))
+      cache = apx.ProgramCache()
+      self.assertIsNone(cache.get('unsupported', lambda: None))
+      self.assertEqual(cache.stats()['size'], 0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -254,6 +254,19 @@ class TestDataSignatureInitValues(unittest.TestCase):
         data = dsg.createInitData(attr.initValue)
         self.assertEqual(b'\xFF\xFF\xFF\xFF', bytes(data))
 
+    def test_create_init_data_u64(self):
+        dsg = apx.base.DataSignature('U')
+        attr = apx.base.PortAttribute('=0x123456789ABCDEF0')
+        data = dsg.createInitData(attr.initValue)
+        self.assertEqual(b'\xF0\xDE\xBC\x9A\x78\x56\x34\x12', bytes(data))
+        dsg = apx.base.DataSignature('u[2]')
+        attr = apx.base.PortAttribute('={-1, 1}')
+        data = dsg.createInitData(attr.initValue)
+        self.assertEqual(b'\xFF'*8+b'\x01'+bytes(7), bytes(data))
+        self.assertEqual(dsg.dataElement.minValWithDefault, -9223372036854775808)
+        self.assertEqual(dsg.dataElement.maxValWithDefault, 9223372036854775807)
+        self.assertEqual(apx.DataElement.UInt64().maxValWithDefault, 0xFFFFFFFFFFFFFFFF)
+
     def test_create_init_data_record(self):
         dsg = apx.base.DataSignature('{"first"C"second"S"third"L}')
 
@@ -367,6 +380,10 @@ class test_elem_size(unittest.TestCase):
         dsg = apx.DataSignature('L')
         self.assertEqual(dsg.packLen(), 4)
 
+    def test_U64(self):
+        self.assertEqual(apx.DataSignature('U').packLen(), 8)
+        self.assertEqual(apx.DataSignature('u[3]').packLen(), 8*3)
+
     def test_U8AR(self):
         dsg = apx.DataSignature('C[8]')
         self.assertEqual(dsg.packLen(), 1*8)
@@ -411,6 +428,19 @@ class test_elem_size(unittest.TestCase):
         dsg = apx.DataSignature('{"TrackTitle"a[40]"TrackLength"L}')
         self.assertEqual(dsg.packLen(), 44)
 
+    def test_record_array(self):
+        dsg = apx.DataSignature('{"Count"C"Tracks"{"Title"a[10]"Length"L}[3]}')
+        self.assertEqual(dsg.packLen(), 1+3*14)
+        tracks = dsg.dataElement.elements[1]
+        self.assertEqual(tracks.typeCode, apx.RECORD_TYPE_CODE)
+        self.assertEqual(tracks.arrayLen, 3)
+        self.assertEqual(str(dsg), '{"Count"C"Tracks"{"Title"a[10]"Length"L}[3]}')
+        dsg = apx.DataSignature('{"Id"C}[2]')
+        self.assertEqual(dsg.packLen(), 2)
+        self.assertTrue(dsg.isArray())
+        initValue = apx.PortAttribute('={{1},{2}}').initValue
+        self.assertEqual(dsg.createInitData(initValue), bytearray([1, 2]))
+
     def test_reference(self):
         typeList = []
         typeList.append(apx.DataType("TestType1", "C[8]"))               #0
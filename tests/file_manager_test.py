@@ -47,6 +47,19 @@ class TestFileManager(unittest.TestCase):
          self.assertEqual(len(mockHandler.transmittedData), 4+63*2)         
       
 
+   def test_writeDataMoreBit(self):
+      output_file = apx.OutputFile('test.out', 4)
+      output_file.address = 0x100
+      with apx.FileManager() as file_manager:
+         file_manager.start()
+         mockHandler = MockTransmitHandler()
+         file_manager.onConnected(mockHandler)
+         output_file.write(0, bytes([1]))
+         file_manager.outPortDataWriteNotify(output_file, 0, 2, True)
+         file_manager.outPortDataWriteNotify(output_file, 2, 2, False)
+         file_manager.stop()
+      self.assertEqual(mockHandler.transmittedData, bytes([0x41, 0x00, 1, 0, 0x01, 0x02, 0, 0]))
+
 
 if __name__ == '__main__':
     unittest.main()   
@@ -3,6 +3,11 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 import apx
 import unittest
 import struct
+import threading
+import gc
+import tempfile
+import json
+from unittest import mock
 
 def create_node_and_data():
    node = apx.Node('TestNode')
@@ -16,6 +21,16 @@ def create_node_and_data():
    node.append(apx.RequirePort('RecordSignal','{"Name"a[8]"Id"L"Data"S[3]}','={"",0xFFFFFFFF,{0,0,0}}'))
    return node
 
+BACKENDS = [apx.BACKEND_VM, apx.BACKEND_STRUCT, apx.BACKEND_PYTHON]
+
+def for_each_backend(test_case, check):
+   """
+   Calls check(backend) for each codec backend, failures are reported per backend (subTest)
+   """
+   for backend in BACKENDS:
+      with test_case.subTest(backend=backend):
+         check(backend)
+
 class TestNodeDataCompile(unittest.TestCase):
 
    def test_port_map_and_compiled_programs(self):
@@ -154,6 +169,57 @@ class TestNodeDataRead(unittest.TestCase):
       input_file.write(data_offset, struct.pack("<HHH",18000,2,10))
       self.assertEqual(node_data.read_require_port(port_RecordSignal), {'Name': "abcdefgh", 'Id':0x12345678, 'Data': [18000,2,10]})
       
+   def test_read_require_port_field(self):
+      node = create_node_and_data()
+      node_data = apx.NodeData(node)
+      port = node.find('RecordSignal')
+      node_data.inPortDataFile.write(9, "Abc\0\0\0\0\0".encode('utf-8')+struct.pack('<L',918)+struct.pack('<HHH', 1000, 2000, 4000))
+      self.assertEqual(node_data.read_require_port_field(port, 'Id'), 918)
+      self.assertEqual(node_data.read_require_port_field(port.id, 'Name'), 'Abc')
+      self.assertEqual(node_data.read_require_port_field(port, 'Data'), [1000, 2000, 4000])
+      self.assertEqual(node_data.read_require_port_field(port, 'Data[1]'), 2000)
+      node_data.inPortDataFile.write(17, struct.pack('<L',919))
+      self.assertEqual(node_data.read_require_port_field(port, 'Id'), 919)
+      with self.assertRaises(ValueError):
+         node_data.read_require_port_field(port, 'Unknown')
+
+   def test_read_bypasses_file_read(self):
+      def check(backend):
+         node = create_node_and_data()
+         node_data = apx.NodeData(node, backend=backend)
+         input_file = node_data.inPortDataFile
+         input_file.write(9, "Abc\0\0\0\0\0".encode('utf-8')+struct.pack('<L',918)+struct.pack('<HHH', 1000, 2000, 4000))
+         def read(offset, length):
+            raise AssertionError('read_require_port must copy the port data under the data lock, not through File.read')
+         input_file.read = read
+         self.assertEqual(node_data.read_require_port(node.find('RecordSignal')), {'Name': "Abc", 'Id': 918, 'Data':[1000,2000,4000]})
+         self.assertEqual(node_data.read_require_port(node.find('RheostatLevelRqst')), 255)
+         self.assertFalse(input_file.dataLock.locked())
+      for_each_backend(self, check)
+
+   def test_read_from_multiple_threads(self):
+      node = create_node_and_data()
+      node_data = apx.NodeData(node, backend=apx.BACKEND_VM)
+      node_data.inPortDataFile.write(9, "Abc\0\0\0\0\0".encode('utf-8')+struct.pack('<L',918)+struct.pack('<HHH', 1000, 2000, 4000))
+      vms = []
+      errors = []
+      def worker(port, expected):
+         vms.append(node_data.vm)
+         for i in range(200):
+            value = node_data.read_require_port(port)
+            if value != expected:
+               errors.append(value)
+      threads = [threading.Thread(target=worker, args=(node.find('RecordSignal'), {'Name': "Abc", 'Id': 918, 'Data':[1000,2000,4000]})),
+                 threading.Thread(target=worker, args=(node.find('RheostatLevelRqst'), 255)),
+                 threading.Thread(target=worker, args=(node.find('StrSignal'), ""))]
+      for thread in threads:
+         thread.start()
+      for thread in threads:
+         thread.join()
+      self.assertEqual(errors, [])
+      self.assertEqual(len(set(id(vm) for vm in vms)), 3)
+      self.assertIs(node_data.vm, node_data.vm)
+
    def test_byte_to_port_all(self):
       node = create_node_and_data()
       node_data = apx.NodeData(node)
@@ -221,6 +287,25 @@ class TestNodeDataRead(unittest.TestCase):
          self.assertEqual(offset, RecordSignal_data_offset)
          self.assertEqual(length, RecordSignal_data_len)
       
+   def test_byte_to_port_large_array_ports(self):
+      node = apx.Node('TestNode')
+      node.append(apx.RequirePort('Header', 'S'))
+      node.append(apx.RequirePort('Samples', 'L[65535]'))
+      node.append(apx.RequirePort('Trailer', 'C'))
+      node_data = apx.NodeData(node)
+      index = node_data.inPortByteMap
+      self.assertIsInstance(index, apx.PortIntervalIndex)
+      self.assertEqual(len(index), 2+4*65535+1)
+      self.assertEqual(index.starts, [0, 2, 2+4*65535])
+      self.assertIs(index[1], node.find('Header'))
+      self.assertIs(index[2+4*65535-1], node.find('Samples'))
+      self.assertIs(index[2+4*65535], node.find('Trailer'))
+      with self.assertRaises(IndexError):
+         index[2+4*65535+1]
+      result = [port.name for port, offset, length in node_data.byte_to_port(1, 4*65535+2)]
+      self.assertEqual(result, ['Header', 'Samples', 'Trailer'])
+      self.assertEqual(list(node_data.byte_to_port(3, 0)), [])
+
    def test_byte_to_port_invalid_args(self):
       node = create_node_and_data()
       node_data = apx.NodeData(node)
@@ -284,6 +369,438 @@ class TestNodeDataRead(unittest.TestCase):
       self.assertEqual(call_history[-1][0], node.find('RecordSignal'))
       self.assertEqual(call_history[-1][1], {'Name': "Abc", 'Id': 918, 'Data':[1000,2000,4000]})
 
+   def test_read_require_ports(self):
+      node = create_node_and_data()
+      node_data = apx.NodeData(node)
+      node_data.inPortDataFile.write(9, "Abc\0\0\0\0\0".encode('utf-8')+struct.pack('<L',918)+struct.pack('<HHH', 1000, 2000, 4000))
+      expected = [255, "", {'Name': "Abc", 'Id': 918, 'Data':[1000,2000,4000]}]
+      self.assertEqual(node_data.read_require_ports(), expected)
+      self.assertEqual(node_data.read_require_ports(1, 3), expected[1:3])
+      self.assertEqual(node_data.read_require_ports(2, 2), [])
+      self.assertEqual(len(node_data.inPortSpanCodecs), 1)
+      self.assertIsInstance(node_data.inPortSpanCodecs[0], apx.SpanCodec)
+      with self.assertRaises(ValueError):
+         node_data.read_require_ports(2, 4)
+
+   def test_read_require_ports_unsupported_span(self):
+      node = create_node_and_data()
+      node_data = apx.NodeData(node)
+      with mock.patch.object(apx.Compiler, 'compileSpanCodec', return_value=None) as compileSpanCodec:
+         self.assertEqual(node_data.read_require_ports(), [255, "", {'Name': "", 'Id': 0xFFFFFFFF, 'Data':[0,0,0]}])
+         self.assertEqual(node_data.read_require_ports(), [255, "", {'Name': "", 'Id': 0xFFFFFFFF, 'Data':[0,0,0]}])
+         self.assertEqual(compileSpanCodec.call_count, 1)
+      self.assertIs(node_data.inPortSpanCodecs[0], apx.SPAN_UNSUPPORTED)
+
+   def test_read_require_port_value_cache(self):
+      node = create_node_and_data()
+      node_data = apx.NodeData(node, cache_values=True)
+      input_file = node_data.inPortDataFile
+      with mock.patch.object(node_data, '_unpackRequirePort', wraps=node_data._unpackRequirePort) as unpack:
+         value = node_data.read_require_port(2)
+         self.assertIs(node_data.read_require_port(2), value)
+         self.assertEqual(unpack.call_count, 1)
+         input_file.write(0, bytes([7]))
+         self.assertIs(node_data.read_require_port(2), value)
+         self.assertEqual(node_data.read_require_port(0), 7)
+         self.assertEqual(unpack.call_count, 2)
+         input_file.write(8, bytes([0, 5]), more_bit=True) #touches StrSignal and RecordSignal
+         self.assertEqual(node_data.inPortByteMap.generations, [1, 1, 1])
+         self.assertEqual(node_data.read_require_port(2)['Name'], "\x05")
+         self.assertEqual(unpack.call_count, 3)
+         target = {}
+         node_data.read_require_port(2, target)
+         self.assertEqual(unpack.call_count, 4)
+      node_data = apx.NodeData(node)
+      self.assertIsNone(node_data.inPortDataFile.portIndex)
+      self.assertIsNot(node_data.read_require_port(2), node_data.read_require_port(2))
+
+   def test_cache_values_enabled_after_construction(self):
+      node = create_node_and_data()
+      node_data = apx.NodeData(node)
+      input_file = node_data.inPortDataFile
+      node_data.cache_values = True
+      value = node_data.read_require_port(2)
+      self.assertIs(node_data.read_require_port(2), value)
+      input_file.write(9, b'Abc\0')
+      self.assertEqual(node_data.read_require_port(2)['Name'], 'Abc')
+      node_data.cache_values = False
+      self.assertIsNone(input_file.portIndex)
+      input_file.write(9, b'Xyz\0')
+      self.assertEqual(node_data.read_require_port(2)['Name'], 'Xyz')
+      node_data.cache_values = True #writes made while disabled must not be hidden by old cache entries
+      self.assertEqual(node_data.read_require_port(2)['Name'], 'Xyz')
+      input_file.write(9, b'Q\0')
+      self.assertEqual(node_data.read_require_port(2)['Name'], 'Q')
+
+   def test_callback_span_unpack(self):
+      call_history = []
+
+      @apx.NodeDataClient.register
+      class Listener:
+         def on_require_port_data(self, port, value):
+            call_history.append((port.name, value))
+
+      node = apx.Node('TestNode')
+      for i in range(apx.SPAN_UNPACK_MIN_PORTS):
+         node.append(apx.RequirePort('Signal{:d}'.format(i), '{"Id"C"Value"s}' if i % 2 else 'S'))
+      node_data = apx.NodeData(node)
+      node_data.nodeDataClient = Listener()
+      values = [{'Id': i, 'Value': -i} if i % 2 else i*100 for i in range(apx.SPAN_UNPACK_MIN_PORTS)]
+      data = b''.join(struct.pack('<Bh', value['Id'], value['Value']) if i % 2 else struct.pack('<H', value) for i, value in enumerate(values))
+      node_data.inPortDataFile.write(0, data)
+      self.assertEqual(call_history, [('Signal{:d}'.format(i), value) for i, value in enumerate(values)])
+      self.assertEqual(node_data.inPortSpanCodecs, [1]) #the first write is decoded port by port
+      del call_history[:]
+      node_data.inPortDataFile.write(0, data)
+      self.assertEqual(call_history, [('Signal{:d}'.format(i), value) for i, value in enumerate(values)])
+      self.assertIsInstance(node_data.inPortSpanCodecs[0], apx.SpanCodec)
+      del call_history[:]
+      node_data.inPortDataFile.write(0, data[:3])
+      self.assertEqual(call_history, [('Signal0', 0), ('Signal1', {'Id': 1, 'Value': -1})])
+
+   def test_callback_span_unpack_chunks(self):
+      call_history = []
+
+      @apx.NodeDataClient.register
+      class Listener:
+         def on_require_port_data(self, port, value):
+            call_history.append((port.id, value))
+
+      node = apx.Node('TestNode')
+      num_ports = apx.SPAN_CHUNK_PORTS*3
+      for i in range(num_ports):
+         node.append(apx.RequirePort('Signal{:d}'.format(i), 'S'))
+      node_data = apx.NodeData(node)
+      node_data.nodeDataClient = Listener()
+      with mock.patch.object(apx.Compiler, 'compileSpanCodec', wraps=apx.Compiler().compileSpanCodec) as compileSpanCodec:
+         for start, stop in [(0, num_ports), (1, num_ports-1), (3, 70), (40, 90), (0, 50)]:
+            del call_history[:]
+            values = [start*1000+i for i in range(stop-start)]
+            node_data.inPortDataFile.write(start*2, struct.pack('<{:d}H'.format(len(values)), *values))
+            self.assertEqual(call_history, list(zip(range(start, stop), values)))
+         self.assertEqual(compileSpanCodec.call_count, 3) #one codec per chunk, generated by the second write covering the chunk
+         node_data = apx.NodeData(node, detect_changes=True)
+         node_data.nodeDataClient = Listener()
+         node_data.inPortDataFile.write(0, bytes(num_ports*2)) #all ports changed, decoded one by one
+         node_data.inPortDataFile.write(0, struct.pack('<H', 1)+bytes(num_ports*2-4)+struct.pack('<H', 1))
+         node_data.inPortDataFile.write(0, struct.pack('<H', 2)+bytes(num_ports*2-4)+struct.pack('<H', 2))
+         self.assertEqual(call_history[-2:], [(0, 2), (num_ports-1, 2)])
+         self.assertEqual(compileSpanCodec.call_count, 3) #two far apart ports never generate a span codec
+
+   def test_callback_only_changed_ports(self):
+      call_history = []
+
+      @apx.NodeDataClient.register
+      class Listener:
+         def on_require_port_data(self, port, value):
+            call_history.append((port.name, value))
+
+      node = create_node_and_data()
+      node_data = apx.NodeData(node, detect_changes=True)
+      node_data.nodeDataClient = Listener()
+      input_file = node_data.inPortDataFile
+      data = bytearray(input_file.data)
+      input_file.write(0, data) #first write notifies all ports, even when equal to the init data
+      self.assertEqual([name for name, value in call_history], ['RheostatLevelRqst', 'StrSignal', 'RecordSignal'])
+      del call_history[:]
+      input_file.write(0, data)
+      self.assertEqual(call_history, [])
+      self.assertEqual(node_data.notification_stats(), {'notified': 3, 'suppressed': 3})
+      data[9] = ord('x')
+      input_file.write(0, data)
+      self.assertEqual(call_history, [('RecordSignal', {'Name': "x", 'Id': 0xFFFFFFFF, 'Data':[0,0,0]})])
+      self.assertEqual(node_data.notification_stats(), {'notified': 4, 'suppressed': 5})
+      self.assertEqual(node_data.inPortSuppressedCount, [2, 2, 1])
+      self.assertEqual(node_data.inPortNotifyCount, [1, 1, 2])
+      del call_history[:]
+      input_file.open()
+      input_file.write(0, bytes([255]))
+      self.assertEqual(call_history, [('RheostatLevelRqst', 255)])
+      node_data.detect_changes = False
+      input_file.write(0, bytes([255]))
+      self.assertEqual(call_history[-1], ('RheostatLevelRqst', 255))
+      self.assertEqual(len(call_history), 2)
+      node_data = apx.NodeData(node)
+      self.assertFalse(node_data.detect_changes)
+      node_data.nodeDataClient = Listener()
+      node_data.inPortDataFile.write(0, bytes([255]))
+      self.assertEqual(call_history[-1], ('RheostatLevelRqst', 255))
+      node_data.detect_changes = True
+      node_data.inPortDataFile.write(0, bytes([255]))
+      node_data.inPortDataFile.write(0, bytes([255]))
+      self.assertEqual(len(call_history), 4)
+      self.assertEqual(node_data.notification_stats(), {'notified': 2, 'suppressed': 1})
+
+class TestNodeDataBackends(unittest.TestCase):
+
+   def test_read_write_all_backends(self):
+      def check(backend):
+         node = create_node_and_data()
+         node_data = apx.NodeData(node, backend=backend)
+         self.assertEqual(node_data.backend, backend)
+         input_file = node_data.inPortDataFile
+         output_file = node_data.outPortDataFile
+         input_file.write(9, "Abc\0\0\0\0\0".encode('utf-8')+struct.pack('<L',918)+struct.pack('<HHH', 1000, 2000, 4000))
+         self.assertEqual(node_data.read_require_port(node.find('RecordSignal')), {'Name': "Abc", 'Id': 918, 'Data':[1000,2000,4000]})
+         self.assertEqual(node_data.read_require_port(node.find('StrSignal')), "")
+         node_data.write_provide_port(node.find('ComplexRecordSignal'), {"SensorData": dict(x = 1, y =2, z= 3), 'TimeStamp':0})
+         self.assertEqual(output_file.read(7, 10), struct.pack("<HHHL", 1,  2,  3, 0))
+         node_data.write_provide_port(node.find('VehicleSpeed'), 0x1234)
+         self.assertEqual(output_file.read(0, 2), bytes([0x34, 0x12]))
+      for_each_backend(self, check)
+
+   def test_64bit_ports_all_backends(self):
+      def check(backend):
+         for compact_arrays in [False, True]:
+            node = apx.Node('TestNode')
+            node.append(apx.ProvidePort('TimeStamp', 'U', '=0xFFFFFFFFFFFFFFFF'))
+            node.append(apx.RequirePort('Counters', '{"Total"U"Delta"u[2]}', '={1,{-1,2}}'))
+            node_data = apx.NodeData(node, backend=backend, compact_arrays=compact_arrays)
+            self.assertEqual(node_data.outPortDataFile.data, bytearray(b'\xFF'*8))
+            value = node_data.read_require_port(node.find('Counters'))
+            self.assertEqual(value['Total'], 1)
+            self.assertEqual(list(value['Delta']), [-1, 2])
+            node_data.write_provide_port(node.find('TimeStamp'), 0x123456789ABCDEF0)
+            self.assertEqual(node_data.outPortDataFile.data, bytearray(struct.pack('<Q', 0x123456789ABCDEF0)))
+      for_each_backend(self, check)
+
+   def test_raw_strings_all_backends(self):
+      def check(backend):
+         node = apx.Node('TestNode')
+         node.append(apx.ProvidePort('Label', 'a[8]', '=""'))
+         node.append(apx.RequirePort('Diagnostics', '{"Code"S"Text"a[8]}', '={1,"Init"}'))
+         node.append(apx.RequirePort('Names', '{"Name"a[4]}[2]', '={{"a"},{"bc"}}'))
+         node_data = apx.NodeData(node, backend=backend, raw_strings=True)
+         self.assertEqual(node_data.read_require_port(node.find('Diagnostics')), {'Code': 1, 'Text': b'Init'})
+         self.assertEqual(node_data.read_require_port(node.find('Names')), [{'Name': b'a'}, {'Name': b'bc'}])
+         self.assertEqual(node_data.read_require_port_field(node.find('Diagnostics'), 'Text'), b'Init')
+         self.assertEqual(node_data.read_require_ports(), [{'Code': 1, 'Text': b'Init'}, [{'Name': b'a'}, {'Name': b'bc'}]])
+         node_data.write_provide_port(node.find('Label'), b'\xc3\xa5')
+         self.assertEqual(node_data.outPortDataFile.data, bytearray(b'\xc3\xa5'+bytes(6)))
+      for_each_backend(self, check)
+
+   def test_write_bytes_to_string_port_all_backends(self):
+      def check(backend):
+         node = apx.Node('TestNode')
+         node.append(apx.ProvidePort('Label', 'a[4]', '=""'))
+         node.append(apx.ProvidePort('Status', '{"Code"C"Text"a[4]}', '={0,""}'))
+         node_data = apx.NodeData(node, backend=backend)
+         node_data.write_provide_port(node.find('Label'), b'ab')
+         node_data.write_provide_port(node.find('Status'), {'Code': 1, 'Text': bytearray(b'\xc3\xa5')})
+         self.assertEqual(node_data.outPortDataFile.data, bytearray(b'ab\0\0\x01\xc3\xa5\0\0'))
+         node_data.write_provide_port(node.find('Label'), 'cd')
+         self.assertEqual(node_data.outPortDataFile.read(0, 4), b'cd\0\0')
+      for_each_backend(self, check)
+
+   def test_compact_arrays_all_backends(self):
+      def check(backend):
+         node = create_node_and_data()
+         node_data = apx.NodeData(node, backend=backend, compact_arrays=True)
+         node_data.inPortDataFile.write(21, struct.pack("<HHH",18000,2,10))
+         value = node_data.read_require_port(node.find('RecordSignal'))
+         self.assertEqual(value['Data'].typecode, apx.ARRAY_TYPECODE_MAP['H'])
+         self.assertEqual(value['Data'].tolist(), [18000,2,10])
+      for_each_backend(self, check)
+
+   def test_reuse_containers_all_backends(self):
+      def check(backend):
+         node = create_node_and_data()
+         node_data = apx.NodeData(node, backend=backend, reuse_containers=True)
+         port = node.find('RecordSignal')
+         value = node_data.read_require_port(port)
+         data_list = value['Data']
+         node_data.inPortDataFile.write(21, struct.pack("<HHH",18000,2,10))
+         self.assertIs(node_data.read_require_port(port), value)
+         self.assertIs(value['Data'], data_list)
+         self.assertEqual(value['Data'], [18000,2,10])
+         target = {}
+         self.assertIs(node_data.read_require_port(port, target), target)
+         self.assertEqual(target, value)
+      for_each_backend(self, check)
+
+   def test_read_into_target(self):
+      node = create_node_and_data()
+      node_data = apx.NodeData(node)
+      port = node.find('RecordSignal')
+      node_data.inPortDataFile.write(21, struct.pack("<HHH",18000,2,10))
+      target = {'Data': [0, 0, 0]}
+      data_list = target['Data']
+      self.assertIs(node_data.read_require_port(port, target), target)
+      self.assertIs(target['Data'], data_list)
+      self.assertEqual(target, {'Name': "", 'Id': 0xFFFFFFFF, 'Data':[18000,2,10]})
+      self.assertIsNot(node_data.read_require_port(port), target)
+
+   def test_profiling(self):
+      node = create_node_and_data()
+      node_data = apx.NodeData(node, backend=apx.BACKEND_VM)
+      node_data.read_require_port(node.find('StrSignal'))
+      profiler = node_data.enable_profiling()
+      node_data.read_require_port(node.find('RecordSignal'))
+      node_data.read_require_port(node.find('RecordSignal'))
+      node_data.write_provide_port(node.find('VehicleSpeed'), 1)
+      self.assertEqual(sorted((name, count) for name, count, total in profiler.program_stats()),
+                       [('RecordSignal', 2), ('VehicleSpeed', 1)])
+      node_data.disable_profiling()
+      node_data.read_require_port(node.find('RecordSignal'))
+      self.assertEqual(sum(count for name, count, total in profiler.program_stats()), 3)
+
+   def test_lock_not_held_while_decoding(self):
+      node = create_node_and_data()
+      node_data = apx.NodeData(node, backend=apx.BACKEND_VM)
+      lock = node_data.inPortDataFile.dataLock
+      exec_unpack_prog = node_data.vm.exec_unpack_prog
+      def check_unlocked(*args):
+         self.assertFalse(lock.locked())
+         return exec_unpack_prog(*args)
+      with mock.patch.object(node_data.vm, 'exec_unpack_prog', side_effect=check_unlocked) as unpack:
+         node_data.inPortDataFile.write(9, b'Abc\0')
+         self.assertEqual(node_data.read_require_port(2)['Name'], 'Abc')
+         self.assertEqual(unpack.call_count, 1)
+      node_data.read_require_ports()
+      codec = node_data.inPortSpanCodecs[0]
+      span_unpack = codec.unpack
+      def check_span_unlocked(*args):
+         self.assertFalse(lock.locked())
+         return span_unpack(*args)
+      with mock.patch.object(codec, 'unpack', side_effect=check_span_unlocked):
+         self.assertEqual(node_data.read_require_ports()[2]['Name'], 'Abc')
+      self.assertEqual(node_data.read_require_port_field(2, 'Name'), 'Abc')
+
+   def test_vms_of_finished_threads_are_released(self):
+      node = create_node_and_data()
+      node_data = apx.NodeData(node, backend=apx.BACKEND_VM)
+      for i in range(5):
+         thread = threading.Thread(target=node_data.read_require_port, args=(node.find('RecordSignal'),))
+         thread.start()
+         thread.join()
+      gc.collect()
+      self.assertEqual(len(node_data.vms), 0)
+      node_data.read_require_port(node.find('RecordSignal'))
+      self.assertEqual(len(node_data.vms), 1)
+      profiler = node_data.enable_profiling()
+      node_data.read_require_port(node.find('RecordSignal'))
+      self.assertEqual([(name, count) for name, count, total in profiler.program_stats()], [('RecordSignal', 1)])
+
+   def test_backend_codecs(self):
+      node = create_node_and_data()
+      node_data = apx.NodeData(node, backend=apx.BACKEND_VM)
+      self.assertEqual(node_data.inPortCodecs, [None, None, None])
+      node_data = apx.NodeData(node, backend=apx.BACKEND_STRUCT)
+      self.assertIsNone(node_data.outPortCodecs[3]) #nested record
+      self.assertIsInstance(node_data.inPortCodecs[2], apx.StructCodec)
+      node_data = apx.NodeData(node, backend=apx.BACKEND_PYTHON)
+      self.assertIsInstance(node_data.outPortCodecs[3], apx.PyCodec)
+
+   def test_record_array_port_all_backends(self):
+      def check(backend):
+         node = apx.Node('TestNode')
+         node.append(apx.ProvidePort('Tracks','{"Title"a[4]"Length"S}[2]'))
+         node.append(apx.RequirePort('Playlist','{"Id"C"Tracks"{"Title"a[4]"Length"S}[2]}','={1,{{"a",2},{"b",3}}}'))
+         node_data = apx.NodeData(node, backend=backend)
+         self.assertEqual(node_data.read_require_port(node.find('Playlist')),
+                          {'Id': 1, 'Tracks': [{'Title': 'a', 'Length': 2}, {'Title': 'b', 'Length': 3}]})
+         self.assertEqual(node_data.read_require_port_field(node.find('Playlist'), 'Tracks[1].Length'), 3)
+         node_data.write_provide_port(node.find('Tracks'), [{'Title': 'x', 'Length': 0x1234}, {'Title': 'yz', 'Length': 1}])
+         self.assertEqual(node_data.outPortDataFile.data, bytearray(struct.pack('<4sH4sH', b'x', 0x1234, b'yz', 1)))
+      for_each_backend(self, check)
+
+   def test_checked_pack(self):
+      def check(backend):
+         node = apx.Node('TestNode')
+         node.append(apx.ProvidePort('Position', '{"x"S(0,1000)"y"S(0,1000)}', '={0,0}'))
+         node.append(apx.ProvidePort('Data', 'c[2]', '={0,0}'))
+         node_data = apx.NodeData(node, backend=backend, checked_pack=True)
+         node_data.write_provide_port(node.find('Position'), {'x': 1000, 'y': 0})
+         with self.assertRaisesRegex(ValueError, r'^Position\.y: value 1001 is out of range'):
+            node_data.write_provide_port(node.find('Position'), {'x': 1, 'y': 1001})
+         with self.assertRaisesRegex(ValueError, r'^Data\[1\]: value 128 is out of range'):
+            node_data.write_provide_port(node.find('Data'), [-128, 128])
+         self.assertEqual(node_data.outPortDataFile.data, bytearray(struct.pack('<HHbb', 1000, 0, 0, 0)))
+         node_data.checked_pack = False
+         node_data.write_provide_port(node.find('Position'), {'x': 1, 'y': 1001})
+         self.assertEqual(node_data.outPortDataFile.read(0, 4), struct.pack('<HH', 1, 1001))
+      for_each_backend(self, check)
+
+class TestNodeDataCache(unittest.TestCase):
+
+   def test_load_from_cache_all_backends(self):
+      def check(backend):
+         with tempfile.TemporaryDirectory() as cache_dir:
+            node = create_node_and_data()
+            node_data1 = apx.NodeData(node, backend=backend, cache_dir=cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            with mock.patch.object(apx.NodeData, '_createInPortDataFile', side_effect=AssertionError('cache not used')):
+               node_data2 = apx.NodeData(create_node_and_data(), backend=backend, cache_dir=cache_dir)
+            self.assertEqual(node_data2.inPortDataMap, [(elem.data_offset, elem.data_len, node_data2.inPortDataMap[i].port) for i, elem in enumerate(node_data1.inPortDataMap)])
+            self.assertEqual(node_data2.inPortPrograms, node_data1.inPortPrograms)
+            self.assertEqual(node_data2.outPortPrograms, node_data1.outPortPrograms)
+            self.assertEqual(node_data2.inPortDataFile.data, node_data1.inPortDataFile.data)
+            self.assertEqual(node_data2.outPortDataFile.data, node_data1.outPortDataFile.data)
+            self.assertEqual([type(codec) for codec in node_data2.inPortCodecs], [type(codec) for codec in node_data1.inPortCodecs])
+            node = node_data2.node
+            node_data2.inPortDataFile.write(9, "Abc\0\0\0\0\0".encode('utf-8')+struct.pack('<L',918)+struct.pack('<HHH', 1000, 2000, 4000))
+            self.assertEqual(node_data2.read_require_port(node.find('RecordSignal')), {'Name': "Abc", 'Id': 918, 'Data':[1000,2000,4000]})
+            node_data2.write_provide_port(node.find('ComplexRecordSignal'), {"SensorData": dict(x = 1, y =2, z= 3), 'TimeStamp':0})
+            self.assertEqual(node_data2.outPortDataFile.read(7, 10), struct.pack("<HHHL", 1,  2,  3, 0))
+      for_each_backend(self, check)
+
+   def test_python_codec_source_not_cached(self):
+      with tempfile.TemporaryDirectory() as cache_dir:
+         apx.NodeData(create_node_and_data(), backend=apx.BACKEND_PYTHON, cache_dir=cache_dir)
+         path = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+         with open(path, 'r') as fh:
+            document = json.load(fh)
+         spec = document['codecs'][document['in']['ports'][2][3]]
+         self.assertEqual(spec['signature'], '{"Name"a[8]"Id"L"Data"S[3]}')
+         self.assertNotIn('source', spec)
+         spec['format'] = '<B'
+         with open(path, 'w') as fh:
+            json.dump(document, fh)
+         self.assertIsNone(apx.node_cache.load(path))
+         spec['signature'] = '{"Name"a[8]'
+         with open(path, 'w') as fh:
+            json.dump(document, fh)
+         self.assertIsNone(apx.node_cache.load(path))
+
+   def test_load_from_text_skips_parsing(self):
+      apx_text = '\n'.join(['APX/1.2', 'N"TestNode"', 'T"Speed_T"S', 'P"Speed"T["Speed_T"]:=65535',
+                            'R"Left"{"x"S"y"S}:={1,2}', 'R"Right"{"x"S"y"S}:={3,4}', 'R"Mode"C(0,3):=3', ''])
+      with tempfile.TemporaryDirectory() as cache_dir:
+         node_data1 = apx.NodeData(apx_text, cache_dir=cache_dir)
+         with mock.patch.object(apx.Parser, 'loads', side_effect=AssertionError('APX text parsed')):
+            node_data2 = apx.NodeData(apx_text, cache_dir=cache_dir)
+         node = node_data2.node
+         self.assertEqual(node.text, apx_text)
+         self.assertEqual([str(port) for port in node.providePorts+node.requirePorts],
+                          [str(port) for port in node_data1.node.providePorts+node_data1.node.requirePorts])
+         self.assertEqual([port.id for port in node.requirePorts], [0, 1, 2])
+         self.assertIs(node.find('Speed').dsg.dataElement.typeReference, node.find('Speed_T'))
+         self.assertIs(node.find('Left').dsg, node.find('Right').dsg)
+         self.assertIs(node_data2.inPortCodecs[0], node_data2.inPortCodecs[1])
+         self.assertEqual(node_data2.read_require_port(node.find('Right')), {'x': 3, 'y': 4})
+         self.assertEqual(node_data2.outPortDataFile.data, bytearray(struct.pack('<H', 65535)))
+
+   def test_cache_key(self):
+      with tempfile.TemporaryDirectory() as cache_dir:
+         apx.NodeData(create_node_and_data(), cache_dir=cache_dir)
+         apx.NodeData(create_node_and_data(), cache_dir=cache_dir, compact_arrays=True)
+         node = create_node_and_data()
+         node.append(apx.RequirePort('ExtraSignal','S','=0'))
+         node_data = apx.NodeData(node, cache_dir=cache_dir)
+         self.assertEqual(len(os.listdir(cache_dir)), 3)
+         self.assertEqual(node_data.inPortDataMap[-1].data_offset, 27)
+
+   def test_invalid_cache_file(self):
+      with tempfile.TemporaryDirectory() as cache_dir:
+         node = create_node_and_data()
+         node_data = apx.NodeData(node, cache_dir=cache_dir)
+         path = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+         with open(path, 'w') as fh:
+            fh.write('{invalid')
+         node_data = apx.NodeData(create_node_and_data(), cache_dir=cache_dir)
+         self.assertEqual(len(node_data.inPortPrograms), 3)
+         self.assertIsNotNone(apx.node_cache.load(path))
+
 class TestNodeDataWrite(unittest.TestCase):
    
    def test_write_VehicleSpeed(self):
@@ -412,6 +929,99 @@ class TestNodeDataWrite(unittest.TestCase):
       self.assertEqual(output_file.read(signal_offset, signal_length), struct.pack('<i',2147483647))
       node_data.write_provide_port(port, 0)
       self.assertEqual(output_file.read(signal_offset, signal_length), struct.pack('<i', 0))         
+
+   def test_write_many(self):
+      node = create_node_and_data()
+      node_data = apx.NodeData(node)
+      output_file = node_data.outPortDataFile
+      output_file.fileManager = mock.Mock()
+      output_file.open()
+      ranges = node_data.write_many({node.find('VehicleSpeed'): 0x1234, 1: 1,
+                                     node.find('ComplexRecordSignal'): {'SensorData': {'x': 1, 'y': 2, 'z': 3}, 'TimeStamp': 4}})
+      self.assertEqual(ranges, [(0, 3), (7, 10)])
+      self.assertEqual(output_file.fileManager.outPortDataWriteNotify.call_args_list, [mock.call(output_file, 0, 3, False), mock.call(output_file, 7, 10, False)])
+      self.assertEqual(output_file.read(0, 17), struct.pack('<HBLHHHL', 0x1234, 1, 0xFFFFFFFF, 1, 2, 3, 4))
+      self.assertEqual(node_data.read_provide_port(1), 1)
+      output_file.fileManager.reset_mock()
+      self.assertEqual(node_data.write_many({0: 1, 1: 2, 2: 3}), [(0, 7)])
+      self.assertEqual(output_file.fileManager.outPortDataWriteNotify.call_count, 1)
+      self.assertEqual(output_file.read(0, 7), struct.pack('<HBL', 1, 2, 3))
+      self.assertEqual(node_data.write_many({}), [])
+
+   def test_transaction(self):
+      node = create_node_and_data()
+      node_data = apx.NodeData(node)
+      output_file = node_data.outPortDataFile
+      output_file.fileManager = mock.Mock()
+      output_file.open()
+      init_data = bytes(output_file.data)
+      with node_data.transaction() as transaction:
+         node_data.write_provide_port(0, 0x1234)
+         with node_data.transaction():
+            node_data.write_many({2: 7})
+         node_data.write_provide_port(3, {'SensorData': {'x': 1, 'y': 2, 'z': 3}, 'TimeStamp': 4})
+         node_data.write_provide_port(0, 0x5678)
+         self.assertEqual(node_data.read_provide_port(0), 0x5678)
+         self.assertEqual(bytes(output_file.data), init_data)
+         output_file.fileManager.outPortDataWriteNotify.assert_not_called()
+      self.assertEqual(transaction.ranges, [(0, 2), (3, 14)])
+      self.assertEqual(output_file.fileManager.outPortDataWriteNotify.call_args_list, [mock.call(output_file, 0, 2, True), mock.call(output_file, 3, 14, False)])
+      self.assertEqual(output_file.read(0, 17), struct.pack('<HBLHHHL', 0x5678, 3, 7, 1, 2, 3, 4))
+      self.assertEqual(node_data.read_provide_port(0), 0x5678)
+
+   def test_transaction_rollback(self):
+      node = create_node_and_data()
+      node_data = apx.NodeData(node)
+      output_file = node_data.outPortDataFile
+      init_data = bytes(output_file.data)
+      with self.assertRaises(RuntimeError):
+         with node_data.transaction():
+            node_data.write_provide_port(0, 0x1234)
+            raise RuntimeError('abort')
+      self.assertEqual(bytes(output_file.data), init_data)
+      node_data.write_provide_port(0, 0x1234)
+      self.assertEqual(output_file.read(0, 2), struct.pack('<H', 0x1234))
+
+   def test_transaction_round_trip(self):
+      call_history = []
+
+      @apx.NodeDataClient.register
+      class Listener:
+         def on_require_port_data(self, port, value):
+            call_history.append((port.name, value))
+
+      class LoopbackFileManager:
+         def __init__(self, remote_file):
+            self.remote_file = remote_file
+         def outPortDataWriteNotify(self, file, offset, length, more_bit=False):
+            self.remote_file.write(offset, file.read(offset, length), more_bit)
+
+      sender = apx.Node('Sender')
+      receiver = apx.Node('Receiver')
+      for name in ['A', 'B', 'C', 'D']:
+         sender.append(apx.ProvidePort(name, 'C', '=0'))
+         receiver.append(apx.RequirePort(name, 'C', '=0'))
+      sender_data = apx.NodeData(sender)
+      receiver_data = apx.NodeData(receiver)
+      receiver_data.nodeDataClient = Listener()
+      output_file = sender_data.outPortDataFile
+      output_file.fileManager = LoopbackFileManager(receiver_data.inPortDataFile)
+      output_file.open()
+      with sender_data.transaction():
+         sender_data.write_provide_port(0, 5)
+         sender_data.write_provide_port(3, 7)
+         sender_data.write_provide_port(1, 6)
+         self.assertEqual(call_history, [])
+      self.assertEqual(call_history, [('A', 5), ('B', 6), ('D', 7)])
+
+   def test_write_many_is_all_or_nothing(self):
+      node = apx.Node('TestNode')
+      node.append(apx.ProvidePort('Speed', 'S(0,1000)', '=0'))
+      node.append(apx.ProvidePort('Level', 'C(0,3)', '=0'))
+      node_data = apx.NodeData(node, checked_pack=True)
+      with self.assertRaisesRegex(ValueError, r'^Level: value 4 is out of range'):
+         node_data.write_many({0: 100, 1: 4})
+      self.assertEqual(node_data.outPortDataFile.data, bytearray(3))
       
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
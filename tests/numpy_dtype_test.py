@@ -0,0 +1,66 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import apx
+import unittest
+import struct
+try:
+   import numpy
+except ImportError:
+   numpy = None
+
+def create_node():
+   node = apx.Node('TestNode')
+   node.add_type(apx.DataType('Speed_T','S'))
+   node.append(apx.RequirePort('RheostatLevelRqst','C','=255'))
+   node.append(apx.RequirePort('StrSignal','a[8]','=""'))
+   node.append(apx.RequirePort('RecordSignal','{"Name"a[8]"Id"L"Data"S[3]}','={"",0xFFFFFFFF,{0,0,0}}'))
+   node.append(apx.RequirePort('Speed','T["Speed_T"]','=0'))
+   return node
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class TestNumpyDtype(unittest.TestCase):
+
+   def test_scalar_and_array(self):
+      self.assertEqual(apx.numpy_dtype.numpy_dtype(apx.DataSignature('S')), numpy.dtype('<u2'))
+      self.assertEqual(apx.numpy_dtype.numpy_dtype(apx.DataSignature('c')), numpy.dtype('i1'))
+      self.assertEqual(apx.numpy_dtype.numpy_dtype(apx.DataSignature('l[4]')), numpy.dtype(('<i4', (4,))))
+      self.assertEqual(apx.numpy_dtype.numpy_dtype(apx.DataSignature('a[10]')), numpy.dtype('S10'))
+
+   def test_record(self):
+      dtype = apx.numpy_dtype.numpy_dtype(apx.DataSignature('{"Name"a[8]"Id"L"Data"S[3]}'))
+      self.assertEqual(dtype.names, ('Name', 'Id', 'Data'))
+      self.assertEqual(dtype.itemsize, 18)
+      self.assertEqual(dtype.fields['Id'][1], 8)
+
+   def test_in_port_view(self):
+      node = create_node()
+      node_data = apx.NodeData(node)
+      dtype = node_data.in_port_dtype()
+      self.assertEqual(dtype.names, ('RheostatLevelRqst', 'StrSignal', 'RecordSignal', 'Speed'))
+      self.assertEqual(dtype.itemsize, len(node_data.inPortDataFile.data))
+      view = node_data.in_port_view()
+      self.assertEqual(view.RheostatLevelRqst[0], 255)
+      self.assertEqual(view.RecordSignal[0]['Id'], 0xFFFFFFFF)
+      #view is zero-copy
+      node_data.inPortDataFile.write(9, "Abc\0\0\0\0\0".encode('utf-8')+struct.pack('<L',918)+struct.pack('<HHH', 1000, 2000, 4000))
+      self.assertEqual(view.RecordSignal[0]['Name'], b'Abc')
+      self.assertEqual(view.RecordSignal[0]['Id'], 918)
+      self.assertEqual(list(view.RecordSignal[0]['Data']), [1000, 2000, 4000])
+
+   def test_snapshot_stack(self):
+      node = create_node()
+      node_data = apx.NodeData(node)
+      snapshots = bytearray()
+      for i in range(3):
+         node_data.inPortDataFile.write(0, bytes([i]))
+         node_data.inPortDataFile.write(27, struct.pack('<H', i*100))
+         snapshots.extend(node_data.inPortDataFile.data)
+      view = node_data.in_port_view(snapshots)
+      self.assertEqual(len(view), 3)
+      self.assertEqual(list(view.RheostatLevelRqst), [0, 1, 2])
+      self.assertEqual(list(view.Speed), [0, 100, 200])
+      with self.assertRaises(ValueError):
+         node_data.in_port_view(snapshots[:-1])
+
+if __name__ == '__main__':
+   unittest.main()
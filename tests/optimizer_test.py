@@ -0,0 +1,94 @@
+import os, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import apx
+import unittest
+import struct
+
+class TestOptimizer(unittest.TestCase):
+
+   def test_merge_fields(self):
+      dataElement = apx.DataSignature('{"SoundId"S"Volume"S"Repetitions"S"Name"a[4]}').dataElement
+      prog = apx.Compiler(optimize=True).compileUnpackProg(dataElement)
+      expected = bytes([apx.OPCODE_UNPACK_PROG, 10,0,0,0, apx.OPCODE_KEY_TABLE, 4]) + 'SoundId\0Volume\0Repetitions\0Name\0'.encode('ascii')
+      expected += bytes([apx.OPCODE_RECORD_ENTER,
+                         apx.OPCODE_UNPACK_FIELDS, apx.OPCODE_UNPACK_U16, 3, 0,
+                         apx.OPCODE_RECORD_SELECT_KEY, 3, apx.OPCODE_UNPACK_STR, 4,0])
+      self.assertEqual(prog, expected)
+
+   def test_pack_program(self):
+      dataElement = apx.DataSignature('{"x"S"y"S"Valid"C}').dataElement
+      prog = apx.Compiler(optimize=True).compilePackProg(dataElement)
+      expected = bytes([apx.OPCODE_PACK_PROG, 5,0,0,0, apx.OPCODE_KEY_TABLE, 3]) + 'x\0y\0Valid\0'.encode('ascii')
+      expected += bytes([apx.OPCODE_RECORD_ENTER,
+                         apx.OPCODE_PACK_FIELDS, apx.OPCODE_PACK_U16, 2, 0,
+                         apx.OPCODE_RECORD_SELECT_KEY, 2, apx.OPCODE_PACK_U8])
+      self.assertEqual(prog, expected)
+
+   def test_non_record_program_unchanged(self):
+      for dataElement in [apx.DataElement.UInt8(), apx.DataElement.SInt32(arrayLen=3), apx.DataElement.String(arrayLen=5)]:
+         self.assertEqual(apx.Compiler(optimize=True).compileUnpackProg(dataElement), apx.Compiler().compileUnpackProg(dataElement))
+
+   def test_remove_empty_records(self):
+      prog = bytes([apx.OPCODE_PACK_PROG, 1,0,0,0, apx.OPCODE_RECORD_ENTER, apx.OPCODE_RECORD_SELECT]) + 'Empty\0'.encode('ascii')
+      prog += bytes([apx.OPCODE_RECORD_ENTER, apx.OPCODE_RECORD_LEAVE, apx.OPCODE_RECORD_SELECT]) + 'Id\0'.encode('ascii')
+      prog += bytes([apx.OPCODE_PACK_U8, apx.OPCODE_RECORD_LEAVE])
+      expected = bytes([apx.OPCODE_PACK_PROG, 1,0,0,0, apx.OPCODE_KEY_TABLE, 1]) + 'Id\0'.encode('ascii')
+      expected += bytes([apx.OPCODE_RECORD_ENTER, apx.OPCODE_RECORD_SELECT_KEY, 0, apx.OPCODE_PACK_U8])
+      self.assertEqual(apx.optimizer.optimize_program(prog), expected)
+
+   def test_same_result_as_unoptimized(self):
+      dataElement = apx.DataSignature('{"Name"a[8]"Id"L"Data"S[3]"a"s"b"s"c"C}').dataElement
+      data = bytearray(struct.pack('<8sLHHHhhB', b'Abc', 918, 1, 2, 3, -1, -2, 255))
+      vm = apx.VM()
+      unpack_prog = apx.Compiler().compileUnpackProg(dataElement)
+      optimized_unpack_prog = apx.Compiler(optimize=True).compileUnpackProg(dataElement)
+      value = vm.exec_unpack_prog(unpack_prog, data, 0)
+      self.assertEqual(vm.exec_unpack_prog(optimized_unpack_prog, data, 0), value)
+      self.assertLess(len(vm.load_program(optimized_unpack_prog).instructions), len(vm.load_program(unpack_prog).instructions))
+      self.assertEqual(vm.exec_unpack_many(optimized_unpack_prog, data+data, len(data)), [value, value])
+      packed = bytearray(len(data))
+      vm.exec_pack_prog(apx.Compiler(optimize=True).compilePackProg(dataElement), packed, 0, value)
+      self.assertEqual(packed, data)
+
+   def test_key_table_reuses_keys(self):
+      dataElement = apx.DataSignature('{"a"C"b"S"a"C}').dataElement
+      prog = apx.Compiler(optimize=True).compileUnpackProg(dataElement)
+      self.assertEqual(prog[5:11], bytes([apx.OPCODE_KEY_TABLE, 2])+'a\0b\0'.encode('ascii'))
+      self.assertEqual(prog[11:], bytes([apx.OPCODE_RECORD_ENTER, apx.OPCODE_RECORD_SELECT_KEY, 0, apx.OPCODE_UNPACK_U8,
+                                         apx.OPCODE_RECORD_SELECT_KEY, 1, apx.OPCODE_UNPACK_U16,
+                                         apx.OPCODE_RECORD_SELECT_KEY, 0, apx.OPCODE_UNPACK_U8]))
+
+   def test_unrolled_record_array_shorter(self):
+      vm = apx.VM()
+      for signature, arrayLen in [('{"a"C"b"C}', 100), ('{"a"C"b"S"c"C}', 60), ('{"Id"C"Pos"{"x"S"y"S}}', 300)]:
+         record = apx.Compiler().compileUnpackProg(apx.DataSignature(signature).dataElement)
+         packLen = apx.DataSignature(signature).packLen()*arrayLen
+         prog = bytes([apx.OPCODE_UNPACK_PROG])+struct.pack('<L', packLen)+bytes([apx.OPCODE_ARRAY_ENTER])+record[5:]*arrayLen+bytes([apx.OPCODE_ARRAY_LEAVE])
+         optimized_prog = apx.optimizer.optimize_program(prog)
+         self.assertLess(len(optimized_prog), len(prog), signature)
+         data = bytearray(i & 0x7F for i in range(packLen))
+         self.assertEqual(vm.exec_unpack_prog(optimized_prog, data, 0), vm.exec_unpack_prog(prog, data, 0), signature)
+
+   def test_record_array_program_length(self):
+      vm = apx.VM()
+      for signature in ['{"a"C"b"S"c"C}', '{"Id"L"Pos"{"x"S"y"S}"Name"a[4]}']:
+         for compiler in [apx.Compiler(), apx.Compiler(optimize=True)]:
+            self.assertEqual(len(compiler.compileUnpackProg(apx.DataSignature(signature+'[300]').dataElement)),
+                             len(compiler.compileUnpackProg(apx.DataSignature(signature+'[2]').dataElement)), signature)
+         dataSignature = apx.DataSignature(signature+'[300]')
+         data = bytearray(i % 0x7F + 1 for i in range(dataSignature.packLen())) #no NUL bytes, strings unpack to their full length
+         value = vm.exec_unpack_prog(apx.Compiler().compileUnpackProg(dataSignature.dataElement), data, 0)
+         self.assertEqual(len(value), 300)
+         self.assertEqual(vm.exec_unpack_prog(apx.Compiler(optimize=True).compileUnpackProg(dataSignature.dataElement), data, 0), value)
+         packed = bytearray(len(data))
+         vm.exec_pack_prog(apx.Compiler(optimize=True).compilePackProg(dataSignature.dataElement), packed, 0, value)
+         self.assertEqual(packed, data)
+
+   def test_invalid_program(self):
+      with self.assertRaises(apx.InvalidInstructionError):
+         apx.optimizer.optimize_program(bytes([apx.OPCODE_UNPACK_U8]))
+      with self.assertRaises(apx.InvalidInstructionError):
+         apx.optimizer.optimize_program(bytes([apx.OPCODE_UNPACK_PROG, 1,0,0,0, apx.OPCODE_RECORD_SELECT, 0x41]))
+
+if __name__ == '__main__':
+   unittest.main()
@@ -622,6 +622,23 @@ class TestVmUnpackState(unittest.TestCase):
         self.assertEqual(data_offset, 14)
         self.assertEqual(st.value, '')
     
+    def test_unpack_str_raw(self):
+        st = apx.VmUnpackState(raw_strings=True)
+        data = memoryview(bytearray('Hello\0World'.encode('utf-8')))
+        data_offset = st.unpack_str(data, 0, 6)
+        self.assertEqual(data_offset, 6)
+        self.assertEqual(st.value, b'Hello')
+        data_offset = st.unpack_str(data, data_offset, 5)
+        self.assertEqual(data_offset, 11)
+        self.assertEqual(st.value, b'World')
+
+    def test_pack_str_from_bytes(self):
+        st = apx.VmPackState()
+        data = bytearray(8)
+        st.value = b'Hi\xff'
+        self.assertEqual(st.pack_str(data, 0, 5), 5)
+        self.assertEqual(data, bytearray(b'Hi\xff\0\0\0\0\0'))
+
     def test_unpack_str_in_record(self):
         st = apx.VmUnpackState()
         data = bytearray(bytes([14,0])+"Selection\0".encode('utf-8')+bytes([0]))
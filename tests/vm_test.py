@@ -1,8 +1,9 @@
-import os, sys
+import os, sys, io
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import apx
 import unittest
 import struct
+import array
 
 class TestApxVM(unittest.TestCase):
 
@@ -366,6 +367,34 @@ class TestApxVM(unittest.TestCase):
         self.assertEqual(vm.value, 0xFFFFFFFF)
         self.assertEqual(vm.data_offset, 12)
 
+    def test_exec_pack_unpack_64bit(self):
+        vm = apx.VM()
+        data = bytearray(16)
+        vm.init_pack_prog(value=0x123456789ABCDEF0, data_len=len(data), data=data, data_offset=0)
+        vm.exec_instruction(vm.exec_pack_u64, None)
+        vm.value = -2
+        vm.exec_instruction(vm.exec_pack_s64, None)
+        self.assertEqual(data, bytearray(struct.pack('<Qq', 0x123456789ABCDEF0, -2)))
+        vm.init_unpack_prog(len(data), data, 0)
+        vm.exec_instruction(vm.exec_unpack_u64, None)
+        self.assertEqual(vm.value, 0x123456789ABCDEF0)
+        vm.exec_instruction(vm.exec_unpack_s64, None)
+        self.assertEqual(vm.value, -2)
+        self.assertEqual(vm.data_offset, 16)
+
+    def test_exec_64bit_programs(self):
+        dataElement = apx.DataSignature('{"TimeStamp"U"Counter"u"Offsets"u[2]"Id"C}').dataElement
+        value = {'TimeStamp': 0xFFFFFFFFFFFFFFFF, 'Counter': -9223372036854775808, 'Offsets': [-1, 1], 'Id': 7}
+        data = bytearray(33)
+        vm = apx.VM()
+        for compiler in [apx.Compiler(), apx.Compiler(optimize=True)]:
+            vm.exec_pack_prog(compiler.compilePackProg(dataElement), data, 0, value)
+            self.assertEqual(data, bytearray(struct.pack('<Qq2qB', 0xFFFFFFFFFFFFFFFF, -9223372036854775808, -1, 1, 7)))
+            self.assertEqual(vm.exec_unpack_prog(compiler.compileUnpackProg(dataElement), data, 0), value)
+        prog = apx.Compiler(optimize=True).compileUnpackProg(apx.DataSignature('{"a"U"b"U}').dataElement)
+        self.assertIn(bytes([apx.OPCODE_UNPACK_FIELDS, apx.OPCODE_UNPACK_U64, 2, 0]), prog)
+        self.assertEqual(vm.exec_unpack_prog(prog, bytearray(struct.pack('<QQ', 1, 2)), 0), {'a': 1, 'b': 2})
+
     def test_exec_pack_s8(self):
         vm = apx.VM()
         data = bytearray(4)
@@ -579,6 +608,23 @@ class TestApxVM(unittest.TestCase):
         self.assertEqual(vm.value, [-100000, 100000])
         self.assertEqual(vm.data_offset, 8)
 
+    def test_exec_unpack_u16_array_compact(self):
+        vm = apx.VM(compact_arrays=True)
+        data = bytearray([0x0A,0, 0x34,0x12, 0xFF,0xFF, 22,0])
+        vm.init_unpack_prog(len(data), data, 0)
+        vm.exec_instruction(vm.exec_unpack_u16, [4])
+        self.assertIsInstance(vm.value, array.array)
+        self.assertEqual(vm.value.itemsize, 2)
+        self.assertEqual(vm.value.tolist(), [0x0A,0x1234,65535,22])
+        self.assertEqual(vm.data_offset, 8)
+
+    def test_exec_pack_s32_array_from_array(self):
+        vm = apx.VM()
+        data = bytearray(8)
+        vm.init_pack_prog(value=array.array('i', [-100000, 100000]), data_len=len(data), data=data, data_offset=0)
+        vm.exec_instruction(vm.exec_pack_s32, [2])
+        self.assertEqual(data, bytearray([0x60,0x79,0xfe,0xff, 0xa0, 0x86,0x01,0x00]))
+
     def test_exec_pack_str(self):
         vm = apx.VM()
         data = bytearray(8)
@@ -594,6 +640,14 @@ class TestApxVM(unittest.TestCase):
         self.assertEqual(vm.value, 'Hello')
         self.assertEqual(vm.data_offset, 6)
     
+    def test_exec_unpack_str_memoryview(self):
+        vm = apx.VM()
+        data = memoryview(bytearray('xHello\0'.encode('utf-8')))
+        vm.init_unpack_prog(6, data, 1)
+        vm.exec_instruction(vm.exec_unpack_str, [6])
+        self.assertEqual(vm.value, 'Hello')
+        self.assertEqual(vm.data_offset, 7)
+
     def test_exec_pack_prog_u8(self):
         prog = bytes([apx.OPCODE_PACK_PROG, 1,0,0,0, apx.OPCODE_PACK_U8])
         data = bytearray(1)
@@ -628,5 +682,194 @@ class TestApxVM(unittest.TestCase):
         self.assertEqual(vm.value, {'SoundId': 63, 'Volume': 12})
         self.assertEqual(vm.data_offset, 3)    
 
+    def test_load_program_record(self):
+        prog = bytes([apx.OPCODE_UNPACK_PROG, 3,0,0,0, apx.OPCODE_RECORD_ENTER, apx.OPCODE_RECORD_SELECT])+'SoundId\0'.encode('ascii')
+        prog += bytes([apx.OPCODE_UNPACK_U16,apx.OPCODE_RECORD_SELECT])+'Volume\0'.encode('ascii')+bytes([apx.OPCODE_UNPACK_U8, apx.OPCODE_RECORD_LEAVE])
+        vm = apx.VM()
+        program = vm.load_program(prog)
+        self.assertIsInstance(program, apx.VmProgram)
+        self.assertEqual(program.prog_type, apx.UNPACK_PROG)
+        self.assertEqual(program.data_len, 3)
+        self.assertEqual(program.instructions, [(vm.exec_unpack_prog_instruction, (3,)),
+                                                (vm.exec_record_enter, ()),
+                                                (vm.exec_record_select, ('SoundId',)),
+                                                (vm.exec_unpack_u16, ()),
+                                                (vm.exec_record_select, ('Volume',)),
+                                                (vm.exec_unpack_u8, ()),
+                                                (vm.exec_record_leave, ())])
+        self.assertIs(vm.load_program(prog), program)
+        self.assertIs(vm.load_program(bytearray(prog)), program)
+
+    def test_exec_prog_decoded_once(self):
+        prog = bytes([apx.OPCODE_UNPACK_PROG, 2,0,0,0, apx.OPCODE_UNPACK_U8AR, 2,0])
+        vm = apx.VM()
+        decode_count = 0
+        decode_program = vm.decode_program
+        def counting_decode_program(code):
+            nonlocal decode_count
+            decode_count+=1
+            return decode_program(code)
+        vm.decode_program = counting_decode_program
+        self.assertEqual(vm.exec_unpack_prog(prog, bytearray([1,2]), 0), [1,2])
+        self.assertEqual(vm.exec_unpack_prog(prog, bytearray([3,4]), 0), [3,4])
+        self.assertEqual(decode_count, 1)
+
+    def test_exec_unpack_many_stride(self):
+        prog = bytes([apx.OPCODE_UNPACK_PROG, 2,0,0,0, apx.OPCODE_UNPACK_U16])
+        data = bytearray([1,0, 2,0, 0xFF,0xFF, 0x34,0x12])
+        vm = apx.VM()
+        self.assertEqual(vm.exec_unpack_many(prog, data, 2), [1, 2, 65535, 0x1234])
+        self.assertEqual(vm.exec_unpack_many(prog, data, 4), [1, 65535])
+        self.assertEqual(vm.exec_unpack_many(prog, data, [6, 0]), [0x1234, 1])
+        with self.assertRaises(RuntimeError):
+            vm.exec_unpack_many(prog, data, [7])
+        with self.assertRaises(ValueError):
+            vm.exec_unpack_many(prog, data, 0)
+        with self.assertRaises(ValueError):
+            vm.exec_unpack_many(prog, data, [0, -2])
+
+    def test_exec_unpack_many_record(self):
+        prog = bytes([apx.OPCODE_UNPACK_PROG, 3,0,0,0, apx.OPCODE_RECORD_ENTER, apx.OPCODE_RECORD_SELECT])+'SoundId\0'.encode('ascii')
+        prog += bytes([apx.OPCODE_UNPACK_U16,apx.OPCODE_RECORD_SELECT])+'Volume\0'.encode('ascii')+bytes([apx.OPCODE_UNPACK_U8, apx.OPCODE_RECORD_LEAVE])
+        data = bytearray([63,0,12, 64,0,13, 65,0,14])
+        vm = apx.VM()
+        self.assertEqual(vm.exec_unpack_many(prog, data, 3), [{'SoundId': 63, 'Volume': 12},
+                                                             {'SoundId': 64, 'Volume': 13},
+                                                             {'SoundId': 65, 'Volume': 14}])
+        self.assertEqual(vm.exec_unpack_many(prog, data, 3, columns=True), {'SoundId': [63, 64, 65], 'Volume': [12, 13, 14]})
+        self.assertEqual(vm.exec_unpack_many(prog, data, [], columns=True), {})
+
+    def test_exec_unpack_many_columns_with_array_field(self):
+        prog = bytes([apx.OPCODE_UNPACK_PROG, 3,0,0,0, apx.OPCODE_RECORD_ENTER, apx.OPCODE_RECORD_SELECT])+'Id\0'.encode('ascii')
+        prog += bytes([apx.OPCODE_UNPACK_U8,apx.OPCODE_RECORD_SELECT])+'Data\0'.encode('ascii')+bytes([apx.OPCODE_UNPACK_U8AR, 2,0, apx.OPCODE_RECORD_LEAVE])
+        data = bytearray([1,10,11, 2,20,21, 3,30,31])
+        vm = apx.VM()
+        result = vm.exec_unpack_many(prog, data, 3, columns=True)
+        self.assertEqual(result, {'Id': [1, 2, 3], 'Data': [[10,11], [20,21], [30,31]]})
+        self.assertIsNot(result['Data'][0], result['Data'][1])
+        self.assertEqual(vm.exec_unpack_many(prog, data, [6, 0], columns=True), {'Id': [3, 1], 'Data': [[30,31], [10,11]]})
+
+    def test_exec_unpack_many_array(self):
+        prog = bytes([apx.OPCODE_UNPACK_PROG, 2,0,0,0, apx.OPCODE_UNPACK_U8AR, 2,0])
+        data = bytearray([1,2,0, 3,4,0])
+        vm = apx.VM()
+        self.assertEqual(vm.exec_unpack_many(prog, data, 3), [[1,2], [3,4]])
+        with self.assertRaises(ValueError):
+            vm.exec_unpack_many(prog, data, 3, columns=True)
+
+    def test_profiling(self):
+        prog = bytes([apx.OPCODE_UNPACK_PROG, 3,0,0,0, apx.OPCODE_RECORD_ENTER, apx.OPCODE_RECORD_SELECT])+'SoundId\0'.encode('ascii')
+        prog += bytes([apx.OPCODE_UNPACK_U16,apx.OPCODE_RECORD_SELECT])+'Volume\0'.encode('ascii')+bytes([apx.OPCODE_UNPACK_U8, apx.OPCODE_RECORD_LEAVE])
+        vm = apx.VM()
+        self.assertIsNone(vm.profiler)
+        ticks = iter(range(1000))
+        profiler = vm.enable_profiling(apx.VmProfiler(timer=lambda: next(ticks)))
+        profiler.set_label(prog, 'SoundRequest')
+        data = bytearray([63,0,12, 64,0,13])
+        self.assertEqual(vm.exec_unpack_prog(prog, data, 0), {'SoundId': 63, 'Volume': 12})
+        self.assertEqual(vm.exec_unpack_many(prog, data, 3), [{'SoundId': 63, 'Volume': 12}, {'SoundId': 64, 'Volume': 13}])
+        opcode_stats = {name: (count, total) for name, count, total in profiler.opcode_stats()}
+        self.assertEqual(opcode_stats['OPCODE_UNPACK_PROG'], (1, 1))
+        self.assertEqual(opcode_stats['OPCODE_RECORD_SELECT'], (6, 6))
+        self.assertEqual(opcode_stats['OPCODE_UNPACK_U8'], (3, 3))
+        self.assertEqual(profiler.program_stats()[0][0:2], ('SoundRequest', 3))
+        self.assertEqual(profiler.opcode_stats()[0][0], 'OPCODE_RECORD_SELECT')
+        output = io.StringIO()
+        profiler.report(output)
+        self.assertIn('OPCODE_RECORD_SELECT', output.getvalue())
+        self.assertIn('SoundRequest', output.getvalue())
+        vm.disable_profiling()
+        vm.exec_unpack_prog(prog, data, 0)
+        self.assertEqual(profiler.program_stats()[0][1], 3)
+
+    def test_exec_unpack_prog_into_target(self):
+        prog = bytes([apx.OPCODE_UNPACK_PROG, 5,0,0,0, apx.OPCODE_RECORD_ENTER, apx.OPCODE_RECORD_SELECT])+'Id\0'.encode('ascii')
+        prog += bytes([apx.OPCODE_UNPACK_U8,apx.OPCODE_RECORD_SELECT])+'Data\0'.encode('ascii')+bytes([apx.OPCODE_UNPACK_U16AR, 2,0, apx.OPCODE_RECORD_LEAVE])
+        vm = apx.VM()
+        target = vm.exec_unpack_prog(prog, bytearray([1, 2,0, 3,0]), 0)
+        data_list = target['Data']
+        value = vm.exec_unpack_prog(prog, bytearray([4, 5,0, 6,0]), 0, target)
+        self.assertIs(value, target)
+        self.assertIs(value['Data'], data_list)
+        self.assertEqual(value, {'Id': 4, 'Data': [5, 6]})
+        array_prog = bytes([apx.OPCODE_UNPACK_PROG, 2,0,0,0, apx.OPCODE_UNPACK_U8AR, 2,0])
+        target = [0, 0]
+        self.assertIs(vm.exec_unpack_prog(array_prog, bytearray([7, 8]), 0, target), target)
+        self.assertEqual(target, [7, 8])
+        self.assertEqual(vm.exec_unpack_prog(array_prog, bytearray([7, 8]), 0, [0]), [7, 8])
+
+    def test_load_optimized_program(self):
+        prog = bytes([apx.OPCODE_UNPACK_PROG, 5,0,0,0, apx.OPCODE_KEY_TABLE, 3])+'x\0y\0Valid\0'.encode('ascii')
+        prog += bytes([apx.OPCODE_RECORD_ENTER, apx.OPCODE_UNPACK_FIELDS, apx.OPCODE_UNPACK_U16, 2, 0,
+                       apx.OPCODE_RECORD_SELECT_KEY, 2, apx.OPCODE_UNPACK_U8])
+        vm = apx.VM()
+        program = vm.load_program(prog)
+        self.assertEqual(program.opcodes, [apx.OPCODE_UNPACK_PROG, apx.OPCODE_RECORD_ENTER, apx.OPCODE_UNPACK_FIELDS,
+                                           apx.OPCODE_RECORD_SELECT_KEY, apx.OPCODE_UNPACK_U8])
+        self.assertEqual(program.instructions[3], (vm.exec_record_select, ('Valid',)))
+        self.assertEqual(vm.exec_unpack_prog(prog, bytearray([1,0, 2,0, 1]), 0), {'x': 1, 'y': 2, 'Valid': 1})
+        with self.assertRaises(apx.InvalidInstructionError):
+            vm.load_program(bytes([apx.OPCODE_UNPACK_PROG, 1,0,0,0, apx.OPCODE_RECORD_ENTER, apx.OPCODE_RECORD_SELECT_KEY, 0, apx.OPCODE_UNPACK_U8]))
+        with self.assertRaises(apx.InvalidInstructionError):
+            vm.load_program(bytes([apx.OPCODE_PACK_PROG, 1,0,0,0, apx.OPCODE_KEY_TABLE, 1])+'x\0'.encode('ascii')+
+                            bytes([apx.OPCODE_PACK_FIELDS, apx.OPCODE_UNPACK_U8, 1, 0]))
+
+    def test_load_record_array_program(self):
+        record = bytes([apx.OPCODE_RECORD_ENTER, apx.OPCODE_RECORD_SELECT])+'Id\0'.encode('ascii')+bytes([apx.OPCODE_UNPACK_U8, apx.OPCODE_RECORD_LEAVE])
+        prog = bytes([apx.OPCODE_UNPACK_PROG, 3,0,0,0, apx.OPCODE_RECORD_ARRAY, 3,0])+record+bytes([apx.OPCODE_ARRAY_LEAVE])
+        vm = apx.VM()
+        program = vm.load_program(prog)
+        self.assertEqual(program.opcodes, [apx.OPCODE_UNPACK_PROG, apx.OPCODE_RECORD_ARRAY])
+        instruction, args = program.instructions[1]
+        self.assertEqual(instruction, vm.exec_record_array)
+        self.assertEqual(args[0], 3)
+        self.assertEqual(len(args[1]), 4) #the record body is only decoded once
+        self.assertEqual(vm.exec_unpack_prog(prog, bytearray([1, 2, 3]), 0), [{'Id': 1}, {'Id': 2}, {'Id': 3}])
+        unrolled_prog = bytes([apx.OPCODE_UNPACK_PROG, 3,0,0,0, apx.OPCODE_ARRAY_ENTER])+record*3+bytes([apx.OPCODE_ARRAY_LEAVE])
+        self.assertEqual(vm.exec_unpack_prog(unrolled_prog, bytearray([1, 2, 3]), 0), [{'Id': 1}, {'Id': 2}, {'Id': 3}])
+        with self.assertRaises(apx.InvalidInstructionError):
+            vm.load_program(bytes([apx.OPCODE_UNPACK_PROG, 3,0,0,0, apx.OPCODE_RECORD_ARRAY, 3,0])+record)
+        with self.assertRaises(apx.InvalidInstructionError):
+            vm.load_program(bytes([apx.OPCODE_UNPACK_PROG, 3,0,0,0, apx.OPCODE_RECORD_ARRAY, 3]))
+
+    def test_exec_nested_records_and_record_arrays(self):
+        dataElement = apx.DataSignature('{"Count"C"Items"{"Id"S"Pos"{"x"s"y"s}}[2]"Name"a[4]}').dataElement
+        value = {'Count': 2, 'Items': [{'Id': 1, 'Pos': {'x': -2, 'y': 3}}, {'Id': 4, 'Pos': {'x': 5, 'y': -6}}], 'Name': 'ab'}
+        data = bytearray(1+2*6+4)
+        vm = apx.VM()
+        for compiler in [apx.Compiler(), apx.Compiler(optimize=True)]:
+            vm.exec_pack_prog(compiler.compilePackProg(dataElement), data, 0, value)
+            self.assertEqual(data, bytearray(struct.pack('<BHhhHhh4s', 2, 1, -2, 3, 4, 5, -6, b'ab')))
+            self.assertEqual(vm.exec_unpack_prog(compiler.compileUnpackProg(dataElement), data, 0), value)
+            self.assertEqual(vm.state.depth, 0)
+
+    def test_exec_unpack_record_array_into_target(self):
+        dataElement = apx.DataSignature('{"Items"{"Id"C"Pos"{"x"C}}[2]}').dataElement
+        prog = apx.Compiler().compileUnpackProg(dataElement)
+        vm = apx.VM()
+        target = vm.exec_unpack_prog(prog, bytearray([1, 2, 3, 4]), 0)
+        items = target['Items']
+        first_item = items[0]
+        first_pos = first_item['Pos']
+        self.assertIs(vm.exec_unpack_prog(prog, bytearray([5, 6, 7, 8]), 0, target), target)
+        self.assertIs(target['Items'], items)
+        self.assertIs(items[0], first_item)
+        self.assertIs(first_item['Pos'], first_pos)
+        self.assertEqual(target, {'Items': [{'Id': 5, 'Pos': {'x': 6}}, {'Id': 7, 'Pos': {'x': 8}}]})
+        items.append({'Id': 0})
+        vm.exec_unpack_prog(prog, bytearray([5, 6, 7, 8]), 0, target)
+        self.assertEqual(len(items), 2)
+
+    def test_exec_prog_wrong_program_type(self):
+        vm = apx.VM()
+        pack_prog = bytes([apx.OPCODE_PACK_PROG, 1,0,0,0, apx.OPCODE_PACK_U8])
+        unpack_prog = bytes([apx.OPCODE_UNPACK_PROG, 1,0,0,0, apx.OPCODE_UNPACK_U8])
+        with self.assertRaises(RuntimeError):
+            vm.exec_unpack_prog(pack_prog, bytearray(1), 0)
+        with self.assertRaises(RuntimeError):
+            vm.exec_pack_prog(unpack_prog, bytearray(1), 0, 1)
+        with self.assertRaises(apx.InvalidInstructionError):
+            vm.load_program(bytes([apx.OPCODE_UNPACK_U8]))
+
 if __name__ == '__main__':
     unittest.main()